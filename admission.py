@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+
+class OverloadedError(Exception):
+    """Raised when a request is shed because the endpoint's wait queue is full"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Concurrency limit with a bounded wait queue for one group of endpoints
+
+    At most max_concurrency requests run at once and at most queue_limit
+    more wait for a slot, each for up to max_wait_seconds. Anything beyond
+    that is shed immediately instead of slowing every request down. The
+    limits can be changed while the server is running.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, queue_limit: int, max_wait_seconds: float = 30.0, retry_after_seconds: int = 5):
+        """
+        Args:
+            name: Name of the endpoint group, used in metrics and messages
+            max_concurrency: Requests processed at once
+            queue_limit: Requests allowed to wait for a free slot
+            max_wait_seconds: Longest a request may wait before it is shed
+            retry_after_seconds: Retry-After sent with shed requests
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.queue_limit = queue_limit
+        self.max_wait_seconds = max_wait_seconds
+        self.retry_after_seconds = retry_after_seconds
+
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.total_wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """
+        Hold a slot for the duration of the block
+
+        Raises:
+            OverloadedError: If the wait queue is full or the wait took too long
+        """
+        start_time = time.perf_counter()
+        if self.active >= self.max_concurrency or self._waiters:
+            if len(self._waiters) >= self.queue_limit:
+                self.shed += 1
+                raise OverloadedError(f"Too many concurrent {self.name} requests", self.retry_after_seconds)
+
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                # Not wait_for, which drops a cancellation arriving together with the slot
+                await asyncio.wait((future,), timeout=self.max_wait_seconds)
+            except asyncio.CancelledError:
+                # The slot may have been handed over just as the request was cancelled
+                if future.done():
+                    self._release()
+                raise
+            finally:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+            if not future.done():
+                future.cancel()
+                self.timed_out += 1
+                raise OverloadedError(f"Timed out waiting for a {self.name} slot", self.retry_after_seconds)
+        else:
+            self.active += 1
+
+        self.admitted += 1
+        self.total_wait_seconds += time.perf_counter() - start_time
+        try:
+            yield
+        finally:
+            self._release()
+
+    def set_limits(self, max_concurrency: Optional[int] = None, queue_limit: Optional[int] = None, max_wait_seconds: Optional[float] = None):
+        """Change the limits at runtime; raising max_concurrency admits waiting requests right away"""
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+        if queue_limit is not None:
+            self.queue_limit = queue_limit
+        if max_wait_seconds is not None:
+            self.max_wait_seconds = max_wait_seconds
+        self._wake()
+
+    def _release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        # Slots are handed over directly, so a newcomer cannot overtake a waiting request
+        while self._waiters and self.active < self.max_concurrency:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return occupancy and shed counters for the metrics endpoint"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_limit": self.queue_limit,
+            "max_wait_seconds": self.max_wait_seconds,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "mean_wait_ms": round(1000 * self.total_wait_seconds / self.admitted, 1) if self.admitted else 0.0,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an AdmissionLimiter to requests by path prefix
+
+    Requests are admitted before their body is read, so shed requests are
+    answered with 503 and Retry-After without receiving the upload. The slot
+    is held until the response (including a streamed one) is complete.
+    """
+
+    def __init__(self, app, limiters: List[Tuple[str, AdmissionLimiter]]):
+        """
+        Args:
+            app: The wrapped ASGI application
+            limiters: (path prefix, limiter) pairs; the first matching prefix applies
+        """
+        self.app = app
+        self.limiters = limiters
+
+    async def __call__(self, scope, receive, send):
+        limiter = None
+        if scope["type"] == "http" and scope["method"] != "OPTIONS":
+            limiter = next((limiter for prefix, limiter in self.limiters if scope["path"].startswith(prefix)), None)
+
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            async with limiter.admit():
+                await self.app(scope, receive, send)
+        except OverloadedError as e:
+            response = JSONResponse(
+                {"detail": f"Server is busy: {str(e)}"},
+                status_code=503,
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
@@ -1,5 +1,5 @@
 from flask import Flask, render_template, request, jsonify, url_for
-from process_medical_text import create_tokenized_dataset, preprocess_text
+from process_medical_text import tokenize_sentences, preprocess_text
 import json
 
 app = Flask(__name__, static_folder='static')
@@ -10,12 +10,12 @@ def index():
         if request.method == 'POST':
             text = request.form.get('medical_text', '')
             if text:
-                # Process the text
-                tokenized_data = create_tokenized_dataset(text)
+                # Process the text; the tokenizer is loaded once per process
                 processed_sentences = preprocess_text(text)
+                tokenized_data = tokenize_sentences(processed_sentences)
                 
                 # Get the first example's tokens
-                first_example = tokenized_data[0]
+                first_example = tokenized_data[0] if tokenized_data else None
                 
                 return render_template('index.html', 
                                     processed_sentences=processed_sentences,
@@ -1,59 +1,40 @@
 import os
-import json
+import shutil
+import uuid
 import argparse
-from datasets import Dataset
+from corpus_ingest import load_text_corpus
+from tokenized_cache import tokenize_corpus
+from mlm_batching import padding_report, print_padding_report, pack_dataset, PackedMLMCollator
+from training_metrics import InstrumentedCollator, TrainingMetricsCallback
+from cpu_profile import add_cpu_profile_args, apply_cpu_profile, read_cpu_baseline
+from checkpointing import AsyncCheckpointCallback, TEMP_MARKER, prepare_checkpoint_dir, publish_directory
 from transformers import AutoTokenizer, AutoModelForMaskedLM, Trainer, TrainingArguments, DataCollatorForLanguageModeling
 from biobert_processor import BioBertProcessor
 
-def load_medical_reports_from_directory(json_dir):
+def load_medical_reports_from_directory(json_dir, num_proc=None):
     """
-    Load medical report data from all JSON files in the specified directory
+    Load medical report data from all JSON and JSONL files in the specified directory
+    
+    Files are parsed in parallel and their records streamed into an
+    Arrow-backed dataset (see corpus_ingest), so the corpus may be larger
+    than memory. Records may use the "input", "content" or "text" field.
     
     Args:
         json_dir: Path to the directory containing JSON files with medical report data
+        num_proc: Processes parsing files in parallel (default: one per CPU)
         
     Returns:
         A Dataset object containing the texts for fine-tuning
+    
+    Raises:
+        ValueError: If no texts were found
     """
-    all_texts = []
-    current_count = 0
-    
-    # Get all JSON files in the directory
-    json_files = [f for f in os.listdir(json_dir) if f.endswith('.json')]
-    print(f"Found {len(json_files)} JSON files in {json_dir}")
-    
-    for json_file in json_files:
-        file_path = os.path.join(json_dir, json_file)
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            # Extract content based on file structure
-            if isinstance(data, list):
-                for item in data:
-                    if isinstance(item, dict):
-                        # Handle training data format
-                        if "input" in item:
-                            all_texts.append(item["input"])
-                        # Handle content-based format
-                        elif "content" in item:
-                            all_texts.append(item["content"])
-            
-            new_count = len(all_texts) - current_count
-            print(f"Processed {json_file}: added {new_count} texts")
-            current_count = len(all_texts)
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error in {json_file}: {str(e)}")
-        except Exception as e:
-            print(f"Error processing {json_file}: {str(e)}")
-    
-    if not all_texts:
-        raise ValueError("No valid training texts found in the provided JSON files")
-    
-    print(f"Total texts extracted: {len(all_texts)}")
-    return Dataset.from_dict({"text": all_texts})
+    return load_text_corpus(json_dir, num_proc=num_proc)
 
-def fine_tune_biobert_batch(json_dir, output_dir="./fine_tuned_biobert_batch", epochs=3, batch_size=8, learning_rate=5e-5):
+def fine_tune_biobert_batch(json_dir, output_dir="./fine_tuned_biobert_batch", epochs=3, batch_size=8, learning_rate=5e-5,
+                            num_proc=None, cache_dir=None, packing=False, isolate_documents=False,
+                            checkpoint_dir=None, checkpoint_minutes=None, checkpoint_tokens=None, resume=False,
+                            overwrite_checkpoints=False, cpu_options=None):
     """
     Fine-tune the Bio_ClinicalBERT model on multiple medical report JSON files
     
@@ -63,12 +44,36 @@ def fine_tune_biobert_batch(json_dir, output_dir="./fine_tuned_biobert_batch", e
         epochs: Number of training epochs
         batch_size: Training batch size
         learning_rate: Learning rate for training
+        num_proc: Processes for loading and tokenizing the corpus (default: one per CPU)
+        cache_dir: Directory of the tokenization cache (default: tokenized_cache.DEFAULT_CACHE_DIR)
+        packing: Pack the reports into full 256-token blocks instead of padding each batch
+        isolate_documents: With packing, keep attention (and positions) within each packed report
+        checkpoint_dir: Directory of the training checkpoints (default: "<output_dir>_checkpoints")
+        checkpoint_minutes: Checkpoint (and evaluate) after this many minutes of training
+        checkpoint_tokens: Checkpoint (and evaluate) after this many training tokens
+            (without either, every checkpointing.DEFAULT_CHECKPOINT_MINUTES minutes)
+        resume: Continue from the latest complete checkpoint in checkpoint_dir, if any
+        overwrite_checkpoints: Delete the checkpoints of a previous run instead; without
+            resume or overwrite_checkpoints, existing checkpoints are an error
+        cpu_options: Parsed cpu_profile.add_cpu_profile_args options (--cpu-optimized, ...);
+            None trains with the default configuration
         
     Returns:
         Path to the saved model
     """
+    # Read before output_dir is cleared or replaced, which deletes the report of the previous run
+    baseline = read_cpu_baseline(cpu_options, output_dir)
+    
+    # Checkpoints live next to the model, so publishing the final model leaves them alone.
+    # Decided before any work, so a forgotten --resume fails fast instead of losing them
+    output_dir = os.path.abspath(output_dir)
+    checkpoint_dir = os.path.abspath(checkpoint_dir or f"{output_dir}_checkpoints")
+    resume_from = prepare_checkpoint_dir(checkpoint_dir, resume=resume, overwrite=overwrite_checkpoints)
+    if resume_from:
+        print(f"Resuming training from {resume_from}")
+    
     print(f"Loading medical report data from {json_dir}...")
-    dataset = load_medical_reports_from_directory(json_dir)
+    dataset = load_medical_reports_from_directory(json_dir, num_proc=num_proc)
     print(f"Loaded {len(dataset)} text samples")
     
     # Load Pretrained Bio_ClinicalBERT Model and Tokenizer
@@ -77,125 +82,106 @@ def fine_tune_biobert_batch(json_dir, output_dir="./fine_tuned_biobert_batch", e
     tokenizer = AutoTokenizer.from_pretrained(model_name)
     model = AutoModelForMaskedLM.from_pretrained(model_name)
     
-    # Tokenize the dataset
-    print("Tokenizing dataset...")
-    def tokenize_function(examples):
-        return tokenizer(examples["text"], padding="max_length", truncation=True, max_length=256)
-
-    tokenized_dataset = dataset.map(tokenize_function, batched=True)
+    # Tokenize the dataset, or load it from the tokenization cache
+    tokenized_dataset = tokenize_corpus(dataset, tokenizer, max_length=256, num_proc=num_proc, cache_dir=cache_dir)
     
     # Split dataset into train and evaluation sets (80/20 split)
-    tokenized_dataset = tokenized_dataset.train_test_split(test_size=0.2)
-    
-    # Data Collator for Masked Language Modeling (MLM)
-    data_collator = DataCollatorForLanguageModeling(
-        tokenizer=tokenizer, mlm=True, mlm_probability=0.15
-    )
-    
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+    # Seeded, so that a resumed run trains on the same split
+    tokenized_dataset = tokenized_dataset.train_test_split(test_size=0.2, seed=42)
+    
+    if packing:
+        # Reports are packed whole into blocks, separated by their [CLS]/[SEP] tokens
+        for split in ("train", "test"):
+            tokenized_dataset[split] = pack_dataset(
+                tokenized_dataset[split], block_size=256, isolate_documents=isolate_documents, num_proc=num_proc
+            )
+        data_collator = PackedMLMCollator(tokenizer, mlm_probability=0.15, isolate_documents=isolate_documents)
+    else:
+        # Examples are not padded: the collator pads each batch to its longest example,
+        # and the Trainer builds batches from examples of similar length
+        print_padding_report(padding_report(tokenized_dataset["train"]["length"], batch_size, max_length=256))
+        
+        # Data Collator for Masked Language Modeling (MLM)
+        data_collator = DataCollatorForLanguageModeling(
+            tokenizer=tokenizer, mlm=True, mlm_probability=0.15
+        )
     
-    # Clean up any existing temporary checkpoints
-    import shutil
-    for item in os.listdir(output_dir):
-        if item.startswith('tmp-checkpoint-'):
-            tmp_path = os.path.join(output_dir, item)
-            try:
-                shutil.rmtree(tmp_path, ignore_errors=True)
-            except Exception as e:
-                print(f"Warning: Could not remove temporary checkpoint {tmp_path}: {e}")
+    # Count the samples and tokens of each training batch for the metrics report
+    data_collator = InstrumentedCollator(data_collator, pad_token_id=tokenizer.pad_token_id)
+    metrics_callback = TrainingMetricsCallback(data_collator)
     
     # Training Arguments
-    training_args = TrainingArguments(
-        output_dir=output_dir,
-        evaluation_strategy="steps",
-        eval_steps=5,
-        save_strategy="steps",
-        save_steps=5,
+    # The Trainer does not save checkpoints itself: checkpoint_callback writes them
+    # in the background, per the minutes/tokens policy, and evaluates at each one
+    training_args = dict(
+        output_dir=checkpoint_dir,
+        evaluation_strategy="no",
+        save_strategy="no",
         per_device_train_batch_size=batch_size,
         per_device_eval_batch_size=batch_size,
+        group_by_length=not packing,
+        length_column_name="length",
+        # The collator needs the document ids of packed blocks, which the model does not take
+        remove_unused_columns=not (packing and isolate_documents),
         num_train_epochs=epochs,
-        logging_dir=os.path.join(output_dir, "logs"),
+        logging_steps=5,
+        logging_dir=os.path.join(checkpoint_dir, "logs"),
         learning_rate=learning_rate,
         weight_decay=0.01,
-        save_total_limit=1,
         report_to="none",
-        load_best_model_at_end=True,
         hub_strategy="end",
         save_safetensors=True,
-        overwrite_output_dir=True,
-        save_only_model=True
+        overwrite_output_dir=True
+    )
+    # Thread settings must be in place before the model runs
+    cpu_run = apply_cpu_profile(cpu_options, training_args)
+    
+    checkpoint_callback = AsyncCheckpointCallback(
+        checkpoint_dir, minutes=checkpoint_minutes, tokens=checkpoint_tokens,
+        collator=data_collator, metrics=metrics_callback
     )
     
     # Initialize Trainer
     trainer = Trainer(
         model=model,
-        args=training_args,
+        args=TrainingArguments(**training_args),
         train_dataset=tokenized_dataset["train"],
         eval_dataset=tokenized_dataset["test"],
         tokenizer=tokenizer,
-        data_collator=data_collator
+        data_collator=data_collator,
+        callbacks=[metrics_callback, checkpoint_callback]
     )
     
     # Fine-Tune the Model
     print("Starting fine-tuning process...")
+    try:
+        trainer.train(resume_from_checkpoint=resume_from)
+    except Exception as e:
+        print(f"Error during training: {e}")
+        print(f"Completed checkpoints are kept in {checkpoint_dir}; run again with --resume to continue")
+        raise
     
-    # Create a unique temporary directory for this run
-    import tempfile
-    import uuid
-    temp_base = tempfile.gettempdir()
-    temp_run_dir = os.path.join(temp_base, f"biobert_train_{uuid.uuid4().hex}")
-    os.makedirs(temp_run_dir, exist_ok=True)
-    
-    # Update training arguments to use temporary directory
-    training_args.output_dir = temp_run_dir
-    
+    # Save the model, tokenizer and metrics report under a temporary name, then
+    # rename the directory into place so output_dir is never left half-written
+    print(f"Saving fine-tuned model to {output_dir}...")
+    os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+    temp_save_dir = f"{output_dir}{TEMP_MARKER}{uuid.uuid4().hex[:8]}"
     try:
-        # Run training
-        trainer.train()
-        
-        # Save final model
-        print(f"Saving fine-tuned model to {output_dir}...")
-        
-        # Create a temporary directory for saving
-        temp_save_dir = os.path.join(temp_base, f"biobert_save_{uuid.uuid4().hex}")
-        os.makedirs(temp_save_dir, exist_ok=True)
-        
-        # Save model and tokenizer to temporary directory first
         trainer.save_model(temp_save_dir)
         tokenizer.save_pretrained(temp_save_dir)
-        
-        # Remove existing output directory if it exists
-        if os.path.exists(output_dir):
-            try:
-                shutil.rmtree(output_dir)
-            except Exception as e:
-                print(f"Warning: Could not remove existing output directory: {e}")
-                # If we can't remove it, try to save to a new directory
-                output_dir = f"{output_dir}_{uuid.uuid4().hex[:8]}"
-        
-        # Move the temporary directory to final location
-        try:
-            shutil.move(temp_save_dir, output_dir)
-        except Exception as e:
-            print(f"Warning: Could not move model to final location: {e}")
-            # If move fails, try to copy instead
-            shutil.copytree(temp_save_dir, output_dir)
-            shutil.rmtree(temp_save_dir, ignore_errors=True)
-        
-        print(f"✅ Fine-tuning complete! Model saved at '{output_dir}'")
-    except Exception as e:
-        print(f"Error during training or saving: {e}")
-        raise
+        metrics_callback.save(temp_save_dir, extra={
+            "config": {
+                "batch_size": batch_size, "epochs": epochs, "learning_rate": learning_rate, "max_length": 256,
+                "packing": packing, "isolate_documents": isolate_documents, "resumed_from": resume_from,
+                "profile": cpu_run["profile"], "cpu": cpu_run["cpu"]
+            },
+            "checkpointing": checkpoint_callback.stats()
+        }, baseline=baseline)
+        publish_directory(temp_save_dir, output_dir)
     finally:
-        # Clean up temporary directories
-        for temp_dir in [temp_run_dir, temp_save_dir]:
-            try:
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir, ignore_errors=True)
-            except Exception as e:
-                print(f"Warning: Could not clean up temporary directory {temp_dir}: {e}")
+        shutil.rmtree(temp_save_dir, ignore_errors=True)
     
+    print(f"✅ Fine-tuning complete! Model saved at '{output_dir}'")
     return output_dir
 
 def integrate_fine_tuned_model(model_path):
@@ -267,19 +253,42 @@ def main():
     parser.add_argument("--epochs", type=int, default=3, help="Number of training epochs")
     parser.add_argument("--batch_size", type=int, default=8, help="Training batch size")
     parser.add_argument("--learning_rate", type=float, default=5e-5, help="Learning rate")
+    parser.add_argument("--num_proc", type=int, help="Processes for loading and tokenizing the corpus (default: one per CPU)")
+    parser.add_argument("--cache_dir", type=str, help="Directory of the tokenization cache")
+    add_cpu_profile_args(parser)
+    parser.add_argument("--packing", action="store_true", help="Pack the reports into full blocks instead of padding them")
+    parser.add_argument("--isolate_documents", action="store_true", help="With --packing, keep attention within each packed report")
+    parser.add_argument("--checkpoint_dir", type=str, help="Directory of the training checkpoints (default: <output_dir>_checkpoints)")
+    parser.add_argument("--checkpoint_minutes", type=float, help="Checkpoint every this many minutes of training (default: 30)")
+    parser.add_argument("--checkpoint_tokens", type=int, help="Checkpoint every this many training tokens")
+    parser.add_argument("--resume", action="store_true", help="Resume from the latest complete checkpoint")
+    parser.add_argument("--overwrite_checkpoints", action="store_true", help="Delete the checkpoints of a previous run")
     parser.add_argument("--test", action="store_true", help="Test the model after fine-tuning")
     parser.add_argument("--test_text", type=str, help="Text to test the model with")
     parser.add_argument("--integrate", action="store_true", help="Integrate the model with BioBertProcessor")
     
     args = parser.parse_args()
     
+    if args.resume and args.overwrite_checkpoints:
+        parser.error("--resume and --overwrite_checkpoints are mutually exclusive")
+    
     # Fine-tune the model
     model_path = fine_tune_biobert_batch(
         args.json_dir,
         output_dir=args.output_dir,
         epochs=args.epochs,
         batch_size=args.batch_size,
-        learning_rate=args.learning_rate
+        learning_rate=args.learning_rate,
+        num_proc=args.num_proc,
+        cache_dir=args.cache_dir,
+        packing=args.packing,
+        isolate_documents=args.isolate_documents,
+        checkpoint_dir=args.checkpoint_dir,
+        checkpoint_minutes=args.checkpoint_minutes,
+        checkpoint_tokens=args.checkpoint_tokens,
+        resume=args.resume,
+        overwrite_checkpoints=args.overwrite_checkpoints,
+        cpu_options=args
     )
     
     # Test the model if requested
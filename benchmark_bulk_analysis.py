@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Compare per-report /analyze calls with /analyze/bulk against a local stub of the messages API
+
+Starts a stub of the Anthropic messages API on localhost that answers after
+a simulated latency (a fixed round trip plus time per output token), points
+llm_client at it, and analyzes the same number of distinct reports once
+through /analyze and once through /analyze/bulk. A fraction of the reports
+in each bulk answer can be corrupted to exercise the retries:
+
+    python benchmark_bulk_analysis.py --reports 40 --failure-rate 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import llm_client
+import server
+from llm_scheduler import LLMScheduler
+
+
+def make_analysis(report_text: str) -> dict:
+    """Build a plausible analysis echoing the metrics of a report section"""
+    metrics = []
+    for name, value in re.findall(r"^- ([^:]+): ([\d.]+)", report_text, re.MULTILINE):
+        metrics.append({"name": name, "value": float(value), "unit": "mg/dL", "status": "normal"})
+    return {
+        "insights": [f"{len(metrics)} results reviewed"],
+        "metrics": metrics,
+        "recommendations": ["Repeat the panel in twelve months"],
+        "trends": {"description": "Stable", "concerns": []},
+    }
+
+
+def make_stub_app(round_trip_ms: float, ms_per_output_token: float, failure_rate: float, stats: dict) -> Starlette:
+    """Build the stub messages API
+
+    Bulk requests ("### REPORT <id>" sections) get one tagged object per
+    report, each replaced by invalid JSON with probability failure_rate.
+    """
+    async def messages(request: Request):
+        payload = await request.json()
+        prompt = payload["messages"][0]["content"]
+        stats["calls"] += 1
+
+        sections = re.split(r"^### REPORT (\S+)\n", prompt, flags=re.MULTILINE)
+        if len(sections) > 1:
+            outputs = []
+            for report_id, report_text in zip(sections[1::2], sections[2::2]):
+                analysis = json.dumps(make_analysis(report_text))
+                if random.random() < failure_rate:
+                    analysis = analysis[: len(analysis) // 3]
+                outputs.append(f'<report id="{report_id}">\n{analysis}\n</report>')
+            text = "\n".join(outputs)
+        else:
+            text = json.dumps(make_analysis(prompt))
+
+        output_tokens = len(text) // 4
+        await asyncio.sleep((round_trip_ms + output_tokens * ms_per_output_token) / 1000)
+        return JSONResponse({
+            "content": [{"type": "text", "text": text}],
+            "usage": {"input_tokens": len(json.dumps(payload)) // 4, "output_tokens": output_tokens},
+        })
+
+    return Starlette(routes=[Route("/v1/messages", messages, methods=["POST"])])
+
+
+def make_reports(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    return [
+        {
+            "reportType": "Lipid Panel",
+            "baseMetrics": [
+                {"name": "Total Cholesterol", "value": rng.randint(150, 260), "unit": "mg/dL"},
+                {"name": "HDL", "value": rng.randint(30, 80), "unit": "mg/dL"},
+                {"name": "LDL", "value": rng.randint(60, 190), "unit": "mg/dL"},
+                {"name": "Triglycerides", "value": rng.randint(60, 300), "unit": "mg/dL"},
+            ],
+        }
+        for _ in range(count)
+    ]
+
+
+async def run_benchmark(reports: int, concurrency: int, port: int, round_trip_ms: float, ms_per_output_token: float, failure_rate: float):
+    stats = {"calls": 0}
+    stub = uvicorn.Server(uvicorn.Config(
+        make_stub_app(round_trip_ms, ms_per_output_token, failure_rate, stats), port=port, log_level="warning"
+    ))
+    stub_task = asyncio.create_task(stub.serve())
+    while not stub.started:
+        await asyncio.sleep(0.05)
+
+    llm_client.ANTHROPIC_API_URL = f"http://127.0.0.1:{port}/v1/messages"
+    # Upstream rate limits would dominate the comparison, so they are lifted
+    llm_client.scheduler = LLMScheduler(requests_per_minute=1e6, input_tokens_per_minute=1e9, output_tokens_per_minute=1e9)
+    server.ANALYZE_BULK_CONCURRENCY = concurrency
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # One report at a time through /analyze, `concurrency` requests in flight
+        single_reports = make_reports(reports, seed=1)
+        slots = asyncio.Semaphore(concurrency)
+
+        async def analyze(report):
+            async with slots:
+                response = await client.post("/analyze", json=report)
+                response.raise_for_status()
+
+        stats["calls"] = 0
+        start = time.perf_counter()
+        await asyncio.gather(*(analyze(report) for report in single_reports))
+        single_elapsed = time.perf_counter() - start
+        single_calls = stats["calls"]
+
+        stats["calls"] = 0
+        start = time.perf_counter()
+        response = await client.post("/analyze/bulk", json={"reports": make_reports(reports, seed=2)})
+        response.raise_for_status()
+        bulk_elapsed = time.perf_counter() - start
+        summary = json.loads(response.text.splitlines()[-1])
+
+    stub.should_exit = True
+    await stub_task
+
+    print(f"reports={reports} concurrency={concurrency} reports/call={server.ANALYZE_BULK_REPORTS_PER_CALL} "
+          f"round_trip={round_trip_ms:g}ms failure_rate={failure_rate:g}")
+    print(f"  /analyze:      {single_calls} upstream calls, {single_elapsed:.2f}s")
+    print(f"  /analyze/bulk: {stats['calls']} upstream calls, {bulk_elapsed:.2f}s "
+          f"({summary['succeeded']} succeeded, {summary['fallback']} fallback)")
+    print(f"  {single_calls / max(stats['calls'], 1):.1f}x fewer calls, {single_elapsed / bulk_elapsed:.1f}x less wall time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reports", type=int, default=40, help="Reports analyzed in each mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="Upstream calls in flight at once")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the stub messages API")
+    parser.add_argument("--round-trip-ms", type=float, default=800, help="Simulated fixed latency of each call")
+    parser.add_argument("--ms-per-output-token", type=float, default=2, help="Simulated generation time per output token")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of bulk report outputs returned invalid")
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args.reports, args.concurrency, args.port, args.round_trip_ms,
+                              args.ms_per_output_token, args.failure_rate))
+
+
+if __name__ == "__main__":
+    main()
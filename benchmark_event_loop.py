@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Measure how responsive the API stays while PDFs are being parsed
+
+Runs the FastAPI app in-process, keeps a number of /upload-pdf requests in
+flight with a synthetic multi-page report, and meanwhile probes GET / at a
+fixed interval. Compare the latency percentiles of / between pool kinds:
+
+    python benchmark_event_loop.py --pool-kind inline    # old behaviour, parsing on the event loop
+    python benchmark_event_loop.py --pool-kind process
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+import server
+from worker_pool import BoundedWorkerPool
+
+SAMPLE_LINES = [
+    "Glucose: 126 mg/dL",
+    "Total Cholesterol: 210 mg/dL",
+    "HDL: 42 mg/dL",
+    "LDL: 138 mg/dL",
+    "Hemoglobin: 14.2 g/dL",
+    "Creatinine: 0.9 mg/dL",
+    "Patient advised to follow up with the primary care physician in three months.",
+]
+
+
+def make_sample_pdf(num_pages: int = 40, lines_per_page: int = 60) -> bytes:
+    """Build a simple text-only PDF resembling a lab report
+
+    Args:
+        num_pages: Number of pages
+        lines_per_page: Number of text lines per page
+
+    Returns:
+        The PDF file content
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages object, filled in once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+
+    for page_num in range(num_pages):
+        lines = [f"Page {page_num + 1}"] + [
+            SAMPLE_LINES[(page_num + i) % len(SAMPLE_LINES)] for i in range(lines_per_page)
+        ]
+        text_ops = " T* ".join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text_ops} ET".encode("latin-1")
+
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode()
+        )
+        page_ids.append(len(objects))
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for obj_id, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n"
+
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode()
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+
+    return bytes(pdf)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_benchmark(pool_kind: str, workers: int, concurrency: int, uploads: int, pages: int, probe_interval: float):
+    server.pdf_pool = BoundedWorkerPool(max_workers=workers, queue_limit=concurrency, kind=pool_kind)
+    pdf_bytes = make_sample_pdf(num_pages=pages)
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # Warm up the pool so worker start-up is not counted
+        await client.post("/upload-pdf", files={"file": ("warmup.pdf", pdf_bytes, "application/pdf")})
+
+        remaining = uploads
+        upload_times = []
+
+        async def uploader():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                response = await client.post("/upload-pdf", files={"file": ("report.pdf", pdf_bytes, "application/pdf")})
+                response.raise_for_status()
+                upload_times.append(time.perf_counter() - start)
+
+        probe_latencies = []
+        done = asyncio.Event()
+
+        async def prober():
+            # Latency is measured from when the probe was due, so time spent waiting
+            # for a blocked event loop counts too
+            due = time.perf_counter()
+            while not done.is_set():
+                due += probe_interval
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                await client.get("/")
+                probe_latencies.append((time.perf_counter() - due) * 1000)
+
+        start_time = time.perf_counter()
+        probe_task = asyncio.create_task(prober())
+        await asyncio.gather(*(uploader() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start_time
+        done.set()
+        await probe_task
+
+    server.pdf_pool.shutdown()
+
+    print(f"pool={pool_kind} workers={server.pdf_pool.max_workers} concurrency={concurrency} "
+          f"uploads={uploads} pages/pdf={pages} pdf_size={len(pdf_bytes) / 1024:.0f} KiB")
+    print(f"  uploads: {uploads / elapsed:.2f} PDFs/s, mean {statistics.mean(upload_times):.3f}s")
+    print(f"  GET / latency over {len(probe_latencies)} probes: "
+          f"p50 {percentile(probe_latencies, 50):.1f} ms, "
+          f"p99 {percentile(probe_latencies, 99):.1f} ms, "
+          f"max {max(probe_latencies):.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark event loop responsiveness during PDF parsing")
+    parser.add_argument("--pool-kind", choices=["inline", "thread", "process"], default="process")
+    parser.add_argument("--workers", type=int, default=None, help="Worker count (default: CPU count)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Uploads in flight at once")
+    parser.add_argument("--uploads", type=int, default=20, help="Total number of uploads")
+    parser.add_argument("--pages", type=int, default=100, help="Pages per synthetic PDF")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="Seconds between GET / probes")
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args.pool_kind, args.workers, args.concurrency, args.uploads, args.pages, args.probe_interval))
+
+
+if __name__ == "__main__":
+    main()
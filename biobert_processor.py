@@ -6,6 +6,7 @@ import os
 import numpy as np
 from torch.utils.data import Dataset, DataLoader
 from sklearn.model_selection import train_test_split
+from regex_metrics import CATEGORY_KEYWORDS, MEDICAL_PATTERNS, determine_report_category, extract_metrics_with_regex
 
 class BioBertProcessor:
     """A processor class that uses Bio_ClinicalBERT to analyze medical text"""
@@ -24,34 +25,9 @@ class BioBertProcessor:
             aggregation_strategy="simple"
         )
         
-        # Common medical test patterns (reusing from server.py.new)
-        self.medical_patterns = {
-            "glucose": r"(?:glucose|blood\s+sugar)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
-            "cholesterol": r"(?:total\s+cholesterol|cholesterol)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
-            "hdl": r"(?:hdl|hdl-c|high\s+density\s+lipoprotein)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
-            "ldl": r"(?:ldl|ldl-c|low\s+density\s+lipoprotein)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
-            "triglycerides": r"(?:triglycerides|tg)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
-            "a1c": r"(?:a1c|hba1c|glycated\s+hemoglobin)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(%|mmol/mol)?",
-            "blood_pressure": r"(?:blood\s+pressure|bp)\s*[:-]?\s*(\d+)\s*[/]\s*(\d+)\s*(mmHg)?",
-            "heart_rate": r"(?:heart\s+rate|pulse)\s*[:-]?\s*(\d+)\s*(bpm)?",
-            "creatinine": r"(?:creatinine|cr)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|μmol/L)?",
-            "egfr": r"(?:egfr|estimated\s+glomerular\s+filtration\s+rate)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mL/min/1.73m2)?",
-            "tsh": r"(?:tsh|thyroid\s+stimulating\s+hormone)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mIU/L|μIU/mL)?",
-            "wbc": r"(?:wbc|white\s+blood\s+cells|leukocytes)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(×10\^9/L|×10\^3/μL)?",
-            "rbc": r"(?:rbc|red\s+blood\s+cells|erythrocytes)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(×10\^12/L|×10\^6/μL)?",
-            "hemoglobin": r"(?:hemoglobin|hgb|hb)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(g/dL|g/L)?",
-            "alt": r"(?:alt|alanine\s+aminotransferase|sgpt)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(U/L|IU/L)?",
-            "ast": r"(?:ast|aspartate\s+aminotransferase|sgot)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(U/L|IU/L)?"
-        }
-        
-        # Medical categories mapping
-        self.category_keywords = {
-            "diabetes": ["glucose", "a1c", "insulin", "diabetes", "glycemic"],
-            "lipid": ["cholesterol", "hdl", "ldl", "triglycerides", "lipid"],
-            "cbc": ["hemoglobin", "hematocrit", "wbc", "rbc", "platelets", "blood count"],
-            "liver": ["alt", "ast", "alp", "bilirubin", "liver", "hepatic"],
-            "kidney": ["creatinine", "egfr", "bun", "kidney", "renal"]
-        }
+        # Common medical test patterns and medical categories mapping (shared with the regex-only path)
+        self.medical_patterns = MEDICAL_PATTERNS
+        self.category_keywords = CATEGORY_KEYWORDS
         
         # Path for saving fine-tuned model
         self.model_save_path = "/Users/purushothamrj/AI Health Parser/fine_tuned_biobert"
@@ -120,104 +96,12 @@ class BioBertProcessor:
         return metrics
     
     def extract_metrics_with_regex(self, text: str) -> List[Dict[str, Any]]:
-        """Extract medical metrics using regex patterns
-        
-        Args:
-            text: The medical text to analyze
-            
-        Returns:
-            List of extracted metrics with their values and units
-        """
-        metrics = []
-        
-        # Convert text to lowercase for case-insensitive matching
-        text_lower = text.lower()
-        
-        # Extract metrics using regex patterns
-        for metric_name, pattern in self.medical_patterns.items():
-            matches = re.findall(pattern, text_lower)
-            
-            if matches:
-                # Handle special case for blood pressure which has two values
-                if metric_name == "blood_pressure" and len(matches[0]) >= 2:
-                    systolic, diastolic = matches[0][0], matches[0][1]
-                    unit = matches[0][2] if len(matches[0]) > 2 and matches[0][2] else "mmHg"
-                    
-                    # Add systolic blood pressure
-                    metrics.append({
-                        "name": "Blood Pressure (Systolic)",
-                        "value": float(systolic),
-                        "unit": unit,
-                        "status": "normal",  # Will be updated later
-                        "source": "regex"
-                    })
-                    
-                    # Add diastolic blood pressure
-                    metrics.append({
-                        "name": "Blood Pressure (Diastolic)",
-                        "value": float(diastolic),
-                        "unit": unit,
-                        "status": "normal",  # Will be updated later
-                        "source": "regex"
-                    })
-                else:
-                    # Handle regular metrics with single values
-                    value = float(matches[0][0])
-                    unit = matches[0][1] if len(matches[0]) > 1 and matches[0][1] else ""
-                    
-                    # Format the metric name for display
-                    display_name = " ".join(word.capitalize() for word in metric_name.replace("_", " ").split())
-                    
-                    metrics.append({
-                        "name": display_name,
-                        "value": value,
-                        "unit": unit,
-                        "status": "normal",  # Will be updated later
-                        "source": "regex"
-                    })
-        
-        return metrics
+        """Extract medical metrics using regex patterns (see regex_metrics.extract_metrics_with_regex)"""
+        return extract_metrics_with_regex(text)
     
     def determine_report_category(self, text: str, metrics: List[Dict[str, Any]]) -> str:
-        """Determine the category of the medical report based on extracted metrics and text
-        
-        Args:
-            text: The medical text
-            metrics: The extracted metrics
-            
-        Returns:
-            The determined category (diabetes, lipid, cbc, liver, kidney, or general)
-        """
-        # Convert text to lowercase for case-insensitive matching
-        text_lower = text.lower()
-        
-        # Count occurrences of category keywords in the text
-        category_scores = {category: 0 for category in self.category_keywords}
-        
-        # Score based on text content
-        for category, keywords in self.category_keywords.items():
-            for keyword in keywords:
-                count = text_lower.count(keyword)
-                category_scores[category] += count
-        
-        # Score based on extracted metrics
-        for metric in metrics:
-            metric_name = metric["name"].lower()
-            for category, keywords in self.category_keywords.items():
-                if any(keyword in metric_name for keyword in keywords):
-                    category_scores[category] += 2  # Give more weight to actual metrics
-        
-        # Find the category with the highest score
-        max_score = 0
-        best_category = "general"
-        
-        for category, score in category_scores.items():
-            if score > max_score:
-                max_score = score
-                best_category = category
-        
-        # If no clear category is found, return general
-        return best_category if max_score > 0 else "general"
+        """Determine the category of the medical report (see regex_metrics.determine_report_category)"""
+        return determine_report_category(text, metrics)
     
     def _is_medical_test_entity(self, entity_type: str, entity_text: str) -> bool:
         """Check if an entity is likely to be a medical test
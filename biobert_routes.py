@@ -1,11 +1,191 @@
-from fastapi import APIRouter, HTTPException, Body, UploadFile, File
+from fastapi import APIRouter, HTTPException, Body, UploadFile, File, Request
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import io
-import json
-from typing import Dict, Any
-from biobert_processor import BioBertProcessor
+import os
+import threading
+from typing import Dict, Any, Callable, List
+from pdf_extractor import extract_text_from_pdf
+from regex_metrics import determine_report_category, extract_metrics_with_regex
+from deadline import (
+    Deadline, DeadlineExceeded, ClientDisconnected, CLIENT_CLOSED_REQUEST,
+    request_deadline, run_until_disconnect
+)
 
 # Initialize router
 router = APIRouter()
 
-# Initialize the BioBertProcessor
-biobert_
\ No newline at end of file
+# The BioBertProcessor is created on first use: loading Bio_ClinicalBERT takes
+# several seconds and a lot of memory, which the rest of the API does not need
+biobert_processor = None
+biobert_processor_lock = threading.Lock()
+
+# Model inference threads cannot be interrupted, so one abandoned at a deadline
+# keeps running after its request has answered (and left admission control).
+# A slot is held until the thread itself finishes, bounding the threads running the model.
+BIOBERT_MAX_THREADS = int(os.environ.get("BIOBERT_MAX_THREADS", os.environ.get("ADMISSION_BIOBERT_CONCURRENCY", "2")))
+biobert_thread_slots = asyncio.Semaphore(BIOBERT_MAX_THREADS)
+
+
+def get_biobert_processor():
+    """
+    Return the shared BioBertProcessor, loading the model on first call
+    """
+    global biobert_processor
+    with biobert_processor_lock:
+        if biobert_processor is None:
+            from biobert_processor import BioBertProcessor
+            biobert_processor = BioBertProcessor()
+    return biobert_processor
+
+
+def analyze_text(text: str) -> Dict[str, Any]:
+    """
+    Extract metrics with BioBERT and regex patterns and determine the report category
+    """
+    processor = get_biobert_processor()
+    metrics = processor.extract_metrics_with_bert(text)
+    return {
+        "metrics": metrics,
+        "category": processor.determine_report_category(text, metrics),
+        "text": text
+    }
+
+
+def analyze_text_regex(text: str) -> Dict[str, Any]:
+    """
+    The regex-only part of analyze_text, used when NER does not finish in time
+
+    It needs neither the model nor its lock, so it answers while the model is still loading.
+    """
+    metrics = extract_metrics_with_regex(text)
+    return {
+        "metrics": metrics,
+        "category": determine_report_category(text, metrics),
+        "text": text,
+        "partial": {"stage": "ner", "reason": "deadline"}
+    }
+
+
+async def run_model_thread(func: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run a model call in the threadpool, holding a BIOBERT_MAX_THREADS slot until the thread finishes
+
+    Cancelling the caller abandons the result but not the slot.
+    """
+    await biobert_thread_slots.acquire()
+    try:
+        work = asyncio.ensure_future(run_in_threadpool(func, *args))
+    except BaseException:
+        biobert_thread_slots.release()
+        raise
+    work.add_done_callback(release_model_thread)
+    return await asyncio.shield(work)
+
+
+def release_model_thread(work: asyncio.Future):
+    biobert_thread_slots.release()
+    # Mark the exception as retrieved in case the caller gave up on the result
+    if not work.cancelled():
+        work.exception()
+
+
+async def analyze_text_within(text: str, deadline: Deadline) -> Dict[str, Any]:
+    """
+    Run analyze_text, falling back to the regex metrics if NER misses the deadline
+
+    The NER thread cannot be interrupted; its result is discarded.
+    """
+    try:
+        return await deadline.run(run_model_thread(analyze_text, text))
+    except DeadlineExceeded:
+        return await run_in_threadpool(analyze_text_regex, text)
+
+
+def extract_entities(text: str) -> List[Dict[str, Any]]:
+    """
+    Run the BioBERT NER pipeline, converting its numpy scores to plain floats
+    """
+    entities = get_biobert_processor().extract_entities(text)
+    return [
+        {**entity, "score": float(entity["score"])} if "score" in entity else entity
+        for entity in entities
+    ]
+
+
+@router.post("/analyze-text")
+async def biobert_analyze_text(request: Request, text: str = Body(..., embed=True)):
+    """
+    Analyze medical text using BioBERT
+
+    Returns:
+        Dict: The extracted metrics, report category and text ("partial" if NER missed the deadline)
+    """
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="No text provided")
+
+    deadline = request_deadline(request)
+    try:
+        # Model inference is CPU-bound, so it runs off the event loop
+        return await run_until_disconnect(request, analyze_text_within(text, deadline))
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except Exception as e:
+        print(f"Error analyzing text with BioBERT: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error analyzing text: {str(e)}")
+
+
+@router.post("/analyze-pdf")
+async def biobert_analyze_pdf(request: Request, file: UploadFile = File(...)):
+    """
+    Analyze a PDF medical report using BioBERT
+
+    Returns:
+        Dict: The extracted metrics, report category and text ("partial" if NER missed the deadline)
+    """
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    deadline = request_deadline(request)
+
+    async def analyze_pdf():
+        contents = await file.read()
+        text = await deadline.run(run_in_threadpool(extract_text_from_pdf, io.BytesIO(contents)))
+        if not text:
+            return {"error": "Could not extract text from the PDF", "metrics": [], "category": "general", "text": ""}
+        return await analyze_text_within(text, deadline)
+
+    try:
+        return await run_until_disconnect(request, analyze_pdf())
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"No results before the deadline: {str(e)}")
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except Exception as e:
+        print(f"Error analyzing PDF with BioBERT: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error analyzing PDF: {str(e)}")
+
+
+@router.post("/extract-entities")
+async def biobert_extract_entities(request: Request, text: str = Body(..., embed=True)):
+    """
+    Extract medical entities using BioBERT NER
+
+    Returns:
+        Dict: The entities with their labels, scores and offsets
+    """
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="No text provided")
+
+    deadline = request_deadline(request)
+    try:
+        entities = await run_until_disconnect(request, deadline.run(run_model_thread(extract_entities, text)))
+        return {"entities": entities}
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"No results before the deadline: {str(e)}")
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except Exception as e:
+        print(f"Error extracting entities with BioBERT: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error extracting entities: {str(e)}")
@@ -0,0 +1,305 @@
+import dataclasses
+import json
+import os
+import random
+import re
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from transformers import TrainerCallback
+
+# Names of the files the Trainer reads back with train(resume_from_checkpoint=...)
+OPTIMIZER_NAME = "optimizer.pt"
+SCHEDULER_NAME = "scheduler.pt"
+TRAINER_STATE_NAME = "trainer_state.json"
+RNG_STATE_NAME = "rng_state.pth"
+
+# Complete checkpoints; incomplete ones carry a ".tmp-<id>" suffix until they are published
+CHECKPOINT_PATTERN = re.compile(r"^checkpoint-(\d+)$")
+TEMP_MARKER = ".tmp-"
+
+# Checkpoint interval when neither minutes nor tokens are given
+DEFAULT_CHECKPOINT_MINUTES = 30.0
+
+
+def list_checkpoints(checkpoint_dir: str) -> List[str]:
+    """
+    List the complete checkpoints of a directory
+
+    Args:
+        checkpoint_dir: Directory holding checkpoint-<step> subdirectories
+
+    Returns:
+        Their paths, oldest (lowest step) first
+    """
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    steps = []
+    for name in os.listdir(checkpoint_dir):
+        match = CHECKPOINT_PATTERN.match(name)
+        if match and os.path.isdir(os.path.join(checkpoint_dir, name)):
+            steps.append(int(match.group(1)))
+    return [os.path.join(checkpoint_dir, f"checkpoint-{step}") for step in sorted(steps)]
+
+
+def latest_checkpoint(checkpoint_dir: str) -> Optional[str]:
+    """Path of the most recent complete checkpoint, or None"""
+    checkpoints = list_checkpoints(checkpoint_dir)
+    return checkpoints[-1] if checkpoints else None
+
+
+def remove_incomplete_checkpoints(checkpoint_dir: str):
+    """Delete checkpoints left half-written by an interrupted run"""
+    if not os.path.isdir(checkpoint_dir):
+        return
+    for name in os.listdir(checkpoint_dir):
+        if TEMP_MARKER in name:
+            print(f"Removing incomplete checkpoint {name}")
+            shutil.rmtree(os.path.join(checkpoint_dir, name), ignore_errors=True)
+
+
+def prepare_checkpoint_dir(checkpoint_dir: str, resume: bool = False, overwrite: bool = False) -> Optional[str]:
+    """
+    Decide how a run treats the checkpoints already in its checkpoint directory
+
+    Args:
+        checkpoint_dir: Directory holding checkpoint-<step> subdirectories
+        resume: Continue from the latest complete checkpoint, if any
+        overwrite: Delete the checkpoints of a previous run and start afresh
+
+    Returns:
+        The checkpoint to resume from, or None to start from scratch
+
+    Raises:
+        ValueError: If checkpoints exist but neither resume nor overwrite was asked for
+    """
+    checkpoints = list_checkpoints(checkpoint_dir)
+    if resume:
+        if checkpoints:
+            return checkpoints[-1]
+        print(f"No complete checkpoint found in {checkpoint_dir}, starting from scratch")
+        return None
+    if checkpoints and not overwrite:
+        raise ValueError(
+            f"{checkpoint_dir} holds checkpoints of a previous run ({os.path.basename(checkpoints[-1])}); "
+            "resume from them with --resume or delete them with --overwrite_checkpoints"
+        )
+    # A new run must not be mistaken for the continuation of an older one
+    for old in checkpoints:
+        print(f"Removing checkpoint of a previous run: {old}")
+        shutil.rmtree(old, ignore_errors=True)
+    return None
+
+
+def fsync_directory(path: str):
+    """Flush the files of a directory, and the directory entry itself, to disk"""
+    for name in os.listdir(path):
+        file_path = os.path.join(path, name)
+        if os.path.isfile(file_path):
+            with open(file_path, "rb") as f:
+                os.fsync(f.fileno())
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def publish_directory(temp_dir: str, target: str):
+    """
+    Move a fully written directory into place with renames, replacing target
+
+    Readers see either the old or the new directory, never a partial one;
+    temp_dir must be on the same filesystem as target.
+    """
+    old = None
+    if os.path.exists(target):
+        old = f"{target}{TEMP_MARKER}old-{uuid.uuid4().hex[:8]}"
+        os.rename(target, old)
+    os.rename(temp_dir, target)
+    if old:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def clone_tensors(value: Any, memo: Optional[Dict[Any, Any]] = None) -> Any:
+    """
+    Copy the tensors of a (nested) state dict, so training can keep updating the originals
+
+    Tensors sharing storage (tied weights) stay shared in the copy.
+    """
+    import torch
+
+    memo = {} if memo is None else memo
+    if isinstance(value, torch.Tensor):
+        key = (value.data_ptr(), value.dtype, tuple(value.shape), value.stride())
+        if key not in memo:
+            memo[key] = value.detach().to("cpu", copy=True)
+        return memo[key]
+    if isinstance(value, dict):
+        return {k: clone_tensors(v, memo) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(clone_tensors(v, memo) for v in value)
+    return value
+
+
+class AsyncCheckpointCallback(TrainerCallback):
+    """
+    Checkpoint training every N minutes or N training tokens, writing in the background
+
+    At a checkpoint the model, optimizer, scheduler, trainer state and RNG
+    states are copied in memory, which is all the training loop waits for;
+    a background thread then writes them to checkpoint-<step>.tmp-<id> and
+    renames the directory to checkpoint-<step> once every file is on disk.
+    A crash therefore never leaves a partial checkpoint-<step>, and the
+    files use the Trainer's layout, so trainer.train(resume_from_checkpoint=
+    latest_checkpoint(checkpoint_dir)) continues where the run stopped.
+
+    At most one checkpoint is written at a time: when the next one is due
+    before the previous write finished, the training loop waits for it.
+    The copy doubles the memory held by the model and optimizer state.
+
+    The Trainer's own checkpointing should be off (save_strategy="no").
+    """
+
+    def __init__(self, checkpoint_dir: str, minutes: Optional[float] = None, tokens: Optional[int] = None,
+                 keep: int = 1, collator=None, metrics=None, evaluate: bool = True):
+        """
+        Args:
+            checkpoint_dir: Where checkpoints are written
+            minutes: Checkpoint after this much training time
+            tokens: Checkpoint after this many training tokens (needs collator)
+            keep: Complete checkpoints kept; older ones are deleted once a newer one is published
+            collator: The training InstrumentedCollator, counting the tokens seen
+            metrics: A TrainingMetricsCallback, told how long each checkpoint blocked training
+            evaluate: Also evaluate at each checkpoint
+        """
+        if tokens and collator is None:
+            raise ValueError("A token checkpoint interval needs the InstrumentedCollator counting tokens")
+        if not minutes and not tokens:
+            minutes = DEFAULT_CHECKPOINT_MINUTES
+        self.checkpoint_dir = checkpoint_dir
+        self.minutes = minutes
+        self.tokens = tokens
+        self.keep = max(1, keep)
+        self.collator = collator
+        self.metrics = metrics
+        self.evaluate = evaluate
+
+        self.checkpoints = 0
+        self.blocked_seconds = 0.0
+        self.write_seconds = 0.0
+        self.failures = 0
+
+        self._writer: Optional[threading.Thread] = None
+        self._last_time = time.monotonic()
+        self._last_tokens = 0
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        remove_incomplete_checkpoints(self.checkpoint_dir)
+        self._last_time = time.monotonic()
+        self._last_tokens = self.collator.tokens if self.collator is not None else 0
+
+    def _due(self) -> bool:
+        if self.minutes and time.monotonic() - self._last_time >= self.minutes * 60:
+            return True
+        return bool(self.tokens and self.collator.tokens - self._last_tokens >= self.tokens)
+
+    def on_step_end(self, args, state, control, model=None, optimizer=None, lr_scheduler=None, **kwargs):
+        if not self._due():
+            return
+        start_time = time.perf_counter()
+        self.wait()
+        snapshot = self._snapshot(state, model, optimizer, lr_scheduler)
+        self._writer = threading.Thread(
+            target=self._write, args=(state.global_step, model, snapshot),
+            name=f"checkpoint-{state.global_step}"
+        )
+        self._writer.start()
+
+        blocked = time.perf_counter() - start_time
+        self.blocked_seconds += blocked
+        if self.metrics is not None:
+            self.metrics.record_checkpoint(blocked)
+        self._last_time = time.monotonic()
+        self._last_tokens = self.collator.tokens if self.collator is not None else 0
+        if self.evaluate:
+            control.should_evaluate = True
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.wait()
+
+    def wait(self):
+        """Block until the checkpoint being written, if any, is on disk"""
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    def _snapshot(self, state, model, optimizer, lr_scheduler) -> Dict[str, Any]:
+        import numpy as np
+        import torch
+
+        # Plain Python values rather than an ndarray: torch>=2.6 loads the file with weights_only=True
+        name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        rng_state = {
+            "python": random.getstate(),
+            "numpy": (name, keys.tolist(), pos, has_gauss, cached_gaussian),
+            "cpu": torch.random.get_rng_state(),
+        }
+        if torch.cuda.is_available():
+            rng_state["cuda"] = torch.cuda.random.get_rng_state_all()
+
+        memo = {}
+        return {
+            "model": clone_tensors(model.state_dict(), memo),
+            "optimizer": clone_tensors(optimizer.state_dict(), memo) if optimizer is not None else None,
+            "scheduler": clone_tensors(lr_scheduler.state_dict(), memo) if lr_scheduler is not None else None,
+            "trainer_state": json.dumps(dataclasses.asdict(state), indent=2, sort_keys=True) + "\n",
+            "rng_state": rng_state,
+        }
+
+    def _write(self, step: int, model, snapshot: Dict[str, Any]):
+        import torch
+
+        start_time = time.perf_counter()
+        target = os.path.join(self.checkpoint_dir, f"checkpoint-{step}")
+        temp_dir = f"{target}{TEMP_MARKER}{uuid.uuid4().hex[:8]}"
+        try:
+            os.makedirs(temp_dir)
+            model.save_pretrained(temp_dir, state_dict=snapshot["model"], safe_serialization=True)
+            if snapshot["optimizer"] is not None:
+                torch.save(snapshot["optimizer"], os.path.join(temp_dir, OPTIMIZER_NAME))
+            if snapshot["scheduler"] is not None:
+                torch.save(snapshot["scheduler"], os.path.join(temp_dir, SCHEDULER_NAME))
+            torch.save(snapshot["rng_state"], os.path.join(temp_dir, RNG_STATE_NAME))
+            with open(os.path.join(temp_dir, TRAINER_STATE_NAME), "w") as f:
+                f.write(snapshot["trainer_state"])
+
+            fsync_directory(temp_dir)
+            publish_directory(temp_dir, target)
+            fsync_directory(self.checkpoint_dir)
+        except Exception as e:
+            # Training goes on; the next checkpoint gets another chance
+            self.failures += 1
+            print(f"Warning: Could not write checkpoint {target}: {e}")
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        for old in list_checkpoints(self.checkpoint_dir)[:-self.keep]:
+            shutil.rmtree(old, ignore_errors=True)
+        self.checkpoints += 1
+        self.write_seconds += time.perf_counter() - start_time
+        print(f"Checkpoint written: {target} ({time.perf_counter() - start_time:.1f}s in the background)")
+
+    def stats(self) -> Dict[str, Any]:
+        """Checkpoint counts and timings, for the training metrics report"""
+        return {
+            "policy": {"minutes": self.minutes, "tokens": self.tokens},
+            "written": self.checkpoints,
+            "failed": self.failures,
+            "blocked_seconds": round(self.blocked_seconds, 2),
+            "background_write_seconds": round(self.write_seconds, 2),
+        }
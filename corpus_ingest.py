@@ -0,0 +1,198 @@
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Fields holding the training text, in order of preference: "input" (training data
+# format), "content" (pages of extracted reports) and "text" (plain text corpora)
+TEXT_FIELDS = ("input", "content", "text")
+
+# Extensions of corpus files; both may hold a JSON array, one JSON value per line, or a single value
+CORPUS_EXTENSIONS = (".json", ".jsonl")
+
+# Characters read from a corpus file at a time
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Skipped between records: whitespace (and a byte order mark), plus commas inside a top-level array
+_WHITESPACE = " \t\r\n\ufeff"
+_ARRAY_SEPARATORS = _WHITESPACE + ","
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+def find_corpus_files(path: str) -> List[str]:
+    """
+    List the corpus files of a directory (or the file itself)
+
+    Args:
+        path: A directory of .json/.jsonl files, or a single file
+
+    Returns:
+        The file paths, sorted so that runs see the records in the same order
+    """
+    if os.path.isfile(path):
+        return [path]
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if name.endswith(CORPUS_EXTENSIONS)
+    )
+
+
+def iter_json_records(file_path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Stream the records of a JSON or JSONL file without loading the whole file
+
+    A top-level array yields its elements; otherwise each top-level value
+    (one per line in JSONL) is a record. Only one record at a time is held
+    in memory, plus the read buffer.
+
+    Args:
+        file_path: Path of the file
+        chunk_size: Characters read at a time
+
+    Yields:
+        The decoded records
+
+    Raises:
+        ValueError: If the file is not valid JSON or JSONL
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size)
+        eof = not buffer
+        pos = 0
+        in_array = None
+
+        while True:
+            # Skip whitespace (and the commas of an array) up to the next value
+            while True:
+                separators = _ARRAY_SEPARATORS if in_array else _WHITESPACE
+                while pos < len(buffer) and buffer[pos] in separators:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                buffer, pos = f.read(chunk_size), 0
+                eof = not buffer
+
+            if pos >= len(buffer):
+                if in_array:
+                    raise ValueError(f"Unexpected end of file in {file_path}")
+                return
+            if in_array is None:
+                in_array = buffer[pos] == "["
+                if in_array:
+                    pos += 1
+                    continue
+            if in_array and buffer[pos] == "]":
+                return
+
+            while True:
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                    # A number cut by the end of the buffer may continue in the next chunk
+                    if eof or isinstance(record, (dict, list, str)) or \
+                            (end < len(buffer) and buffer[end] not in _NUMBER_CHARS):
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+
+            yield record
+            pos = end
+
+
+def record_text(record: Any) -> Optional[str]:
+    """
+    Get the training text of a record, whichever schema it uses
+
+    Args:
+        record: A record from a corpus file: a dict with one of TEXT_FIELDS, or a plain string
+
+    Returns:
+        The text, or None if the record has no usable text
+    """
+    if isinstance(record, str):
+        text = record
+    elif isinstance(record, dict):
+        text = next((record[field] for field in TEXT_FIELDS if isinstance(record.get(field), str)), None)
+    else:
+        return None
+    return text if text and text.strip() else None
+
+
+def generate_texts(files: List[Tuple[str, int, float]]) -> Iterator[Dict[str, str]]:
+    """
+    Yield {"text": ...} examples from corpus files, for the datasets generator builders
+
+    A file that turns out to be malformed is reported and skipped from that
+    point on; the records read before the error are kept.
+
+    Args:
+        files: (path, size, modification time) of each file. Size and time are
+            not used here, but make the datasets cache notice changed files.
+    """
+    for file_path, _, _ in files:
+        count = 0
+        try:
+            for record in iter_json_records(file_path):
+                text = record_text(record)
+                if text is not None:
+                    count += 1
+                    yield {"text": text}
+            print(f"Processed {os.path.basename(file_path)}: added {count} texts")
+        except (OSError, ValueError) as e:
+            print(f"Error processing {os.path.basename(file_path)} after {count} texts: {str(e)}")
+
+
+def load_text_corpus(path: str, num_proc: Optional[int] = None, streaming: bool = False):
+    """
+    Load the texts of a corpus file or directory as a datasets dataset
+
+    Records are streamed from the files by a generator, so the corpus is
+    never held in a Python list. Without streaming, the texts are written to
+    the datasets Arrow cache, which is memory-mapped, so the corpus may be
+    larger than RAM; files are parsed by up to num_proc processes. With
+    streaming, an IterableDataset reads the files as training consumes it,
+    sharded by file across the dataloader workers.
+
+    Args:
+        path: A directory of .json/.jsonl files, or a single file
+        num_proc: Processes parsing files in parallel (default: one per CPU, at most one per file)
+        streaming: Return an IterableDataset instead of an Arrow-backed Dataset
+
+    Returns:
+        A Dataset (or IterableDataset) with a "text" column
+
+    Raises:
+        ValueError: If no corpus files or no texts were found
+    """
+    from datasets import Dataset, Features, IterableDataset, Value
+
+    paths = find_corpus_files(path)
+    print(f"Found {len(paths)} JSON/JSONL files in {path}")
+    if not paths:
+        raise ValueError(f"No JSON or JSONL files found in {path}")
+
+    files = []
+    for file_path in paths:
+        stat = os.stat(file_path)
+        files.append((file_path, stat.st_size, stat.st_mtime))
+
+    features = Features({"text": Value("string")})
+    if streaming:
+        return IterableDataset.from_generator(generate_texts, features=features, gen_kwargs={"files": files})
+
+    num_proc = min(num_proc or os.cpu_count() or 1, len(files))
+    dataset = Dataset.from_generator(
+        generate_texts,
+        features=features,
+        gen_kwargs={"files": files},
+        num_proc=num_proc if num_proc > 1 else None
+    )
+    if len(dataset) == 0:
+        raise ValueError("No valid training texts found in the provided JSON files")
+
+    print(f"Total texts extracted: {len(dataset)}")
+    return dataset
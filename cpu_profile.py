@@ -0,0 +1,173 @@
+import argparse
+import math
+import os
+from typing import Any, Dict, List, Optional
+
+from training_metrics import METRICS_JSON, load_baseline
+
+# Samples per optimizer step reached with gradient accumulation in the CPU-optimized profile
+DEFAULT_EFFECTIVE_BATCH_SIZE = 64
+
+# CPU flags of native bf16 arithmetic; without them bf16 is emulated and slower than fp32
+BF16_CPU_FLAGS = ("avx512_bf16", "amx_bf16")
+
+_CPU_TOPOLOGY = "/sys/devices/system/cpu/cpu{}/topology/{}"
+
+
+def usable_cpus() -> List[int]:
+    """The CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _topology(cpus: List[int], name: str) -> set:
+    values = set()
+    for cpu in cpus:
+        with open(_CPU_TOPOLOGY.format(cpu, name)) as f:
+            values.add(f.read().strip())
+    return values
+
+
+def physical_cores() -> int:
+    """Physical cores among the usable CPUs; hyperthreads of one core count once"""
+    cpus = usable_cpus()
+    try:
+        return len(_topology(cpus, "thread_siblings_list")) or len(cpus)
+    except OSError:
+        return len(cpus)
+
+
+def cpu_sockets() -> int:
+    """Sockets the usable CPUs belong to"""
+    try:
+        return len(_topology(usable_cpus(), "physical_package_id")) or 1
+    except OSError:
+        return 1
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether the CPU computes in bf16 natively (AVX512-BF16 or AMX)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = line.split(":", 1)[1].split()
+                    return any(flag in flags for flag in BF16_CPU_FLAGS)
+    except OSError:
+        pass
+    return False
+
+
+def configure_cpu_training(batch_size: int, effective_batch_size: int = DEFAULT_EFFECTIVE_BATCH_SIZE,
+                           torch_compile: bool = False) -> Dict[str, Any]:
+    """
+    Set up torch for training on this CPU and describe the settings
+
+    Intra-op threads are set to the physical cores (hyperthreads slow dense
+    math down) and inter-op threads to one per socket. bf16 autocast is used
+    only when the CPU computes in bf16 natively. Gradients are accumulated
+    over enough batches of batch_size to reach effective_batch_size samples
+    per optimizer step without holding them in memory at once.
+
+    Call before the model runs: inter-op threads cannot change afterwards.
+
+    Args:
+        batch_size: Samples per forward/backward pass
+        effective_batch_size: Samples per optimizer step
+        torch_compile: Compile the model with torch.compile
+
+    Returns:
+        The settings; training_arguments() turns them into TrainingArguments overrides
+    """
+    import torch
+
+    intra_op_threads = physical_cores()
+    inter_op_threads = min(cpu_sockets(), intra_op_threads)
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError as e:
+        # Already set, or inter-op work already ran in this process
+        print(f"Warning: Could not set inter-op threads: {e}")
+        inter_op_threads = torch.get_num_interop_threads()
+
+    accumulation = max(1, math.ceil(effective_batch_size / batch_size))
+    profile = {
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads,
+        "bf16": cpu_supports_bf16(),
+        "gradient_accumulation_steps": accumulation,
+        "effective_batch_size": batch_size * accumulation,
+        "torch_compile": torch_compile,
+    }
+    print(f"CPU-optimized profile: {profile['intra_op_threads']} intra-op / {profile['inter_op_threads']} inter-op threads, "
+          f"bf16 autocast {'on' if profile['bf16'] else 'off (no native bf16 support)'}, "
+          f"{accumulation} x {batch_size} samples per optimizer step, "
+          f"torch.compile {'on' if torch_compile else 'off'}")
+    return profile
+
+
+def training_arguments(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """TrainingArguments overrides of a configure_cpu_training profile"""
+    return {
+        "use_cpu": True,
+        "bf16": profile["bf16"],
+        "gradient_accumulation_steps": profile["gradient_accumulation_steps"],
+        "torch_compile": profile["torch_compile"],
+    }
+
+
+def add_cpu_profile_args(parser: argparse.ArgumentParser):
+    """Add the options of the CPU-optimized profile to a fine-tuning command line"""
+    parser.add_argument("--cpu-optimized", "--cpu_optimized", dest="cpu_optimized", action="store_true",
+                        help="Tune threads, bf16 autocast and gradient accumulation for training on this CPU")
+    parser.add_argument("--effective_batch_size", type=int, default=DEFAULT_EFFECTIVE_BATCH_SIZE,
+                        help="With --cpu-optimized, samples per optimizer step, reached by gradient accumulation")
+    parser.add_argument("--torch_compile", action="store_true", help="Compile the model with torch.compile")
+    parser.add_argument("--baseline_metrics", type=str,
+                        help="With --cpu-optimized, training_metrics.json of a default run to compare against "
+                             "(default: the one in --output_dir)")
+
+
+def read_cpu_baseline(args: Optional[argparse.Namespace], output_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Read the default-configuration report a --cpu-optimized run is compared against
+
+    That is args.baseline_metrics, or else the training_metrics.json a
+    previous run left in output_dir. Call before the run clears or replaces
+    output_dir, which would delete that report.
+
+    Returns:
+        The report, or None without --cpu-optimized or a usable default-profile report
+    """
+    if not (args and args.cpu_optimized):
+        return None
+    return load_baseline(args.baseline_metrics or os.path.join(output_dir, METRICS_JSON))
+
+
+def apply_cpu_profile(args: Optional[argparse.Namespace], training_args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply the add_cpu_profile_args options to the TrainingArguments of a run
+
+    With args.cpu_optimized, torch is set up for this CPU (see
+    configure_cpu_training) and training_args gets the matching overrides.
+    Call before the model runs.
+
+    Args:
+        args: The parsed options; None for the default configuration
+        training_args: TrainingArguments keyword arguments, updated in place
+            (per_device_train_batch_size must be set)
+
+    Returns:
+        The "profile" and "cpu" settings for the training metrics report
+    """
+    torch_compile = bool(args and args.torch_compile)
+    if not (args and args.cpu_optimized):
+        if torch_compile:
+            training_args["torch_compile"] = True
+        return {"profile": "default", "cpu": None}
+
+    settings = configure_cpu_training(training_args["per_device_train_batch_size"], args.effective_batch_size, torch_compile)
+    training_args.update(training_arguments(settings))
+    return {"profile": "cpu-optimized", "cpu": settings}
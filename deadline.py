@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Optional
+
+from starlette.requests import Request
+
+# Time budget of a request across all of its stages, and the most a client may ask for
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "60"))
+REQUEST_MAX_DEADLINE_SECONDS = float(os.environ.get("REQUEST_MAX_DEADLINE_SECONDS", "300"))
+
+# Status logged for requests abandoned by the client (nginx's "client closed request")
+CLIENT_CLOSED_REQUEST = 499
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage cannot finish within the request's time budget"""
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away before the response was ready"""
+
+
+class Deadline:
+    """The time budget of one request, shared by all of its stages"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    async def run(self, awaitable: Awaitable[Any]) -> Any:
+        """
+        Await a stage, cancelling it when the deadline passes
+
+        Raises:
+            DeadlineExceeded: If the deadline passed first
+        """
+        if self.expired:
+            # Do not start work that can no longer finish in time
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s exceeded")
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s exceeded")
+
+
+async def run_within(deadline: Optional[Deadline], awaitable: Awaitable[Any]) -> Any:
+    """Await a stage under a deadline, or without a time limit if deadline is None"""
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable)
+
+
+def request_deadline(request: Request) -> Deadline:
+    """
+    Build the deadline of a request
+
+    Clients may ask for a shorter (or, up to REQUEST_MAX_DEADLINE_SECONDS,
+    longer) budget with an X-Request-Timeout header in seconds.
+    """
+    seconds = REQUEST_DEADLINE_SECONDS
+    header = request.headers.get("x-request-timeout")
+    if header:
+        try:
+            seconds = float(header)
+        except ValueError:
+            pass
+    return Deadline(min(max(seconds, 0.0), REQUEST_MAX_DEADLINE_SECONDS))
+
+
+async def wait_for_disconnect(request: Request):
+    """Return once the client has disconnected (the request body must already have been read)"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_until_disconnect(request: Request, awaitable: Awaitable[Any]) -> Any:
+    """
+    Await the handling of a request, cancelling it if the client disconnects
+
+    Streaming responses do not need this: Starlette already cancels them.
+
+    Raises:
+        ClientDisconnected: If the client went away first
+    """
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not work.done():
+            work.cancel()
+
+    if work.done() and not work.cancelled():
+        return work.result()
+
+    # Let the cancelled work run its cleanup before reporting the disconnect
+    await asyncio.gather(work, return_exceptions=True)
+    raise ClientDisconnected("Client disconnected")
@@ -1,29 +1,31 @@
-import json
 import torch
 import os
-from datasets import Dataset
+from corpus_ingest import load_text_corpus
+from tokenized_cache import tokenize_corpus
+from mlm_batching import padding_report, print_padding_report
+from training_metrics import InstrumentedCollator, TrainingMetricsCallback
+from cpu_profile import add_cpu_profile_args, apply_cpu_profile, read_cpu_baseline
 from transformers import AutoTokenizer, AutoModelForMaskedLM, Trainer, TrainingArguments, DataCollatorForLanguageModeling
 
 
-def load_medical_data(json_file):
-    """Load medical data from a JSON file
+def load_medical_data(json_file, num_proc=None):
+    """Load medical data from a JSON or JSONL file
+    
+    Records are streamed from the file into an Arrow-backed dataset (see
+    corpus_ingest), so the file may be larger than memory.
     
     Args:
         json_file: Path to the JSON file containing medical text data
+        num_proc: Processes parsing files in parallel (when json_file is a directory)
         
     Returns:
         A Dataset object containing the texts
     """
-    with open(json_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    # Adjust based on your JSON structure
-    # This assumes each entry in the JSON has a 'text' field
-    texts = [entry["text"] for entry in data]
-    return Dataset.from_dict({"text": texts})
+    return load_text_corpus(json_file, num_proc=num_proc)
 
 
-def fine_tune_biobert(json_file, output_dir="./fine_tuned_bio_clinicalbert", epochs=3, batch_size=8, learning_rate=5e-5):
+def fine_tune_biobert(json_file, output_dir="./fine_tuned_bio_clinicalbert", epochs=3, batch_size=8, learning_rate=5e-5,
+                      num_proc=None, cache_dir=None, cpu_options=None):
     """Fine-tune the Bio_ClinicalBERT model on custom medical data
     
     Args:
@@ -32,12 +34,19 @@ def fine_tune_biobert(json_file, output_dir="./fine_tuned_bio_clinicalbert", epo
         epochs: Number of training epochs
         batch_size: Training batch size
         learning_rate: Learning rate for training
+        num_proc: Processes for loading and tokenizing the corpus (default: one per CPU)
+        cache_dir: Directory of the tokenization cache (default: tokenized_cache.DEFAULT_CACHE_DIR)
+        cpu_options: Parsed cpu_profile.add_cpu_profile_args options (--cpu-optimized, ...);
+            None trains with the default configuration
         
     Returns:
         Path to the saved model
     """
+    # Read before output_dir is cleared or replaced, which deletes the report of the previous run
+    baseline = read_cpu_baseline(cpu_options, output_dir)
+    
     print(f"Loading medical data from {json_file}...")
-    dataset = load_medical_data(json_file)
+    dataset = load_medical_data(json_file, num_proc=num_proc)
     print(f"Loaded {len(dataset)} text samples")
     
     # Load Pretrained Bio_ClinicalBERT Model and Tokenizer
@@ -46,32 +55,39 @@ def fine_tune_biobert(json_file, output_dir="./fine_tuned_bio_clinicalbert", epo
     tokenizer = AutoTokenizer.from_pretrained(model_name)
     model = AutoModelForMaskedLM.from_pretrained(model_name)
     
-    # Tokenize the dataset
-    print("Tokenizing dataset...")
-    def tokenize_function(examples):
-        return tokenizer(examples["text"], padding="max_length", truncation=True, max_length=128)
-
-    tokenized_dataset = dataset.map(tokenize_function, batched=True)
+    # Tokenize the dataset, or load it from the tokenization cache
+    tokenized_dataset = tokenize_corpus(dataset, tokenizer, max_length=128, num_proc=num_proc, cache_dir=cache_dir)
     
     # Split dataset into train and evaluation sets (80/20 split)
     tokenized_dataset = tokenized_dataset.train_test_split(test_size=0.2)
     
+    # Examples are not padded: the collator pads each batch to its longest example,
+    # and the Trainer builds batches from examples of similar length
+    print_padding_report(padding_report(tokenized_dataset["train"]["length"], batch_size, max_length=128))
+    
     # Data Collator for Masked Language Modeling (MLM)
     data_collator = DataCollatorForLanguageModeling(
         tokenizer=tokenizer, mlm=True, mlm_probability=0.15
     )
     
+    # Count the samples and tokens of each training batch for the metrics report
+    data_collator = InstrumentedCollator(data_collator, pad_token_id=tokenizer.pad_token_id)
+    metrics_callback = TrainingMetricsCallback(data_collator)
+    
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
     # Training Arguments
-    training_args = TrainingArguments(
+    training_args = dict(
         output_dir=output_dir,
         evaluation_strategy="epoch",
         save_strategy="epoch",
         per_device_train_batch_size=batch_size,
         per_device_eval_batch_size=batch_size,
+        group_by_length=True,
+        length_column_name="length",
         num_train_epochs=epochs,
+        logging_steps=10,
         logging_dir=os.path.join(output_dir, "logs"),
         learning_rate=learning_rate,
         weight_decay=0.01,
@@ -79,15 +95,18 @@ def fine_tune_biobert(json_file, output_dir="./fine_tuned_bio_clinicalbert", epo
         report_to="none",
         load_best_model_at_end=True
     )
+    # Thread settings must be in place before the model runs
+    cpu_run = apply_cpu_profile(cpu_options, training_args)
     
     # Initialize Trainer
     trainer = Trainer(
         model=model,
-        args=training_args,
+        args=TrainingArguments(**training_args),
         train_dataset=tokenized_dataset["train"],
         eval_dataset=tokenized_dataset["test"],
         tokenizer=tokenizer,
-        data_collator=data_collator
+        data_collator=data_collator,
+        callbacks=[metrics_callback]
     )
     
     # Fine-Tune the Model
@@ -98,6 +117,10 @@ def fine_tune_biobert(json_file, output_dir="./fine_tuned_bio_clinicalbert", epo
     print(f"Saving fine-tuned model to {output_dir}...")
     trainer.save_model(output_dir)
     tokenizer.save_pretrained(output_dir)
+    metrics_callback.save(output_dir, extra={"config": {
+        "batch_size": batch_size, "epochs": epochs, "learning_rate": learning_rate, "max_length": 128,
+        "profile": cpu_run["profile"], "cpu": cpu_run["cpu"]
+    }}, baseline=baseline)
     
     print(f"✅ Fine-tuning complete! Model saved at '{output_dir}'")
     return output_dir
@@ -142,6 +165,9 @@ def main():
     parser.add_argument("--epochs", type=int, default=3, help="Number of training epochs")
     parser.add_argument("--batch_size", type=int, default=8, help="Training batch size")
     parser.add_argument("--learning_rate", type=float, default=5e-5, help="Learning rate")
+    parser.add_argument("--num_proc", type=int, help="Processes for loading and tokenizing the corpus (default: one per CPU)")
+    parser.add_argument("--cache_dir", type=str, help="Directory of the tokenization cache")
+    add_cpu_profile_args(parser)
     parser.add_argument("--test", action="store_true", help="Test the model after fine-tuning")
     parser.add_argument("--test_text", type=str, help="Text to test the model with")
     
@@ -153,7 +179,10 @@ def main():
         output_dir=args.output_dir,
         epochs=args.epochs,
         batch_size=args.batch_size,
-        learning_rate=args.learning_rate
+        learning_rate=args.learning_rate,
+        num_proc=args.num_proc,
+        cache_dir=args.cache_dir,
+        cpu_options=args
     )
     
     # Test the model if requested
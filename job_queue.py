@@ -0,0 +1,263 @@
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Job states. "dead" jobs failed max_attempts times and are kept for inspection (dead letters).
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+DEAD = "dead"
+FINAL_STATES = (SUCCEEDED, DEAD)
+
+
+class JobQueue:
+    """A durable background job queue backed by SQLite
+
+    Jobs are stored with their payload, state and result, so they survive
+    restarts. Several processes (e.g. uvicorn workers) may share one
+    database: a job is claimed atomically by one of them and leased to it
+    for lease_seconds, renewed while it runs. Jobs whose lease ran out
+    because their process died are queued again by any live process, or
+    dead-lettered if that was their last attempt, since an attempt is
+    counted when the job is claimed. A fixed number of asyncio workers run
+    the handler registered for each job kind; failures are retried with
+    exponential backoff and moved to the dead state after max_attempts.
+    Finished jobs are deleted retention_seconds after they finished.
+    """
+
+    def __init__(self, db_path: str, workers: int = 4, max_attempts: int = 3, retry_backoff_seconds: float = 2.0,
+                 poll_interval_seconds: float = 1.0, lease_seconds: float = 60.0, retention_seconds: float = 7 * 86400):
+        """Initialize the queue
+
+        Args:
+            db_path: Path of the SQLite file holding the jobs
+            workers: Number of jobs run concurrently
+            max_attempts: Attempts before a job is dead-lettered
+            retry_backoff_seconds: Delay before the first retry, doubled on each further attempt
+            poll_interval_seconds: How often idle workers look for retries that became due
+            lease_seconds: How long a claimed job stays reserved for this process without a renewal
+            retention_seconds: How long succeeded and dead jobs are kept
+        """
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        # Identifies this process's leases
+        self._owner = uuid.uuid4().hex
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL, "
+            "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, run_after REAL NOT NULL, "
+            "lease_owner TEXT, lease_until REAL)"
+        )
+        # Databases created before leases existed
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in (("lease_owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status_run_after ON jobs (status, run_after)")
+        self._db.commit()
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        """Register the coroutine function that runs jobs of a kind
+
+        Args:
+            kind: The job kind
+            handler: Coroutine function taking the job payload and returning a JSON-serializable result
+        """
+        self._handlers[kind] = handler
+
+    async def start(self):
+        """Recover jobs whose process died and start the workers"""
+        self._maintain()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+
+    async def stop(self):
+        """Stop the workers; jobs they were running are queued again, without using up an attempt"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts - 1, lease_owner = NULL, lease_until = NULL, "
+                "run_after = ?, updated_at = ? WHERE status = ? AND lease_owner = ?",
+                (QUEUED, time.time(), time.time(), RUNNING, self._owner)
+            )
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        """Queue a job
+
+        Args:
+            kind: The job kind, which must have a registered handler
+            payload: JSON-serializable job input
+
+        Returns:
+            The id of the new job
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind: {kind}")
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at, run_after) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), now, now, now)
+            )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the public state of a job, or None if it does not exist"""
+        row = self._db.execute(
+            "SELECT id, kind, status, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        job_id, kind, status, result, error, attempts, created_at, updated_at = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "attempts": attempts,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Wait until a job reaches a final state
+
+        Args:
+            job_id: The job id
+            timeout: Maximum seconds to wait, None to wait indefinitely
+
+        Returns:
+            The job state (possibly still unfinished if the timeout expired), or None if it does not exist
+        """
+        job = self.get(job_id)
+        if job is None or job["status"] in FINAL_STATES:
+            return job
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, []).append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(job_id, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(job_id, None)
+        return self.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return job counts per state for the metrics endpoint"""
+        counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in (QUEUED, RUNNING, SUCCEEDED, DEAD)}
+
+    def _claim_next(self) -> Optional[tuple]:
+        # A single statement, so no other process can claim the same job in between
+        now = time.time()
+        with self._db:
+            return self._db.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_until = ?, updated_at = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = ? AND run_after <= ? ORDER BY run_after LIMIT 1) "
+                "AND status = ? RETURNING id, kind, payload, attempts",
+                (RUNNING, self._owner, now + self.lease_seconds, now, QUEUED, now, QUEUED)
+            ).fetchone()
+
+    def _maintain(self):
+        """Renew this process's leases, recover jobs with expired leases and purge old finished jobs"""
+        now = time.time()
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE status = ? AND lease_owner = ?",
+                (now + self.lease_seconds, RUNNING, self._owner)
+            )
+            # The process running these died; the attempt it was making counts
+            expired = "status = ? AND (lease_until IS NULL OR lease_until < ?)"
+            self._db.execute(
+                f"UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, lease_until = NULL, updated_at = ? "
+                f"WHERE {expired} AND attempts >= ?",
+                (DEAD, "Interrupted on its last attempt", now, RUNNING, now, self.max_attempts)
+            )
+            self._db.execute(
+                f"UPDATE jobs SET status = ?, lease_owner = NULL, lease_until = NULL, run_after = ?, updated_at = ? "
+                f"WHERE {expired}",
+                (QUEUED, now, now, RUNNING, now)
+            )
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (SUCCEEDED, DEAD, now - self.retention_seconds)
+            )
+
+    async def _maintenance(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                self._maintain()
+            except sqlite3.Error as e:
+                print(f"Job queue maintenance failed: {str(e)}")
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None, run_after: float = 0.0):
+        with self._db:
+            # Unless the lease was lost and another process took the job over
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, run_after = ?, "
+                "lease_owner = NULL, lease_until = NULL WHERE id = ? AND lease_owner = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), run_after, job_id, self._owner)
+            )
+        if status in FINAL_STATES:
+            for future in self._waiters.pop(job_id, []):
+                if not future.done():
+                    future.set_result(None)
+
+    async def _worker(self):
+        while True:
+            job = self._claim_next()
+            if job is None:
+                # Sleep until a job is submitted, or until a delayed retry may have become due
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, kind, payload, attempts = job
+            try:
+                result = await self._handlers[kind](json.loads(payload))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job {job_id} ({kind}) failed on attempt {attempts}: {str(e)}")
+                if attempts >= self.max_attempts:
+                    self._finish(job_id, DEAD, error=str(e))
+                else:
+                    retry_at = time.time() + self.retry_backoff_seconds * 2 ** (attempts - 1)
+                    self._finish(job_id, QUEUED, error=str(e), run_after=retry_at)
+                continue
+
+            self._finish(job_id, SUCCEEDED, result=result)
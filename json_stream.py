@@ -0,0 +1,171 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class StreamingJSONParser:
+    """
+    Incrementally parse a JSON object from streamed LLM output
+
+    Any prose before the opening brace is ignored. Each call to feed()
+    returns the events that became complete with the new text:
+
+    - ("field", key, value) for a top-level field of the object
+    - ("item", key, value) for an element of a top-level array field listed
+      in item_fields, as soon as that element is complete
+
+    If the output is cut off or malformed, result() recovers the fields and
+    array elements that were complete.
+    """
+
+    def __init__(self, item_fields: Iterable[str] = ("metrics", "insights")):
+        self.item_fields = set(item_fields)
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.key = None
+        self.expect = "key"
+        self.field_start = None
+        self.item_start = None
+        self.in_items = False
+        self.object_start = None
+        self.object_end = None
+        self.fields: Dict[str, Any] = {}
+        self.items: Dict[str, List[Any]] = {}
+        self.recovered = False
+
+    @property
+    def json_text(self) -> str:
+        """The text of the top-level object, without surrounding prose"""
+        if self.object_start is None:
+            return self.text
+        return self.text[self.object_start:self.object_end]
+
+    def feed(self, chunk: str) -> List[Tuple[str, str, Any]]:
+        """
+        Consume the next fragment of the output
+
+        Returns:
+            List: The ("field" | "item", key, value) events completed by this fragment
+        """
+        self.text += chunk
+        events = []
+        text = self.text
+
+        for i in range(self.pos, len(text)):
+            char = text[i]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.expect == "key":
+                        self.key = json.loads(text[self.field_start:i + 1])
+                        self.field_start = None
+                        self.expect = "colon"
+                    elif self.depth == 1 and self.expect == "value":
+                        self._field(text[self.field_start:i + 1], events)
+                    elif self.depth == 2 and self.item_start is not None:
+                        self._item(text[self.item_start:i + 1], events)
+                continue
+
+            # Skip anything outside the top-level object
+            if self.depth == 0 and (char != "{" or self.object_end is not None):
+                continue
+            if self.depth == 0:
+                self.object_start = i
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.field_start is None:
+                    self.field_start = i
+                elif self.depth == 2 and self.in_items and self.item_start is None:
+                    self.item_start = i
+            elif char in "{[":
+                if self.depth == 1 and self.field_start is None:
+                    self.field_start = i
+                    self.in_items = char == "[" and self.key in self.item_fields
+                elif self.depth == 2 and self.in_items and self.item_start is None:
+                    self.item_start = i
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 2 and self.item_start is not None:
+                    self._item(text[self.item_start:i + 1], events)
+                elif self.depth == 1:
+                    # A scalar last element is only terminated by the closing bracket
+                    if self.item_start is not None:
+                        self._item(text[self.item_start:i], events)
+                    if self.field_start is not None:
+                        self._field(text[self.field_start:i + 1], events)
+                elif self.depth == 0:
+                    if self.field_start is not None:
+                        self._field(text[self.field_start:i], events)
+                    self.object_end = i + 1
+            elif self.depth == 1:
+                if char == ":":
+                    self.expect = "value"
+                elif char == ",":
+                    if self.field_start is not None:
+                        self._field(text[self.field_start:i], events)
+                    self.expect = "key"
+                elif not char.isspace() and self.field_start is None and self.expect == "value":
+                    self.field_start = i
+            elif self.depth == 2 and self.in_items:
+                if char == ",":
+                    if self.item_start is not None:
+                        self._item(text[self.item_start:i], events)
+                elif not char.isspace() and self.item_start is None:
+                    self.item_start = i
+
+        self.pos = len(text)
+        return events
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        """
+        Return the parsed object
+
+        If the object is incomplete or invalid, the complete fields and array
+        elements seen so far are returned instead and recovered is set.
+
+        Returns:
+            Dict: The (possibly partial) object, or None if nothing could be parsed
+        """
+        if self.object_end is not None:
+            try:
+                return json.loads(self.json_text)
+            except json.JSONDecodeError:
+                pass
+
+        partial = dict(self.fields)
+        for key, values in self.items.items():
+            if key not in partial and values:
+                partial[key] = list(values)
+
+        self.recovered = True
+        return partial or None
+
+    def _field(self, raw: str, events: List[Tuple[str, str, Any]]):
+        self.field_start = None
+        self.item_start = None
+        self.in_items = False
+        self.expect = "done"
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        self.fields[self.key] = value
+        events.append(("field", self.key, value))
+
+    def _item(self, raw: str, events: List[Tuple[str, str, Any]]):
+        self.item_start = None
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        self.items.setdefault(self.key, []).append(value)
+        events.append(("item", self.key, value))
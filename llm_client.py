@@ -0,0 +1,144 @@
+import json
+import os
+from typing import Dict, Any, AsyncIterator, Optional
+
+import httpx
+import orjson
+
+from llm_scheduler import Grant, LLMScheduler
+from prompt_builder import estimate_tokens
+
+# Anthropic API configuration
+ANTHROPIC_API_KEY = "sk-ant-REDACTED"
+# Point ANTHROPIC_API_URL at a local stub of the messages API to test or benchmark without upstream calls
+ANTHROPIC_API_URL = os.environ.get("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
+
+# Every upstream call goes through this scheduler, so bursts of background work
+# cannot use up the rate limits interactive requests depend on
+scheduler = LLMScheduler(
+    requests_per_minute=float(os.environ.get("LLM_REQUESTS_PER_MINUTE", "50")),
+    input_tokens_per_minute=float(os.environ.get("LLM_INPUT_TOKENS_PER_MINUTE", "50000")),
+    output_tokens_per_minute=float(os.environ.get("LLM_OUTPUT_TOKENS_PER_MINUTE", "10000")),
+    aging_seconds=float(os.environ.get("LLM_PRIORITY_AGING_SECONDS", "30"))
+)
+
+# Seconds to hold all calls after a 429 without a Retry-After header
+DEFAULT_RETRY_AFTER_SECONDS = 10.0
+
+
+def anthropic_headers() -> Dict[str, str]:
+    """Return the headers required by the Anthropic messages API"""
+    return {
+        "x-api-key": ANTHROPIC_API_KEY,
+        "Content-Type": "application/json",
+        "anthropic-version": "2023-06-01"
+    }
+
+
+def estimate_payload_tokens(payload: Dict[str, Any]) -> int:
+    """Estimate the input tokens of a messages API request body"""
+    return estimate_tokens(json.dumps(payload.get("system", "")) + json.dumps(payload.get("messages", [])))
+
+
+def settle_usage(grant: Grant, response: httpx.Response, usage: Dict[str, Any] = None):
+    """Report the outcome of an upstream call to the scheduler
+
+    Args:
+        grant: The scheduler grant the call was made under
+        response: The HTTP response
+        usage: The "usage" object of the completion, if known
+    """
+    if response.status_code == 429:
+        retry_after = response.headers.get("retry-after")
+        grant.throttled(float(retry_after) if retry_after else DEFAULT_RETRY_AFTER_SECONDS)
+    elif usage:
+        grant.record_usage(
+            input_tokens=usage.get("input_tokens", 0) + usage.get("cache_creation_input_tokens", 0),
+            output_tokens=usage.get("output_tokens")
+        )
+
+
+async def post_message(payload: Dict[str, Any], priority: str = "background") -> httpx.Response:
+    """Send a (non-streaming) request to the Anthropic messages API
+
+    Args:
+        payload: The messages API request body
+        priority: Scheduler priority class ("chat", "analyze" or "background")
+
+    Returns:
+        The raw HTTP response
+    """
+    async with scheduler.slot(priority, estimate_payload_tokens(payload), payload.get("max_tokens", 1024)) as grant:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(ANTHROPIC_API_URL, json=payload, headers=anthropic_headers())
+        settle_usage(grant, response, response.json().get("usage") if response.status_code == 200 else None)
+        return response
+
+
+async def stream_message_text(payload: Dict[str, Any], priority: str = "background",
+                              message: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    """Stream a completion from the Anthropic messages API
+
+    Yields text deltas as they arrive. Closing the generator (e.g. because
+    the downstream client disconnected) closes the upstream connection.
+
+    Args:
+        payload: The messages API request body, without the "stream" flag
+        priority: Scheduler priority class ("chat", "analyze" or "background")
+        message: Optional dict that receives the "stop_reason" of the completion
+            ("end_turn" when Claude finished, "max_tokens" when it was cut off)
+
+    Yields:
+        Text fragments of the completion
+
+    Raises:
+        httpx.HTTPStatusError: If the API answers with a non-200 status
+    """
+    payload = {**payload, "stream": True}
+    usage = {}
+
+    async with scheduler.slot(priority, estimate_payload_tokens(payload), payload.get("max_tokens", 1024)) as grant:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=60.0)) as client:
+            async with client.stream("POST", ANTHROPIC_API_URL, json=payload, headers=anthropic_headers()) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    settle_usage(grant, response)
+                    raise httpx.HTTPStatusError(response.text, request=response.request, response=response)
+
+                async for line in response.aiter_lines():
+                    # Server-sent events: we only need the JSON carried by "data:" lines
+                    if not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[len("data:"):].strip())
+                    event_type = event.get("type")
+
+                    if event_type == "content_block_delta":
+                        text = event.get("delta", {}).get("text")
+                        if text:
+                            yield text
+                    elif event_type == "message_start":
+                        usage.update(event.get("message", {}).get("usage", {}))
+                    elif event_type == "message_delta":
+                        usage.update(event.get("usage", {}))
+                        if message is not None and "stop_reason" in event.get("delta", {}):
+                            message["stop_reason"] = event["delta"]["stop_reason"]
+                    elif event_type == "message_stop":
+                        break
+                    elif event_type == "error":
+                        raise RuntimeError(event.get("error", {}).get("message", "Upstream stream error"))
+
+                settle_usage(grant, response, usage)
+
+
+def sse_event(data: Any, event: str = None) -> str:
+    """Format one server-sent event
+
+    Args:
+        data: JSON-serializable event payload
+        event: Optional event name
+
+    Returns:
+        The encoded event, terminated by a blank line
+    """
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {orjson.dumps(data).decode()}\n\n"
@@ -0,0 +1,237 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+# Priority classes, most urgent first
+PRIORITIES = ("chat", "analyze", "background")
+
+
+class TokenBucket:
+    """A token bucket refilled continuously at a per-minute rate"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Return the seconds until amount tokens are available (0 if they are now)"""
+        self._refill()
+        # A single request larger than the bucket would never fit, so it waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class Grant:
+    """Admission of one upstream call; used to settle the token estimate against actual usage"""
+
+    def __init__(self, scheduler: "LLMScheduler", priority: str, input_tokens: int, output_tokens: int, waited: float):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.waited = waited
+        self.settled = False
+
+    def record_usage(self, input_tokens: Optional[int] = None, output_tokens: Optional[int] = None):
+        """Give back tokens that were reserved but not used (or charge extra ones)"""
+        self.settled = True
+        if input_tokens is not None:
+            self.scheduler.input_bucket.give_back(self.input_tokens - input_tokens)
+            self.input_tokens = input_tokens
+        if output_tokens is not None:
+            self.scheduler.output_bucket.give_back(self.output_tokens - output_tokens)
+            self.output_tokens = output_tokens
+        self.scheduler._dispatch()
+
+    def throttled(self, retry_after: float):
+        """Report a 429 from upstream: hold every class until retry_after seconds have passed"""
+        self.settled = True
+        self.scheduler.pause(retry_after)
+
+
+class LLMScheduler:
+    """
+    Admit outbound LLM calls by priority within per-minute rate limits
+
+    Calls wait in one FIFO queue per priority class and are admitted when
+    the request, input-token and output-token buckets can all cover their
+    estimated cost. Classes are served in strict priority order, so
+    background work only uses capacity interactive calls leave over; a
+    waiting call gains one class of priority every aging_seconds, so it is
+    never starved.
+
+    A call that ends without reporting its usage (e.g. because it failed)
+    gets its output-token reservation back; one cancelled after it was
+    admitted, but before it could be made, gets its whole reservation back.
+    """
+
+    def __init__(self, requests_per_minute: float = 50, input_tokens_per_minute: float = 50000,
+                 output_tokens_per_minute: float = 10000, aging_seconds: float = 30.0):
+        """
+        Args:
+            requests_per_minute: Upstream request rate limit
+            input_tokens_per_minute: Upstream input token rate limit
+            output_tokens_per_minute: Upstream output token rate limit
+            aging_seconds: Waiting time after which a call is promoted by one priority class
+        """
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.input_bucket = TokenBucket(input_tokens_per_minute)
+        self.output_bucket = TokenBucket(output_tokens_per_minute)
+        self.aging_seconds = aging_seconds
+
+        self._queues: Dict[str, Deque[List[Any]]] = {priority: deque() for priority in PRIORITIES}
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+
+        self.granted = {priority: 0 for priority in PRIORITIES}
+        self.throttled = 0
+        self._wait_times = {priority: deque(maxlen=1000) for priority in PRIORITIES}
+
+    @asynccontextmanager
+    async def slot(self, priority: str, input_tokens: int, output_tokens: int) -> AsyncIterator[Grant]:
+        """
+        Wait for admission of an upstream call
+
+        Args:
+            priority: One of PRIORITIES
+            input_tokens: Estimated input tokens of the call
+            output_tokens: Maximum output tokens of the call (max_tokens)
+
+        Yields:
+            Grant: Lets the caller report actual usage or upstream throttling
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        enqueued = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        entry = [next(self._sequence), enqueued, input_tokens, output_tokens, future]
+        self._queues[priority].append(entry)
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if entry in self._queues[priority]:
+                self._queues[priority].remove(entry)
+            elif future.done() and not future.cancelled():
+                # Admitted just before the cancellation: the call is never made
+                self.request_bucket.give_back(1)
+                self.input_bucket.give_back(input_tokens)
+                self.output_bucket.give_back(output_tokens)
+            self._dispatch()
+            raise
+
+        waited = time.monotonic() - enqueued
+        self._wait_times[priority].append(waited)
+        self.granted[priority] += 1
+        grant = Grant(self, priority, input_tokens, output_tokens, waited)
+        try:
+            yield grant
+        finally:
+            if not grant.settled:
+                # The request may have reached upstream, but produced no output we know of
+                grant.record_usage(output_tokens=0)
+
+    def pause(self, seconds: float):
+        """Stop admitting calls for a while, e.g. after the API answered 429"""
+        self.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        for bucket in (self.request_bucket, self.input_bucket, self.output_bucket):
+            bucket.drain()
+
+    def _next_entry(self) -> Optional[str]:
+        # Highest effective priority first (aging promotes long waits), FIFO within a class
+        now = time.monotonic()
+        best = None
+        for rank, priority in enumerate(PRIORITIES):
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            sequence, enqueued = queue[0][0], queue[0][1]
+            effective = rank - int((now - enqueued) / self.aging_seconds)
+            if best is None or (effective, sequence) < best[0]:
+                best = ((effective, sequence), priority)
+        return best[1] if best else None
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while True:
+            priority = self._next_entry()
+            if priority is None:
+                return
+
+            _, _, input_tokens, output_tokens, future = self._queues[priority][0]
+            if future.done():
+                self._queues[priority].popleft()
+                continue
+
+            delay = max(
+                self._paused_until - time.monotonic(),
+                self.request_bucket.delay(1),
+                self.input_bucket.delay(input_tokens),
+                self.output_bucket.delay(output_tokens),
+            )
+            if delay > 0:
+                # Later calls wait too, so a large background call cannot be overtaken forever
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+
+            self._queues[priority].popleft()
+            self.request_bucket.take(1)
+            self.input_bucket.take(input_tokens)
+            self.output_bucket.take(output_tokens)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depths, wait times and bucket levels for the metrics endpoint"""
+        classes = {}
+        for priority in PRIORITIES:
+            waits = sorted(self._wait_times[priority])
+            classes[priority] = {
+                "queued": len(self._queues[priority]),
+                "granted": self.granted[priority],
+                "wait_ms_mean": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                "wait_ms_p95": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+                "wait_ms_max": round(1000 * waits[-1], 1) if waits else 0.0,
+            }
+
+        for bucket in (self.request_bucket, self.input_bucket, self.output_bucket):
+            bucket._refill()
+        return {
+            "classes": classes,
+            "throttled": self.throttled,
+            "available": {
+                "requests": round(self.request_bucket.tokens, 1),
+                "input_tokens": round(self.input_bucket.tokens),
+                "output_tokens": round(self.output_bucket.tokens),
+            },
+        }
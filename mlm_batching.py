@@ -0,0 +1,165 @@
+import random
+from typing import Any, Dict, List, Sequence
+
+
+def padded_tokens(lengths: Sequence[int], batches: List[List[int]]) -> int:
+    """Count the tokens of batches padded to their longest example"""
+    return sum(max(lengths[i] for i in batch) * len(batch) for batch in batches if batch)
+
+
+def padding_report(lengths: Sequence[int], batch_size: int, max_length: int, seed: int = 42) -> Dict[str, Any]:
+    """
+    Compare the share of real (non-pad) tokens under three batching schemes
+
+    - static: every example padded to max_length, as the scripts used to do
+    - dynamic: random batches padded to their longest example by the collator
+    - grouped: batches of similar lengths (the Trainer's group_by_length), padded by the collator
+
+    Args:
+        lengths: Tokens per example
+        batch_size: Training batch size
+        max_length: The static padding length
+        seed: Seed of the simulated shuffles
+
+    Returns:
+        Dict with the real token count and, per scheme, the total tokens and real fraction
+    """
+    from transformers.trainer_pt_utils import get_length_grouped_indices
+    import torch
+
+    real = sum(lengths)
+    indices = list(range(len(lengths)))
+    random.Random(seed).shuffle(indices)
+    grouped = get_length_grouped_indices(lengths, batch_size, generator=torch.Generator().manual_seed(seed))
+
+    totals = {
+        "static": len(lengths) * max_length,
+        "dynamic": padded_tokens(lengths, [indices[i:i + batch_size] for i in range(0, len(indices), batch_size)]),
+        "grouped": padded_tokens(lengths, [grouped[i:i + batch_size] for i in range(0, len(grouped), batch_size)]),
+    }
+    return {
+        "examples": len(lengths),
+        "real_tokens": real,
+        **{
+            scheme: {"tokens": total, "real_fraction": round(real / total, 4) if total else 0.0}
+            for scheme, total in totals.items()
+        },
+    }
+
+
+def print_padding_report(report: Dict[str, Any]):
+    """Print a padding_report"""
+    print(f"Padding report for {report['examples']} examples ({report['real_tokens']} real tokens):")
+    for scheme, label in (("static", "padded to max_length"), ("dynamic", "dynamic padding"), ("grouped", "dynamic padding, grouped by length")):
+        print(f"  {label}: {report[scheme]['tokens']} tokens, {report[scheme]['real_fraction']:.1%} real")
+
+
+def pack_examples(examples: Dict[str, List[List[int]]], block_size: int, isolate_documents: bool = False) -> Dict[str, List[List[int]]]:
+    """
+    Pack tokenized reports into blocks of up to block_size tokens
+
+    Reports are kept whole, with their own [CLS] and [SEP] tokens marking
+    where each one starts and ends, and placed in order: a report that does
+    not fit in the current block starts the next one. Used with
+    Dataset.map(batched=True).
+
+    Args:
+        examples: A batch of tokenized examples ("input_ids")
+        block_size: Maximum tokens per block; longer reports are truncated
+        isolate_documents: Also return "document_ids", the index of the report each token belongs to
+
+    Returns:
+        The blocks, as "input_ids" and "token_type_ids" (plus "document_ids")
+    """
+    blocks = {"input_ids": [], "token_type_ids": []}
+    if isolate_documents:
+        blocks["document_ids"] = []
+    block_ids: List[int] = []
+    block_documents: List[int] = []
+
+    def flush():
+        blocks["input_ids"].append(block_ids)
+        blocks["token_type_ids"].append([0] * len(block_ids))
+        if isolate_documents:
+            blocks["document_ids"].append(block_documents)
+
+    for input_ids in examples["input_ids"]:
+        input_ids = input_ids[:block_size]
+        if block_ids and len(block_ids) + len(input_ids) > block_size:
+            flush()
+            block_ids, block_documents = [], []
+        document = block_documents[-1] + 1 if block_documents else 0
+        block_ids = block_ids + list(input_ids)
+        block_documents = block_documents + [document] * len(input_ids)
+    if block_ids:
+        flush()
+    return blocks
+
+
+def pack_dataset(dataset, block_size: int, isolate_documents: bool = False, num_proc=None):
+    """
+    Pack a tokenized dataset into blocks for MLM training (see pack_examples)
+
+    Args:
+        dataset: A tokenized Dataset
+        block_size: Maximum tokens per block
+        isolate_documents: Keep the "document_ids" used by PackedMLMCollator to isolate attention
+        num_proc: Processes used for packing
+
+    Returns:
+        The packed Dataset
+    """
+    packed = dataset.map(
+        pack_examples,
+        batched=True,
+        fn_kwargs={"block_size": block_size, "isolate_documents": isolate_documents},
+        num_proc=num_proc,
+        remove_columns=dataset.column_names
+    )
+    real = sum(dataset["length"]) if "length" in dataset.column_names else None
+    if real is not None and len(packed):
+        print(f"Packed {len(dataset)} examples into {len(packed)} blocks of up to {block_size} tokens "
+              f"({real / (len(packed) * block_size):.1%} real tokens)")
+    return packed
+
+
+class PackedMLMCollator:
+    """
+    MLM collator for packed blocks that can keep attention within each report
+
+    Masking and padding are done by DataCollatorForLanguageModeling. With
+    isolate_documents, the attention mask becomes a [batch, seq, seq] mask
+    that only lets tokens attend to tokens of the same report, and position
+    ids restart at each report, so each report is seen as if it were alone.
+    """
+
+    def __init__(self, tokenizer, mlm_probability: float = 0.15, isolate_documents: bool = False):
+        from transformers import DataCollatorForLanguageModeling
+
+        self.collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=True, mlm_probability=mlm_probability)
+        self.isolate_documents = isolate_documents
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+        import torch
+
+        document_ids = [feature.get("document_ids") for feature in features]
+        batch = self.collator([{key: value for key, value in feature.items() if key != "document_ids"} for feature in features])
+        if not self.isolate_documents or any(ids is None for ids in document_ids):
+            return batch
+
+        # Padding gets document -1, so it attends to nothing and nothing attends to it
+        seq_length = batch["input_ids"].shape[1]
+        documents = torch.full((len(features), seq_length), -1, dtype=torch.long)
+        for row, ids in enumerate(document_ids):
+            documents[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        valid = documents >= 0
+        batch["attention_mask"] = (
+            (documents[:, :, None] == documents[:, None, :]) & valid[:, :, None] & valid[:, None, :]
+        ).long()
+
+        # Positions count from the first token of each report
+        positions = torch.arange(seq_length).expand(len(features), seq_length)
+        starts = torch.ones_like(documents, dtype=torch.bool)
+        starts[:, 1:] = documents[:, 1:] != documents[:, :-1]
+        batch["position_ids"] = positions - torch.cummax(positions * starts, dim=1).values
+        return batch
@@ -0,0 +1,641 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import PyPDF2
+
+# On-disk cache of extracted page text, shared by all worker processes. It holds
+# patient data, so it is off unless PDF_PAGE_CACHE_DIR names a directory for it;
+# the directory is made private to the server's user (0700, database file 0600).
+PAGE_CACHE_DIR = os.environ.get("PDF_PAGE_CACHE_DIR", "")
+PAGE_CACHE_FILE = "pdf_page_cache.sqlite3"
+# Documents kept at most, and days a document is kept after it was last seen
+PAGE_CACHE_MAX_DOCUMENTS = int(os.environ.get("PDF_PAGE_CACHE_MAX_DOCUMENTS", "1000"))
+PAGE_CACHE_MAX_AGE_DAYS = float(os.environ.get("PDF_PAGE_CACHE_MAX_AGE_DAYS", "7"))
+
+# Common medical test patterns for extraction
+MEDICAL_PATTERNS = {
+    "glucose": r"(?:glucose|blood\s+sugar)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
+    "cholesterol": r"(?:total\s+cholesterol|cholesterol)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
+    "hdl": r"(?:hdl|hdl-c|high\s+density\s+lipoprotein)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
+    "ldl": r"(?:ldl|ldl-c|low\s+density\s+lipoprotein)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
+    "triglycerides": r"(?:triglycerides|tg)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
+    "a1c": r"(?:a1c|hba1c|glycated\s+hemoglobin)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(%|mmol/mol)?",
+    "blood_pressure": r"(?:blood\s+pressure|bp)\s*[:-]?\s*(\d+)\s*[/]\s*(\d+)\s*(mmHg)?",
+    "heart_rate": r"(?:heart\s+rate|pulse)\s*[:-]?\s*(\d+)\s*(bpm)?",
+    "weight": r"(?:weight|wt)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(kg|lbs)?",
+    "height": r"(?:height|ht)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(cm|m|ft|in)?",
+    "bmi": r"(?:bmi|body\s+mass\s+index)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(kg/m2)?",
+    "creatinine": r"(?:creatinine|cr)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|μmol/L)?",
+    "egfr": r"(?:egfr|estimated\s+glomerular\s+filtration\s+rate)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mL/min/1.73m2)?",
+    "tsh": r"(?:tsh|thyroid\s+stimulating\s+hormone)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mIU/L|μIU/mL)?",
+    "vitamin_d": r"(?:vitamin\s+d|25-oh\s+vitamin\s+d)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(ng/mL|nmol/L)?",
+    "iron": r"(?:iron|fe)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(μg/dL|μmol/L)?",
+    "ferritin": r"(?:ferritin)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(ng/mL|μg/L)?",
+    "wbc": r"(?:wbc|white\s+blood\s+cells|leukocytes)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(×10\^9/L|×10\^3/μL)?",
+    "rbc": r"(?:rbc|red\s+blood\s+cells|erythrocytes)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(×10\^12/L|×10\^6/μL)?",
+    "hemoglobin": r"(?:hemoglobin|hgb|hb)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(g/dL|g/L)?",
+    "hematocrit": r"(?:hematocrit|hct)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(%|L/L)?",
+    "platelets": r"(?:platelets|plt)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(×10\^9/L|×10\^3/μL)?",
+    "sodium": r"(?:sodium|na)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mmol/L|mEq/L)?",
+    "potassium": r"(?:potassium|k)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mmol/L|mEq/L)?",
+    "chloride": r"(?:chloride|cl)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mmol/L|mEq/L)?",
+    "calcium": r"(?:calcium|ca)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
+    "magnesium": r"(?:magnesium|mg)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
+    "phosphorus": r"(?:phosphorus|p)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|mmol/L)?",
+    "uric_acid": r"(?:uric\s+acid)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|μmol/L)?",
+    "alt": r"(?:alt|alanine\s+aminotransferase|sgpt)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(U/L|IU/L)?",
+    "ast": r"(?:ast|aspartate\s+aminotransferase|sgot)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(U/L|IU/L)?",
+    "alp": r"(?:alp|alkaline\s+phosphatase)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(U/L|IU/L)?",
+    "ggt": r"(?:ggt|gamma-glutamyl\s+transferase)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(U/L|IU/L)?",
+    "bilirubin": r"(?:total\s+bilirubin|bilirubin)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mg/dL|μmol/L)?",
+    "protein": r"(?:total\s+protein|protein)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(g/dL|g/L)?",
+    "albumin": r"(?:albumin|alb)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(g/dL|g/L)?",
+    "globulin": r"(?:globulin|glob)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(g/dL|g/L)?",
+    "psa": r"(?:psa|prostate\s+specific\s+antigen)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(ng/mL|μg/L)?",
+    "cea": r"(?:cea|carcinoembryonic\s+antigen)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(ng/mL|μg/L)?",
+    "afp": r"(?:afp|alpha-fetoprotein)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(ng/mL|μg/L)?",
+    "ca125": r"(?:ca125|ca-125|cancer\s+antigen\s+125)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(U/mL|kU/L)?",
+    "ca19_9": r"(?:ca19-9|ca19_9|cancer\s+antigen\s+19-9)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(U/mL|kU/L)?",
+    "hcg": r"(?:hcg|human\s+chorionic\s+gonadotropin)\s*[:-]?\s*(\d+(?:\.\d+)?)\s*(mIU/mL|IU/L)?",
+}
+
+# Reference ranges for common medical tests
+REFERENCE_RANGES = {
+    "glucose": {"min": 70, "max": 99, "unit": "mg/dL"},
+    "cholesterol": {"min": 125, "max": 200, "unit": "mg/dL"},
+    "hdl": {"min": 40, "max": 60, "unit": "mg/dL"},
+    "ldl": {"min": 0, "max": 100, "unit": "mg/dL"},
+    "triglycerides": {"min": 0, "max": 150, "unit": "mg/dL"},
+    "a1c": {"min": 4.0, "max": 5.6, "unit": "%"},
+    "blood_pressure_systolic": {"min": 90, "max": 120, "unit": "mmHg"},
+    "blood_pressure_diastolic": {"min": 60, "max": 80, "unit": "mmHg"},
+    "heart_rate": {"min": 60, "max": 100, "unit": "bpm"},
+    "bmi": {"min": 18.5, "max": 24.9, "unit": "kg/m2"},
+    "creatinine_male": {"min": 0.74, "max": 1.35, "unit": "mg/dL"},
+    "creatinine_female": {"min": 0.59, "max": 1.04, "unit": "mg/dL"},
+    "egfr": {"min": 90, "max": 120, "unit": "mL/min/1.73m2"},
+    "tsh": {"min": 0.4, "max": 4.0, "unit": "mIU/L"},
+    "vitamin_d": {"min": 30, "max": 100, "unit": "ng/mL"},
+    "iron": {"min": 65, "max": 175, "unit": "μg/dL"},
+    "ferritin_male": {"min": 30, "max": 400, "unit": "ng/mL"},
+    "ferritin_female": {"min": 15, "max": 150, "unit": "ng/mL"},
+    "wbc": {"min": 4.5, "max": 11.0, "unit": "×10^9/L"},
+    "rbc_male": {"min": 4.7, "max": 6.1, "unit": "×10^12/L"},
+    "rbc_female": {"min": 4.2, "max": 5.4, "unit": "×10^12/L"},
+    "hemoglobin_male": {"min": 13.5, "max": 17.5, "unit": "g/dL"},
+    "hemoglobin_female": {"min": 12.0, "max": 15.5, "unit": "g/dL"},
+    "hematocrit_male": {"min": 41, "max": 50, "unit": "%"},
+    "hematocrit_female": {"min": 36, "max": 44, "unit": "%"},
+    "platelets": {"min": 150, "max": 450, "unit": "×10^9/L"},
+    "sodium": {"min": 135, "max": 145, "unit": "mmol/L"},
+    "potassium": {"min": 3.5, "max": 5.0, "unit": "mmol/L"},
+    "chloride": {"min": 98, "max": 107, "unit": "mmol/L"},
+    "calcium": {"min": 8.5, "max": 10.5, "unit": "mg/dL"},
+    "magnesium": {"min": 1.7, "max": 2.2, "unit": "mg/dL"},
+    "phosphorus": {"min": 2.5, "max": 4.5, "unit": "mg/dL"},
+    "uric_acid_male": {"min": 3.4, "max": 7.0, "unit": "mg/dL"},
+    "uric_acid_female": {"min": 2.4, "max": 6.0, "unit": "mg/dL"},
+    "alt": {"min": 7, "max": 55, "unit": "U/L"},
+    "ast": {"min": 8, "max": 48, "unit": "U/L"},
+    "alp": {"min": 40, "max": 129, "unit": "U/L"},
+    "ggt": {"min": 8, "max": 61, "unit": "U/L"},
+    "bilirubin": {"min": 0.1, "max": 1.2, "unit": "mg/dL"},
+    "protein": {"min": 6.0, "max": 8.3, "unit": "g/dL"},
+    "albumin": {"min": 3.5, "max": 5.0, "unit": "g/dL"},
+    "globulin": {"min": 2.0, "max": 3.5, "unit": "g/dL"},
+    "psa_male": {"min": 0, "max": 4.0, "unit": "ng/mL"}
+}
+
+
+def extract_text_from_pdf(pdf_file) -> str:
+    """
+    Extract text from a PDF file using PyPDF2
+    
+    Args:
+        pdf_file: The PDF file object
+        
+    Returns:
+        str: The extracted text from the PDF
+    """
+    try:
+        # Extract text from each page, joining once at the end (linear in the document size)
+        return "".join(text + "\n\n" for _, text in iter_pdf_pages(pdf_file))
+    except Exception as e:
+        print(f"Error extracting text from PDF: {str(e)}")
+        return ""
+
+
+def extract_medical_data(text: str) -> Dict[str, Any]:
+    """
+    Extract medical data from text using regex patterns
+    
+    Args:
+        text: The text to extract data from
+        
+    Returns:
+        Dict: The extracted medical data
+    """
+    extracted_data = {}
+    metrics = []
+    
+    # Convert text to lowercase for case-insensitive matching
+    text_lower = text.lower()
+    
+    # Extract metrics using regex patterns
+    for metric_name, pattern in MEDICAL_PATTERNS.items():
+        matches = re.findall(pattern, text_lower)
+        
+        if matches:
+            # Handle special case for blood pressure which has two values
+            if metric_name == "blood_pressure" and len(matches[0]) >= 2:
+                systolic, diastolic = matches[0][0], matches[0][1]
+                unit = matches[0][2] if len(matches[0]) > 2 and matches[0][2] else "mmHg"
+                
+                # Add systolic blood pressure
+                systolic_value = float(systolic)
+                systolic_status = "normal"
+                if systolic_value < REFERENCE_RANGES["blood_pressure_systolic"]["min"]:
+                    systolic_status = "caution"
+                elif systolic_value > REFERENCE_RANGES["blood_pressure_systolic"]["max"]:
+                    systolic_status = "attention"
+                    
+                metrics.append({
+                    "name": "Blood Pressure (Systolic)",
+                    "value": systolic_value,
+                    "unit": unit,
+                    "status": systolic_status,
+                    "referenceRange": f"{REFERENCE_RANGES['blood_pressure_systolic']['min']}-{REFERENCE_RANGES['blood_pressure_systolic']['max']} {unit}"
+                })
+                
+                # Add diastolic blood pressure
+                diastolic_value = float(diastolic)
+                diastolic_status = "normal"
+                if diastolic_value < REFERENCE_RANGES["blood_pressure_diastolic"]["min"]:
+                    diastolic_status = "caution"
+                elif diastolic_value > REFERENCE_RANGES["blood_pressure_diastolic"]["max"]:
+                    diastolic_status = "attention"
+                    
+                metrics.append({
+                    "name": "Blood Pressure (Diastolic)",
+                    "value": diastolic_value,
+                    "unit": unit,
+                    "status": diastolic_status,
+                    "referenceRange": f"{REFERENCE_RANGES['blood_pressure_diastolic']['min']}-{REFERENCE_RANGES['blood_pressure_diastolic']['max']} {unit}"
+                })
+            else:
+                # Handle regular metrics with single values
+                value = float(matches[0][0])
+                unit = matches[0][1] if len(matches[0]) > 1 and matches[0][1] else ""
+                
+                # Get reference range and determine status
+                reference_key = metric_name
+                status = "normal"
+                reference_range = ""
+                
+                # Handle gender-specific reference ranges
+                if f"{metric_name}_male" in REFERENCE_RANGES:
+                    # For simplicity, we'll use the male reference range as default
+                    # In a real app, you would determine the gender from the report or user profile
+                    reference_key = f"{metric_name}_male"
+                
+                if reference_key in REFERENCE_RANGES:
+                    ref_range = REFERENCE_RANGES[reference_key]
+                    reference_range = f"{ref_range['min']}-{ref_range['max']} {ref_range['unit']}"
+                    
+                    # Set unit from reference range if not found in the text
+                    if not unit and 'unit' in ref_range:
+                        unit = ref_range['unit']
+                    
+                    # Determine status based on reference range
+                    if value < ref_range["min"]:
+                        status = "caution"
+                    elif value > ref_range["max"]:
+                        status = "attention"
+                
+                # Format the metric name for display
+                display_name = " ".join(word.capitalize() for word in metric_name.replace("_", " ").split())
+                
+                metrics.append({
+                    "name": display_name,
+                    "value": value,
+                    "unit": unit,
+                    "status": status,
+                    "referenceRange": reference_range
+                })
+    
+    # Determine the report category based on the metrics found
+    category = determine_category(metrics)
+    
+    extracted_data = {
+        "metrics": metrics,
+        "category": category,
+        "text": text
+    }
+    
+    return extracted_data
+
+
+def determine_category(metrics: List[Dict[str, Any]]) -> str:
+    """
+    Determine the report category based on the metrics found
+    
+    Args:
+        metrics: The extracted metrics
+        
+    Returns:
+        str: One of diabetes, lipid, cbc, liver, kidney or general
+    """
+    category = "general"
+    if any(m["name"].lower() in ["glucose", "a1c"] for m in metrics):
+        category = "diabetes"
+    elif any(m["name"].lower() in ["cholesterol", "hdl", "ldl", "triglycerides"] for m in metrics):
+        category = "lipid"
+    elif any(m["name"].lower() in ["hemoglobin", "hematocrit", "wbc", "rbc", "platelets"] for m in metrics):
+        category = "cbc"
+    elif any(m["name"].lower() in ["alt", "ast", "alp", "bilirubin"] for m in metrics):
+        category = "liver"
+    elif any(m["name"].lower() in ["creatinine", "egfr", "bun"] for m in metrics):
+        category = "kidney"
+    
+    return category
+
+
+def annotate_llm_metrics(llm_metrics: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Add status and reference ranges to metrics returned by Claude
+    
+    Metrics whose value is not a number (e.g. "<0.1" or "N/A") are skipped.
+    
+    Args:
+        llm_metrics: The metrics from Claude's JSON response (name, value, unit, optional source)
+        
+    Returns:
+        List: The processed metrics, in the same format as extract_medical_data
+    """
+    processed_metrics = []
+    for metric in llm_metrics:
+        if not isinstance(metric, dict):
+            continue
+        name = str(metric.get("name") or "").lower()
+        unit = metric.get("unit", "")
+        
+        # Skip metrics without a numeric value
+        try:
+            value = float(metric.get("value"))
+        except (TypeError, ValueError):
+            continue
+        if not math.isfinite(value):
+            continue
+            
+        # Try to match the metric name to our reference ranges
+        status = "normal"
+        reference_range = ""
+        
+        # Find the closest matching reference key
+        matching_key = None
+        for ref_key in REFERENCE_RANGES.keys():
+            # Remove gender suffixes for comparison
+            base_key = ref_key.split("_")[0] if "_male" in ref_key or "_female" in ref_key else ref_key
+            if base_key in name:
+                matching_key = ref_key
+                break
+        
+        if matching_key:
+            ref_range = REFERENCE_RANGES[matching_key]
+            reference_range = f"{ref_range['min']}-{ref_range['max']} {ref_range['unit']}"
+            
+            # Set unit from reference range if not found
+            if not unit and 'unit' in ref_range:
+                unit = ref_range['unit']
+            
+            # Determine status based on reference range
+            if value < ref_range["min"]:
+                status = "caution"
+            elif value > ref_range["max"]:
+                status = "attention"
+        
+        # Format the metric name for display
+        display_name = metric.get("name")
+        
+        processed_metric = {
+            "name": display_name,
+            "value": value,
+            "unit": unit,
+            "status": status,
+            "referenceRange": reference_range
+        }
+        # Where in the report the value was read, e.g. "p2 l14"
+        if isinstance(metric.get("source"), str):
+            processed_metric["source"] = metric["source"]
+        processed_metrics.append(processed_metric)
+    
+    return processed_metrics
+
+
+def iter_pdf_pages(pdf_file, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Yield the text of each page of a PDF, one page at a time
+    
+    Args:
+        pdf_file: A path or binary file object
+        start: Index of the first page to extract
+        stop: Index after the last page to extract, None for the end of the document
+        
+    Yields:
+        Tuple of (page index, page text)
+    """
+    pdf_reader = PyPDF2.PdfReader(pdf_file)
+    stop = len(pdf_reader.pages) if stop is None else min(stop, len(pdf_reader.pages))
+    
+    for page_num in range(start, stop):
+        yield page_num, pdf_reader.pages[page_num].extract_text() or ""
+
+
+def fingerprint_pdf(path: str) -> Tuple[str, int]:
+    """
+    Hash a PDF file and count its pages
+    
+    Documents seen before are answered from the page cache without parsing the PDF.
+    
+    Args:
+        path: Path of the PDF file
+        
+    Returns:
+        Tuple of (content hash, number of pages)
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    doc_hash = digest.hexdigest()
+    
+    db = _page_cache()
+    if db is not None:
+        row = db.execute("SELECT num_pages FROM documents WHERE doc_hash = ?", (doc_hash,)).fetchone()
+        if row is not None:
+            with db:
+                db.execute("UPDATE documents SET accessed_at = strftime('%s', 'now') WHERE doc_hash = ?", (doc_hash,))
+            return doc_hash, row[0]
+    
+    num_pages = len(PyPDF2.PdfReader(path).pages)
+    
+    if db is not None:
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO documents (doc_hash, num_pages, accessed_at) VALUES (?, ?, strftime('%s', 'now'))",
+                (doc_hash, num_pages)
+            )
+            _prune_page_cache(db)
+    
+    return doc_hash, num_pages
+
+
+def extract_pdf_page_texts(path: str, doc_hash: str, start: int, stop: int) -> List[str]:
+    """
+    Extract the text of a range of pages, using the page cache
+    
+    Pages of a document seen before are read straight from the cache. For a new
+    or amended document, each page is looked up by the hash of its content
+    stream and resources, so only pages that actually changed are parsed.
+    Module-level so it can run in a worker process.
+    
+    Args:
+        path: Path of the PDF file
+        doc_hash: Content hash of the file, from fingerprint_pdf
+        start: Index of the first page
+        stop: Index after the last page
+        
+    Returns:
+        List: The text of each page in the range
+    """
+    db = _page_cache()
+    
+    if db is not None:
+        row = db.execute("SELECT num_pages FROM documents WHERE doc_hash = ?", (doc_hash,)).fetchone()
+        if row is not None:
+            stop = min(stop, row[0])
+        rows = db.execute(
+            "SELECT p.text FROM document_pages d JOIN pages p ON p.page_key = d.page_key "
+            "WHERE d.doc_hash = ? AND d.page_index >= ? AND d.page_index < ? ORDER BY d.page_index",
+            (doc_hash, start, stop)
+        ).fetchall()
+        if rows and len(rows) == stop - start:
+            return [row[0] for row in rows]
+    
+    pdf_reader = PyPDF2.PdfReader(path)
+    stop = min(stop, len(pdf_reader.pages))
+    texts = []
+    fingerprint_memo = {}
+    
+    for page_num in range(start, stop):
+        page = pdf_reader.pages[page_num]
+        page_key = _page_fingerprint(page, fingerprint_memo) if db is not None else None
+        
+        text = None
+        if page_key is not None:
+            row = db.execute("SELECT text FROM pages WHERE page_key = ?", (page_key,)).fetchone()
+            text = row[0] if row is not None else None
+        
+        if text is None:
+            text = page.extract_text() or ""
+            if page_key is not None:
+                with db:
+                    db.execute("INSERT OR REPLACE INTO pages (page_key, text) VALUES (?, ?)", (page_key, text))
+        
+        if page_key is not None:
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO document_pages (doc_hash, page_index, page_key) VALUES (?, ?, ?)",
+                    (doc_hash, page_num, page_key)
+                )
+        
+        texts.append(text)
+    
+    return texts
+
+
+def extract_pdf_page_range(path: str, doc_hash: str, start: int, stop: int) -> List[Dict[str, Any]]:
+    """
+    Extract text and metrics for a range of pages of a PDF file
+    
+    Module-level so it can run in a worker process; the file is read from
+    disk by the worker instead of being sent over.
+    
+    Args:
+        path: Path of the PDF file
+        doc_hash: Content hash of the file, from fingerprint_pdf
+        start: Index of the first page
+        stop: Index after the last page
+        
+    Returns:
+        List: One dict per page with "page" (1-based), "text" and "metrics"
+    """
+    pages = []
+    for offset, text in enumerate(extract_pdf_page_texts(path, doc_hash, start, stop)):
+        pages.append({
+            "page": start + offset + 1,
+            "text": text,
+            "metrics": extract_medical_data(text)["metrics"] if text.strip() else []
+        })
+    return pages
+
+
+_page_cache_local = threading.local()
+
+
+def _page_cache() -> Optional[sqlite3.Connection]:
+    """Return this thread's connection to the page cache, or None if it is disabled"""
+    if not PAGE_CACHE_DIR:
+        return None
+    
+    db = getattr(_page_cache_local, "db", None)
+    if db is None:
+        path = _private_cache_file(PAGE_CACHE_DIR, PAGE_CACHE_FILE)
+        if path is None:
+            return None
+        db = sqlite3.connect(path, timeout=30)
+        # WAL lets the worker processes read while one of them writes
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(
+            "CREATE TABLE IF NOT EXISTS documents (doc_hash TEXT PRIMARY KEY, num_pages INTEGER NOT NULL, accessed_at INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS pages (page_key TEXT PRIMARY KEY, text TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS document_pages (doc_hash TEXT NOT NULL, page_index INTEGER NOT NULL, "
+            "page_key TEXT NOT NULL, PRIMARY KEY (doc_hash, page_index));"
+        )
+        _page_cache_local.db = db
+    return db
+
+
+def _private_cache_file(directory: str, name: str) -> Optional[str]:
+    """
+    Create (or check) a cache directory only the current user can access, and a 0600 file in it
+    
+    Returns:
+        The file path, or None if the directory belongs to another user
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if os.stat(directory).st_uid != os.getuid():
+        print(f"Warning: Not using PDF page cache {directory}: owned by another user")
+        return None
+    os.chmod(directory, 0o700)
+    
+    path = os.path.join(directory, name)
+    # SQLite gives its -wal and -shm files the permissions of the database file
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+    os.chmod(path, 0o600)
+    return path
+
+
+def _hash_pdf_object(digest, obj, memo: Dict[int, bytes], depth: int = 0):
+    """
+    Feed a PDF object into digest: dictionaries, arrays and stream data, following references
+    
+    memo holds the digest of each indirect object already hashed, so resources
+    shared by many pages (fonts, their ToUnicode maps and font files) are read once.
+    """
+    if depth > 32:
+        raise ValueError("PDF object nesting too deep")
+    
+    if isinstance(obj, PyPDF2.generic.IndirectObject):
+        if obj.idnum not in memo:
+            # Placeholder first, so reference cycles terminate
+            memo[obj.idnum] = b""
+            sub = hashlib.sha256()
+            _hash_pdf_object(sub, obj.get_object(), memo, depth + 1)
+            memo[obj.idnum] = sub.digest()
+        digest.update(b"R" + memo[obj.idnum])
+    elif isinstance(obj, PyPDF2.generic.StreamObject):
+        data = getattr(obj, "_data", None)
+        digest.update(b"S" + (data if data is not None else obj.get_data()))
+        _hash_pdf_dict(digest, obj, memo, depth)
+    elif isinstance(obj, PyPDF2.generic.DictionaryObject):
+        _hash_pdf_dict(digest, obj, memo, depth)
+    elif isinstance(obj, PyPDF2.generic.ArrayObject):
+        digest.update(b"[")
+        for item in obj:
+            _hash_pdf_object(digest, item, memo, depth + 1)
+        digest.update(b"]")
+    else:
+        digest.update(f"{type(obj).__name__}:{obj};".encode("utf-8"))
+
+
+def _hash_pdf_dict(digest, obj, memo: Dict[int, bytes], depth: int):
+    digest.update(b"{")
+    for key in sorted(obj.keys()):
+        # /Parent links back up the page tree, which has nothing to do with this page's text
+        if key in ("/Parent", "/Length"):
+            continue
+        digest.update(f"{key}=".encode("utf-8"))
+        _hash_pdf_object(digest, obj.raw_get(key), memo, depth + 1)
+    digest.update(b"}")
+
+
+def _page_fingerprint(page, memo: Dict[int, bytes]) -> Optional[str]:
+    """
+    Hash everything that determines a page's text
+    
+    That is its content stream and all of its resources, including the fonts'
+    encodings, ToUnicode maps and embedded font data, and form XObjects, so two
+    pages only share a key when they would extract to the same text.
+    """
+    try:
+        digest = hashlib.sha256()
+        contents = page.get_contents()
+        if contents is not None:
+            digest.update(contents.get_data())
+        
+        resources = page.raw_get("/Resources") if "/Resources" in page else None
+        if resources is not None:
+            _hash_pdf_object(digest, resources, memo)
+        
+        return digest.hexdigest()
+    except Exception as e:
+        # Unusual page structure: just skip caching for this page
+        print(f"Could not fingerprint PDF page: {str(e)}")
+        return None
+
+
+def _prune_page_cache(db: sqlite3.Connection):
+    """
+    Drop documents not seen for PAGE_CACHE_MAX_AGE_DAYS, the least recently used ones
+    beyond PAGE_CACHE_MAX_DOCUMENTS, and the pages no remaining document uses
+    """
+    expired = db.execute(
+        "DELETE FROM documents WHERE accessed_at < strftime('%s', 'now') - ?",
+        (int(PAGE_CACHE_MAX_AGE_DAYS * 86400),)
+    ).rowcount
+    count = db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    if count <= PAGE_CACHE_MAX_DOCUMENTS and not expired:
+        return
+    
+    if count > PAGE_CACHE_MAX_DOCUMENTS:
+        db.execute(
+            "DELETE FROM documents WHERE doc_hash IN "
+            "(SELECT doc_hash FROM documents ORDER BY accessed_at ASC LIMIT ?)",
+            (count - PAGE_CACHE_MAX_DOCUMENTS,)
+        )
+    db.execute("DELETE FROM document_pages WHERE doc_hash NOT IN (SELECT doc_hash FROM documents)")
+    db.execute("DELETE FROM pages WHERE page_key NOT IN (SELECT page_key FROM document_pages)")
+
+
+def merge_page_metrics(pages_metrics: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Merge per-page metrics into one list, keeping the first occurrence of each metric
+    
+    This mirrors extract_medical_data on the whole text, which also keeps the first match.
+    
+    Args:
+        pages_metrics: The metrics of each page, in page order
+        
+    Returns:
+        List: The merged metrics
+    """
+    merged = {}
+    for metrics in pages_metrics:
+        for metric in metrics:
+            merged.setdefault(metric["name"].lower(), metric)
+    return list(merged.values())
@@ -1,6 +1,27 @@
 from transformers import AutoTokenizer
-from datasets import Dataset
+from functools import lru_cache
 import re
+import threading
+
+DEFAULT_MODEL_NAME = "emilyalsentzer/Bio_ClinicalBERT"
+
+# Fast tokenizers are not safe to call from several threads at once (Flask serves requests in threads)
+_tokenizer_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name=DEFAULT_MODEL_NAME):
+    """
+    Load a tokenizer, once per process and model name.
+    
+    Args:
+        model_name (str): Name of the pretrained model
+        
+    Returns:
+        The tokenizer
+    """
+    return AutoTokenizer.from_pretrained(model_name)
+
 
 def preprocess_text(text):
     """
@@ -20,10 +41,43 @@ def preprocess_text(text):
     
     return processed_sentences
 
-def create_tokenized_dataset(text, model_name="emilyalsentzer/Bio_ClinicalBERT", max_length=128):
+def tokenize_sentences(sentences, model_name=DEFAULT_MODEL_NAME, max_length=128):
+    """
+    Tokenize sentences directly with the cached tokenizer, without building a dataset.
+    
+    This is the fast path for interactive inputs. Sentences are padded to the
+    longest one in the input rather than to max_length.
+    
+    Args:
+        sentences (list): Sentences, e.g. from preprocess_text
+        model_name (str): Name of the pretrained model to use
+        max_length (int): Maximum sequence length for tokenization
+        
+    Returns:
+        list: One dict per sentence with input_ids, token_type_ids and attention_mask lists
+    """
+    if not sentences:
+        return []
+    
+    tokenizer = get_tokenizer(model_name)
+    with _tokenizer_lock:
+        encoding = tokenizer(
+            sentences,
+            padding="longest",
+            truncation=True,
+            max_length=max_length
+        )
+    return [
+        {key: values[i] for key, values in encoding.items()}
+        for i in range(len(sentences))
+    ]
+
+def create_tokenized_dataset(text, model_name=DEFAULT_MODEL_NAME, max_length=128):
     """
     Create a tokenized dataset from input text using Bio_ClinicalBERT tokenizer.
     
+    For a single interactive input, tokenize_sentences is much cheaper.
+    
     Args:
         text (str): Input medical text
         model_name (str): Name of the pretrained model to use
@@ -32,8 +86,10 @@ def create_tokenized_dataset(text, model_name="emilyalsentzer/Bio_ClinicalBERT",
     Returns:
         datasets.Dataset: Tokenized dataset
     """
-    # Initialize tokenizer
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # datasets is only imported by the callers that need a Dataset
+    from datasets import Dataset
+    
+    tokenizer = get_tokenizer(model_name)
     
     # Process text into sentences
     processed_sentences = preprocess_text(text)
@@ -41,15 +97,15 @@ def create_tokenized_dataset(text, model_name="emilyalsentzer/Bio_ClinicalBERT",
     # Create dataset
     dataset = Dataset.from_dict({"text": processed_sentences})
     
-    # Define tokenization function
+    # Define tokenization function; each batch is padded to its longest sentence
     def tokenize_function(examples):
-        return tokenizer(
-            examples["text"],
-            padding="max_length",
-            truncation=True,
-            max_length=max_length,
-            return_tensors="pt"
-        )
+        with _tokenizer_lock:
+            return tokenizer(
+                examples["text"],
+                padding="longest",
+                truncation=True,
+                max_length=max_length
+            )
     
     # Tokenize dataset
     tokenized_datasets = dataset.map(
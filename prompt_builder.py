@@ -0,0 +1,332 @@
+import re
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+# Static instructions for /analyze, sent as the system prompt. They are far shorter than
+# the minimum prefix Claude 3 Haiku caches (2048 tokens), so no cache breakpoint is set.
+ANALYSIS_INSTRUCTIONS = """You analyze medical report data and provide medically accurate insights.
+
+Return only a JSON object with the following structure:
+{"insights": [string array of key health insights],
+  "metrics": [array of metric objects with name, value, unit, status],
+  "recommendations": [string array of personalized recommendations],
+  "trends": {
+    "description": string describing the overall trend,
+    "concerns": [array of potential health concerns]
+  }
+}
+
+IMPORTANT MEDICAL GUIDELINES:
+1. Do NOT change any values of the metrics in the input data, only add or enhance metadata
+2. For status, use one of: "normal", "caution", "attention"
+3. Do not exaggerate risks or create false concerns
+4. Ensure all insights and recommendations are medically accurate and responsible
+5. Focus on providing actionable health insights based on the lab values
+6. Include specific reference ranges when discussing abnormal values
+7. Highlight potential correlations between different metrics
+8. Suggest follow-up tests when appropriate for concerning values"""
+
+# Extra instructions for bulk analysis, sent after ANALYSIS_INSTRUCTIONS
+BULK_ANALYSIS_INSTRUCTIONS = """You will receive several medical reports at once. Each one starts with a line "### REPORT <id>".
+Analyze every report on its own, as described above, and return one JSON object per report,
+each wrapped in tags carrying the report's id, in the order the reports were given:
+<report id="<id>">
+{ ...the JSON object for this report... }
+</report>
+Write nothing outside the tags."""
+
+# One report's output in a bulk response
+BULK_REPORT_PATTERN = re.compile(r'<report id="([^"]+)">(.*?)</report>', re.DOTALL)
+
+# Fields of the report and of each metric that the model actually needs.
+# Everything else (raw text, descriptions, UI state) is dropped.
+REPORT_FIELDS = ("reportType", "category", "age", "gender", "sex")
+METRIC_FIELDS = ("name", "value", "unit", "status", "referenceRange", "change")
+
+# Rough characters-per-token ratio for English text with Claude's tokenizer
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of input tokens of a text
+
+    Args:
+        text: The text to measure
+
+    Returns:
+        Approximate token count
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def compact_report(report_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep only the report fields relevant to the analysis
+
+    Args:
+        report_data: The report data as sent by the frontend
+
+    Returns:
+        A reduced copy with the report-level fields and a "metrics" list
+    """
+    compact = {
+        field: report_data[field]
+        for field in REPORT_FIELDS
+        if report_data.get(field) not in (None, "")
+    }
+
+    compact["metrics"] = [
+        {
+            field: metric[field]
+            for field in METRIC_FIELDS
+            if metric.get(field) not in (None, "")
+        }
+        for metric in report_data.get("baseMetrics", [])
+        if isinstance(metric, dict)
+    ]
+
+    return compact
+
+
+def format_metric(metric: Dict[str, Any]) -> str:
+    """Format one metric as a single compact line, e.g. "- Glucose: 98 mg/dL | ref 70-100 mg/dL | normal"
+
+    Args:
+        metric: A metric from compact_report
+
+    Returns:
+        The formatted line
+    """
+    line = f"- {metric.get('name', 'Unknown')}: {metric.get('value', '')}"
+    if metric.get("unit"):
+        line += f" {metric['unit']}"
+    if metric.get("referenceRange"):
+        line += f" | ref {metric['referenceRange']}"
+    if metric.get("status"):
+        line += f" | {metric['status']}"
+    if metric.get("change") not in (None, 0):
+        line += f" | change {metric['change']}"
+    return line
+
+
+def format_report(compact: Dict[str, Any], token_budget: int) -> Tuple[str, int]:
+    """Render a compact report as prompt text within a token budget
+
+    When the metrics do not all fit, abnormal metrics are kept first and the
+    number of omitted metrics is stated at the end.
+
+    Args:
+        compact: The output of compact_report
+        token_budget: Maximum estimated tokens for the rendered report
+
+    Returns:
+        Tuple of (report text, number of metrics omitted)
+    """
+    header = [f"{field}: {compact[field]}" for field in REPORT_FIELDS if field in compact]
+    header.append("Metrics (name: value unit | reference range | status):")
+    used = estimate_tokens("\n".join(header))
+
+    metric_lines = [format_metric(metric) for metric in compact["metrics"]]
+
+    # Abnormal results matter most, so they get the budget first
+    order = sorted(
+        range(len(metric_lines)),
+        key=lambda i: compact["metrics"][i].get("status", "normal") == "normal"
+    )
+    kept = set()
+    for i in order:
+        cost = estimate_tokens(metric_lines[i]) + 1
+        if used + cost > token_budget:
+            continue
+        kept.add(i)
+        used += cost
+
+    lines = header + [line for i, line in enumerate(metric_lines) if i in kept]
+    omitted = len(metric_lines) - len(kept)
+    if omitted:
+        lines.append(f"({omitted} further metrics omitted for length)")
+
+    return "\n".join(lines), omitted
+
+
+def build_analysis_prompt(report_data: Dict[str, Any], token_budget: int = 2000) -> Dict[str, Any]:
+    """Build the system and messages parts of an /analyze request
+
+    Args:
+        report_data: The report data as sent by the frontend
+        token_budget: Maximum estimated input tokens for the report part of the prompt
+
+    Returns:
+        Dict with "system" and "messages" entries for the messages API, plus
+        "estimated_input_tokens" and "omitted_metrics" for logging
+    """
+    report_text, omitted = format_report(compact_report(report_data), token_budget)
+
+    system_block = {"type": "text", "text": ANALYSIS_INSTRUCTIONS}
+    prompt = f"Analyze this medical report data:\n{report_text}"
+
+    return {
+        "system": [system_block],
+        "messages": [{"role": "user", "content": prompt}],
+        "estimated_input_tokens": estimate_tokens(ANALYSIS_INSTRUCTIONS) + estimate_tokens(prompt),
+        "omitted_metrics": omitted,
+    }
+
+
+
+def build_bulk_analysis_prompt(reports: List[Tuple[str, Dict[str, Any]]], token_budget: int = 2000) -> Dict[str, Any]:
+    """Build the system and messages parts of a request analyzing several reports at once
+
+    Args:
+        reports: (report id, report data) pairs; the ids tag the outputs in the response
+        token_budget: Maximum estimated input tokens for each report
+
+    Returns:
+        Dict with "system" and "messages" entries for the messages API, plus
+        "estimated_input_tokens" and "omitted_metrics" for logging
+    """
+    sections = []
+    omitted_total = 0
+    for report_id, report_data in reports:
+        report_text, omitted = format_report(compact_report(report_data), token_budget)
+        sections.append(f"### REPORT {report_id}\n{report_text}")
+        omitted_total += omitted
+
+    system_blocks = [
+        {"type": "text", "text": ANALYSIS_INSTRUCTIONS},
+        {"type": "text", "text": BULK_ANALYSIS_INSTRUCTIONS},
+    ]
+    instructions_tokens = sum(estimate_tokens(block["text"]) for block in system_blocks)
+
+    prompt = f"Analyze each of these {len(reports)} medical reports:\n\n" + "\n\n".join(sections)
+
+    return {
+        "system": system_blocks,
+        "messages": [{"role": "user", "content": prompt}],
+        "estimated_input_tokens": instructions_tokens + estimate_tokens(prompt),
+        "omitted_metrics": omitted_total,
+    }
+
+
+def split_bulk_response(text: str) -> Dict[str, str]:
+    """Split the output of a bulk analysis into the output of each report
+
+    Outputs cut off before their closing tag are left out, like reports
+    the model skipped; the caller retries them.
+
+    Args:
+        text: The model's complete output
+
+    Returns:
+        The output text of each report, by report id
+    """
+    return {report_id: output.strip() for report_id, output in BULK_REPORT_PATTERN.findall(text)}
+
+# Analytes and lab vocabulary used to spot result lines in raw report text. Broader than
+# the regex patterns in pdf_extractor, since the fallback runs when those found nothing.
+ANALYTE_TERMS = frozenset("""
+glucose sugar cholesterol hdl ldl vldl triglycerides tg a1c hba1c hemoglobin haemoglobin hgb hb
+hematocrit haematocrit hct rbc wbc erythrocytes leukocytes platelets plt mcv mch mchc rdw mpv
+neutrophils lymphocytes monocytes eosinophils basophils sodium potassium chloride bicarbonate co2
+calcium magnesium phosphorus phosphate creatinine urea bun egfr gfr uric albumin globulin protein
+bilirubin alt ast alp ggt sgpt sgot ldh ck tsh t3 t4 ft3 ft4 thyroxine triiodothyronine vitamin
+ferritin iron transferrin tibc b12 folate crp esr inr pt aptt fibrinogen d-dimer psa cea afp hcg
+ca125 ca-125 troponin bnp insulin cortisol testosterone estradiol progesterone lh fsh prolactin
+lipase amylase ketones nitrite ph specific gravity bmi weight height pulse heart pressure systolic
+diastolic spo2 oxygen saturation
+""".split())
+
+# Units of lab results; a number next to one of these is almost always a result
+UNIT_PATTERN = re.compile(
+    r"(?<![a-z])(?:mg/dl|g/dl|g/l|mmol/l|mmol/mol|umol/l|μmol/l|µmol/l|nmol/l|pmol/l|mEq/l|meq/l|ng/ml|ng/dl|"
+    r"pg/ml|ug/dl|μg/dl|µg/dl|ug/l|μg/l|miu/ml|miu/l|uiu/ml|μiu/ml|iu/l|u/l|u/ml|ku/l|mmhg|bpm|fl|pg|"
+    r"x?10\^?\d+/[uμµ]?l|ml/min(?:/1\.73\s?m2)?|kg/m2|kg|lbs|cm|mm/hr?|%)(?![a-z])",
+    re.IGNORECASE
+)
+NUMBER_PATTERN = re.compile(r"(?<![\w.])\d+(?:[.,]\d+)?(?![\w.])")
+# Dates, times and phone numbers are numbers that are never results
+NOISE_PATTERN = re.compile(r"\d{1,4}[/.-]\d{1,2}[/.-]\d{2,4}|\d{1,2}:\d{2}(?::\d{2})?|\(?\d{3}\)?[ -]\d{3}-\d{4}")
+WORD_PATTERN = re.compile(r"[a-z][a-z0-9-]*", re.IGNORECASE)
+
+# Lines scoring below this are not sent to Claude
+CANDIDATE_MIN_SCORE = 0.5
+
+
+def score_line(line: str) -> float:
+    """Score how likely a line of report text is to hold a lab result
+
+    The score is the density of numbers, units and analyte names among the
+    words of the line, so short table rows score high and long narrative
+    sentences that happen to mention a number score low. Lines without a
+    number, or with a number but neither a unit nor an analyte, score 0.
+
+    Args:
+        line: One line of extracted report text
+
+    Returns:
+        The score, 0 for lines that cannot be results
+    """
+    cleaned = NOISE_PATTERN.sub(" ", line)
+    numbers = len(NUMBER_PATTERN.findall(cleaned))
+    if not numbers:
+        return 0.0
+
+    units = len(UNIT_PATTERN.findall(cleaned))
+    words = WORD_PATTERN.findall(cleaned)
+    analytes = sum(1 for word in words if word.lower() in ANALYTE_TERMS)
+    if not units and not analytes:
+        return 0.0
+
+    size = max(len(words) + numbers, 4)
+    return (2 * analytes + 2 * units + min(numbers, 3)) / size
+
+
+def has_analyte(line: str) -> bool:
+    """Return whether a line names an analyte from ANALYTE_TERMS"""
+    return any(word.lower() in ANALYTE_TERMS for word in WORD_PATTERN.findall(line))
+
+
+def select_candidate_lines(pages: Iterable[Tuple[Optional[int], str]], token_budget: int) -> Tuple[str, int, int]:
+    """Keep the lines of report text that look like lab results, within a token budget
+
+    Each kept line is prefixed with its provenance, e.g. "p3 l12 | Glucose 126 mg/dL"
+    (without the page when it is unknown). A line naming an analyte without a
+    value is kept together with the next line when that one is a value
+    without an analyte name, which is how table columns often come out of
+    PDF extraction. When the candidates
+    do not all fit, the highest-scoring ones are kept, in document order.
+
+    Args:
+        pages: (page number or None, page text) pairs, in document order
+        token_budget: Maximum estimated tokens for the selected lines
+
+    Returns:
+        Tuple of (selected lines, number of results kept, number of results dropped for length)
+    """
+    candidates: List[Tuple[float, str]] = []
+    for page, page_text in pages:
+        lines = page_text.splitlines()
+        scores = [score_line(line) for line in lines]
+        label = None
+        for index, line in enumerate(lines):
+            location = f"p{page} l{index + 1}" if page is not None else f"l{index + 1}"
+            entry = f"{location} | {' '.join(line.split())}"
+            if scores[index] >= CANDIDATE_MIN_SCORE:
+                # A label line and its result are kept or dropped together
+                candidates.append((scores[index], f"{label}\n{entry}" if label else entry))
+                label = None
+            elif index + 1 < len(lines) and scores[index + 1] >= CANDIDATE_MIN_SCORE and \
+                    has_analyte(line) and not has_analyte(lines[index + 1]):
+                label = entry
+            else:
+                label = None
+
+    used = 0
+    kept = set()
+    for i in sorted(range(len(candidates)), key=lambda i: -candidates[i][0]):
+        cost = estimate_tokens(candidates[i][1]) + 1
+        if used + cost > token_budget:
+            continue
+        kept.add(i)
+        used += cost
+
+    selected = [line for i, (_, line) in enumerate(candidates) if i in kept]
+    return "\n".join(selected), len(selected), len(candidates) - len(selected)
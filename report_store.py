@@ -0,0 +1,215 @@
+import gzip
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+# Brotli is optional; without it responses are offered with gzip only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content ids are served for a long time: the same id always means the same bytes
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+def negotiate_encoding(accept_encoding: str, available) -> Optional[str]:
+    """
+    Pick the best content coding the client accepts
+
+    Args:
+        accept_encoding: The Accept-Encoding request header
+        available: The codings a representation exists in ("br", "gzip")
+
+    Returns:
+        "br", "gzip", or None for the uncompressed body
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    for coding in ("br", "gzip"):
+        if coding in available and accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+class ReportStore:
+    """
+    Content-addressed store of encoded report results
+
+    Each result is kept as the exact JSON bytes sent to the client, plus
+    gzip (and brotli, if installed) versions compressed once when stored.
+    The content id is an HMAC-SHA-256 of the JSON bytes under a server
+    secret, so it doubles as a strong ETag and repeat views are answered
+    without re-encoding anything, while nobody can derive the id of a
+    result from a guess of its content: only the client the result was
+    sent to knows it. Results are dropped max_age_seconds after they were
+    first stored.
+
+    The methods block on SQLite and compression; call them from a thread.
+    """
+
+    def __init__(self, path: str = ":memory:", max_entries: int = 1000, compress_min_bytes: int = 1024,
+                 max_age_seconds: float = 86400.0, secret: Optional[bytes] = None):
+        """
+        Args:
+            path: Path of the SQLite file, ":memory:" to keep results in memory only
+            max_entries: Results kept; the least recently served are dropped first
+            compress_min_bytes: Bodies smaller than this are not compressed
+            max_age_seconds: How long a result is kept after it was stored
+            secret: Key of the content ids; random by default, so ids change when the server restarts
+        """
+        self.max_entries = max_entries
+        self.compress_min_bytes = compress_min_bytes
+        self.max_age_seconds = max_age_seconds
+        self._secret = secret or os.urandom(32)
+
+        # One connection shared by the threadpool threads; a file may also be shared by several worker processes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            "id TEXT PRIMARY KEY, body BLOB NOT NULL, gzip BLOB, br BLOB, accessed_at REAL NOT NULL, stored_at REAL)"
+        )
+        # Stores created before retention existed
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(reports)")}
+        if "stored_at" not in columns:
+            self._db.execute("ALTER TABLE reports ADD COLUMN stored_at REAL")
+        self._db.execute("UPDATE reports SET stored_at = accessed_at WHERE stored_at IS NULL")
+        self._db.commit()
+
+        self.stored = 0
+        self.expired = 0
+        self.served = 0
+        self.not_modified = 0
+        self.bytes_saved = 0
+
+    def put(self, body: bytes) -> str:
+        """
+        Store an encoded result
+
+        Args:
+            body: The JSON-encoded result
+
+        Returns:
+            The content id of the result
+        """
+        content_id = hmac.new(self._secret, body, hashlib.sha256).hexdigest()
+
+        with self._lock, self._db:
+            updated = self._db.execute(
+                "UPDATE reports SET accessed_at = ? WHERE id = ? AND stored_at >= ?",
+                (time.time(), content_id, time.time() - self.max_age_seconds)
+            ).rowcount
+        if updated:
+            return content_id
+
+        # Compressed outside the lock, so other requests can read meanwhile
+        compressed_gzip = compressed_br = None
+        if len(body) >= self.compress_min_bytes:
+            compressed_gzip = gzip.compress(body, compresslevel=6)
+            if brotli is not None:
+                compressed_br = brotli.compress(body, quality=5)
+
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO reports (id, body, gzip, br, accessed_at, stored_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (content_id, body, compressed_gzip, compressed_br, now, now)
+            )
+            self.expired += self._db.execute(
+                "DELETE FROM reports WHERE stored_at < ?", (now - self.max_age_seconds,)
+            ).rowcount
+            self._db.execute(
+                "DELETE FROM reports WHERE id IN (SELECT id FROM reports ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        self.stored += 1
+        return content_id
+
+    def response(self, request: Request, content_id: str, status_code: int = 200) -> Optional[Response]:
+        """
+        Build the response for a stored result
+
+        GET and HEAD requests whose If-None-Match names the content id get a
+        304. Otherwise the body is sent in the best encoding the client
+        accepts, with the content id as ETag and Content-Location.
+
+        Returns:
+            The response, or None if the content id is unknown or expired
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT body, gzip, br FROM reports WHERE id = ? AND stored_at >= ?",
+                (content_id, time.time() - self.max_age_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE reports SET accessed_at = ? WHERE id = ?", (time.time(), content_id))
+
+        representations: Dict[str, bytes] = {"gzip": row[1], "br": row[2]}
+        representations = {coding: data for coding, data in representations.items() if data is not None}
+        coding = negotiate_encoding(request.headers.get("accept-encoding", ""), representations)
+
+        # Each coding is a different byte sequence, so it gets its own strong ETag
+        etag = f'"{content_id}-{coding}"' if coding else f'"{content_id}"'
+        headers = {
+            "ETag": etag,
+            "Content-Location": f"/reports/{content_id}",
+            "Cache-Control": CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+
+        if request.method in ("GET", "HEAD") and self._matches(request.headers.get("if-none-match", ""), content_id):
+            self.not_modified += 1
+            self.bytes_saved += len(representations.get(coding, row[0]))
+            return Response(status_code=304, headers=headers)
+
+        self.served += 1
+        if coding:
+            headers["Content-Encoding"] = coding
+            self.bytes_saved += len(row[0]) - len(representations[coding])
+            return Response(representations[coding], status_code=status_code, headers=headers, media_type="application/json")
+        return Response(row[0], status_code=status_code, headers=headers, media_type="application/json")
+
+    @staticmethod
+    def _matches(if_none_match: str, content_id: str) -> bool:
+        if if_none_match.strip() == "*":
+            return True
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            # Any coding of the same content counts as a match
+            if tag.strip('"').split("-")[0] == content_id:
+                return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        """Return store counters for the metrics endpoint"""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+        return {
+            "entries": entries,
+            "stored": self.stored,
+            "expired": self.expired,
+            "served": self.served,
+            "not_modified": self.not_modified,
+            "bytes_saved": self.bytes_saved,
+            "brotli": brotli is not None,
+        }
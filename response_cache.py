@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class ResponseCache:
+    """An LRU cache with TTL expiry for upstream LLM responses
+
+    Entries live in memory and can optionally be written through to a SQLite
+    file so that they survive restarts. Concurrent lookups for the same key
+    share a single in-flight computation (single-flight coalescing).
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600, persist_path: Optional[str] = None, namespace: str = ""):
+        """Initialize the cache
+
+        Args:
+            max_entries: Maximum number of entries kept in memory (and on disk)
+            ttl_seconds: Time-to-live of an entry in seconds
+            persist_path: Path of the SQLite file for the persistent tier, None to disable it
+            namespace: Prefix mixed into every key (e.g. model name and temperature)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.namespace = namespace
+
+        # key -> (expires_at, value, cost_seconds)
+        self._entries: "OrderedDict[str, Tuple[float, Any, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiting: Dict[str, int] = {}
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.abandoned = 0
+        self.saved_seconds = 0.0
+
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "cost REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def make_key(self, payload: Any) -> str:
+        """Build a cache key from a canonicalized form of the payload
+
+        Dict ordering and insignificant whitespace do not change the key.
+
+        Args:
+            payload: Any JSON-serializable object
+
+        Returns:
+            A hex digest identifying the payload
+        """
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(f"{self.namespace}\n{canonical}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Look up a key in the memory tier, then in the persistent tier
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached value, or None if missing or expired
+        """
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value, cost = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += cost
+                return value
+            del self._entries[key]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, expires_at, cost FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                value_json, expires_at, cost = row
+                if expires_at > now:
+                    self._db.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    value = json.loads(value_json)
+                    # Promote to the memory tier
+                    self._store_in_memory(key, value, expires_at, cost)
+                    self.hits += 1
+                    self.persistent_hits += 1
+                    self.saved_seconds += cost
+                    return value
+                self._db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._db.commit()
+
+        return None
+
+    def set(self, key: str, value: Any, cost_seconds: float = 0.0):
+        """Store a value in the cache
+
+        Args:
+            key: The cache key
+            value: A JSON-serializable value
+            cost_seconds: How long the value took to compute, used for the saved-time metric
+        """
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        self._store_in_memory(key, value, expires_at, cost_seconds)
+
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, cost, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, cost_seconds, now)
+            )
+            # Keep the persistent tier bounded as well, dropping expired and least recently used rows
+            self._db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            self._db.execute(
+                "DELETE FROM response_cache WHERE key NOT IN "
+                "(SELECT key FROM response_cache ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._db.commit()
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                             cacheable: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Return the cached value for a key, computing it at most once concurrently
+
+        If another request is already computing the same key, this call waits
+        for that computation instead of starting a new one. Results that are
+        None, or rejected by cacheable, are returned but not cached. If every
+        waiter is cancelled (client disconnects, deadlines), the computation
+        is cancelled too.
+
+        Args:
+            key: The cache key
+            compute: Coroutine function producing the value on a miss
+            cacheable: Optional predicate deciding whether a computed value is stored
+
+        Returns:
+            The cached or freshly computed value
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        task = self._inflight.get(key)
+        joined = task is not None
+        if joined:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._compute_and_store(key, compute, cacheable))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish_inflight(key, done))
+
+        # Shield the shared task so that one disconnected client does not cancel it for the others
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            value, cost = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiting[key] == 1 and not task.done():
+                # Nobody is left to use the result; later lookups start afresh
+                task.cancel()
+                self._inflight.pop(key, None)
+                self.abandoned += 1
+            raise
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+        if joined:
+            self.saved_seconds += cost
+        return value
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Any]],
+                                 cacheable: Optional[Callable[[Any], bool]]) -> Tuple[Any, float]:
+        start_time = time.perf_counter()
+        value = await compute()
+        cost = time.perf_counter() - start_time
+        if value is not None and (cacheable is None or cacheable(value)):
+            self.set(key, value, cost)
+        return value, cost
+
+    def _finish_inflight(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every waiter went away before it finished
+        if not task.cancelled():
+            task.exception()
+
+    def _store_in_memory(self, key: str, value: Any, expires_at: float, cost: float):
+        self._entries[key] = (expires_at, value, cost)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache counters for the metrics endpoint"""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "saved_upstream_seconds": round(self.saved_seconds, 3),
+        }
@@ -3,6 +3,8 @@
 import os
 import argparse
 from batch_fine_tune_medical_reports import fine_tune_biobert_batch, integrate_fine_tuned_model, test_fine_tuned_model
+from corpus_ingest import find_corpus_files
+from cpu_profile import add_cpu_profile_args
 
 def main():
     """
@@ -17,6 +19,18 @@ def main():
     parser.add_argument("--epochs", type=int, default=3, help="Number of training epochs")
     parser.add_argument("--batch_size", type=int, default=8, help="Training batch size")
     parser.add_argument("--learning_rate", type=float, default=5e-5, help="Learning rate")
+    parser.add_argument("--num_proc", type=int, help="Processes for loading and tokenizing the corpus (default: one per CPU)")
+    parser.add_argument("--cache_dir", type=str, help="Directory of the tokenization cache")
+    add_cpu_profile_args(parser)
+    parser.add_argument("--packing", action="store_true",
+                        help="Pack the tokenized reports, separated by [CLS]/[SEP], into full 256-token blocks instead of padding them")
+    parser.add_argument("--isolate_documents", action="store_true",
+                        help="With --packing, keep attention and positions within each packed report")
+    parser.add_argument("--checkpoint_dir", type=str, help="Directory of the training checkpoints (default: <output_dir>_checkpoints)")
+    parser.add_argument("--checkpoint_minutes", type=float, help="Checkpoint every this many minutes of training (default: 30)")
+    parser.add_argument("--checkpoint_tokens", type=int, help="Checkpoint every this many training tokens")
+    parser.add_argument("--resume", action="store_true", help="Resume from the latest complete checkpoint")
+    parser.add_argument("--overwrite_checkpoints", action="store_true", help="Delete the checkpoints of a previous run")
     parser.add_argument("--test", action="store_true", help="Test the model after fine-tuning")
     parser.add_argument("--test_text", type=str, 
                         help="Text to test the model with (default: 'The patient's hemoglobin level was [MASK] g/dL, which is within normal range.')")
@@ -24,18 +38,23 @@ def main():
     
     args = parser.parse_args()
     
+    if args.isolate_documents and not args.packing:
+        parser.error("--isolate_documents requires --packing")
+    if args.resume and args.overwrite_checkpoints:
+        parser.error("--resume and --overwrite_checkpoints are mutually exclusive")
+    
     # Ensure the JSON directory exists
     if not os.path.exists(args.json_dir):
         print(f"Error: JSON directory '{args.json_dir}' does not exist.")
         return
     
-    # Check if there are JSON files in the directory
-    json_files = [f for f in os.listdir(args.json_dir) if f.endswith('.json')]
+    # Check if there are JSON or JSONL files in the directory
+    json_files = find_corpus_files(args.json_dir)
     if not json_files:
-        print(f"Error: No JSON files found in '{args.json_dir}'.")
+        print(f"Error: No JSON or JSONL files found in '{args.json_dir}'.")
         return
     
-    print(f"Found {len(json_files)} JSON files in '{args.json_dir}'.")
+    print(f"Found {len(json_files)} JSON/JSONL files in '{args.json_dir}'.")
     print("Starting batch fine-tuning process...")
     
     # Fine-tune the model on all JSON files in the directory
@@ -44,7 +63,17 @@ def main():
         output_dir=args.output_dir,
         epochs=args.epochs,
         batch_size=args.batch_size,
-        learning_rate=args.learning_rate
+        learning_rate=args.learning_rate,
+        num_proc=args.num_proc,
+        cache_dir=args.cache_dir,
+        packing=args.packing,
+        isolate_documents=args.isolate_documents,
+        checkpoint_dir=args.checkpoint_dir,
+        checkpoint_minutes=args.checkpoint_minutes,
+        checkpoint_tokens=args.checkpoint_tokens,
+        resume=args.resume,
+        overwrite_checkpoints=args.overwrite_checkpoints,
+        cpu_options=args
     )
     
     # Test the model if requested
@@ -0,0 +1,65 @@
+from typing import Any, List, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+
+def coerce_text(value: Any) -> Any:
+    """Turn a number into a string; Claude sometimes writes e.g. a status or unit as a number"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+
+def coerce_text_list(value: Any) -> Any:
+    """Treat a null list as empty and turn numbers in it into strings"""
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [coerce_text(item) for item in value]
+    return value
+
+
+class Metric(BaseModel):
+    """A lab result as returned by /analyze"""
+
+    # Claude may add fields such as "description" or "referenceRange"; they are kept
+    model_config = ConfigDict(extra="allow")
+
+    name: str
+    value: Union[int, float, str, None] = None
+    unit: Optional[str] = None
+    status: Optional[str] = None
+
+    _coerce_text = field_validator("name", "unit", "status", mode="before")(coerce_text)
+
+
+class Trends(BaseModel):
+    description: str = ""
+    concerns: List[str] = []
+
+    @field_validator("description", mode="before")
+    @classmethod
+    def _coerce_description(cls, value: Any) -> Any:
+        return "" if value is None else coerce_text(value)
+
+    _coerce_concerns = field_validator("concerns", mode="before")(coerce_text_list)
+
+
+class Analysis(BaseModel):
+    """The analysis of a medical report"""
+
+    insights: List[str]
+    metrics: List[Metric]
+    recommendations: List[str]
+    trends: Trends
+
+    _coerce_lists = field_validator("insights", "recommendations", mode="before")(coerce_text_list)
+
+
+class AnalyzeResponse(BaseModel):
+    """Body of /analyze responses"""
+
+    analysis: Analysis
+    status: str
+    # Legacy clients: the analysis again, as a JSON-encoded string (only with legacy_content=true)
+    content: Optional[str] = None
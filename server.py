@@ -1,17 +1,69 @@
-from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import httpx
+import asyncio
 import json
-import io
 import os
+import secrets
 import tempfile
-import re
+import time
+import zipfile
+import orjson
 from typing import Dict, Any, Optional, List
 import uvicorn
-import PyPDF2
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
+from response_cache import ResponseCache
+from schemas import Analysis, AnalyzeResponse
+from report_store import ReportStore
+from prompt_builder import (
+    build_analysis_prompt, build_bulk_analysis_prompt, split_bulk_response, compact_report, estimate_tokens,
+    select_candidate_lines
+)
+from pdf_extractor import (
+    extract_medical_data, annotate_llm_metrics, fingerprint_pdf, extract_pdf_page_texts,
+    extract_pdf_page_range, merge_page_metrics, determine_category
+)
+from worker_pool import BoundedWorkerPool, PoolSaturatedError
+from llm_client import post_message, stream_message_text, sse_event, scheduler as llm_scheduler
+from job_queue import JobQueue, FINAL_STATES
+from json_stream import StreamingJSONParser
+from admission import AdmissionLimiter, AdmissionMiddleware
+from biobert_routes import router as biobert_router
+from deadline import (
+    Deadline, DeadlineExceeded, ClientDisconnected, CLIENT_CLOSED_REQUEST,
+    request_deadline, run_within, run_until_disconnect
+)
 
-app = FastAPI(title="Medical Report Analysis API")
+app = FastAPI(title="Medical Report Analysis API", default_response_class=ORJSONResponse)
+
+# Inbound admission control for the heavy endpoints: requests beyond a group's
+# concurrency limit wait in a bounded queue, and are shed with 503 when it is full
+admission_limiters = {
+    "upload_pdf": AdmissionLimiter(
+        "upload_pdf",
+        max_concurrency=int(os.environ.get("ADMISSION_UPLOAD_PDF_CONCURRENCY", str(2 * (os.cpu_count() or 1)))),
+        queue_limit=int(os.environ.get("ADMISSION_UPLOAD_PDF_QUEUE", "16"))
+    ),
+    "analyze": AdmissionLimiter(
+        "analyze",
+        max_concurrency=int(os.environ.get("ADMISSION_ANALYZE_CONCURRENCY", "32")),
+        queue_limit=int(os.environ.get("ADMISSION_ANALYZE_QUEUE", "64"))
+    ),
+    "biobert": AdmissionLimiter(
+        "biobert",
+        max_concurrency=int(os.environ.get("ADMISSION_BIOBERT_CONCURRENCY", "2")),
+        queue_limit=int(os.environ.get("ADMISSION_BIOBERT_QUEUE", "8"))
+    ),
+}
+
+# Added before CORS so that shed responses still carry the CORS headers
+app.add_middleware(AdmissionMiddleware, limiters=[
+    ("/upload-pdf", admission_limiters["upload_pdf"]),
+    ("/analyze", admission_limiters["analyze"]),
+    ("/biobert/", admission_limiters["biobert"]),
+])
 
 # Configure CORS
 app.add_middleware(
@@ -22,110 +74,408 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Anthropic API configuration
-ANTHROPIC_API_KEY = "sk-ant-REDACTED"
-ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
+app.include_router(biobert_router, prefix="/biobert")
+
+# Anthropic model configuration
+ANALYZE_MODEL = "claude-3-haiku-20240307"  # Using the same model as in llmService.ts
+ANALYZE_TEMPERATURE = 0.2  # Lower temperature for more consistent medical advice
+ANALYZE_INPUT_TOKEN_BUDGET = int(os.environ.get("ANALYZE_INPUT_TOKEN_BUDGET", "2000"))
+
+# /analyze/bulk: reports packed into one upstream call, calls in flight at once, attempts per report
+# before it gets the fallback analysis, and the most reports accepted per request
+ANALYZE_BULK_REPORTS_PER_CALL = int(os.environ.get("ANALYZE_BULK_REPORTS_PER_CALL", "4"))
+ANALYZE_BULK_CONCURRENCY = int(os.environ.get("ANALYZE_BULK_CONCURRENCY", "4"))
+ANALYZE_BULK_MAX_ATTEMPTS = int(os.environ.get("ANALYZE_BULK_MAX_ATTEMPTS", "3"))
+ANALYZE_BULK_MAX_REPORTS = int(os.environ.get("ANALYZE_BULK_MAX_REPORTS", "500"))
+# Output tokens allowed per packed report, and for a whole bulk call (the model's output limit)
+ANALYZE_BULK_OUTPUT_TOKENS_PER_REPORT = 1000
+ANALYZE_BULK_MAX_OUTPUT_TOKENS = 4096
+
+# Also send the analysis as a JSON-encoded "content" string, as /analyze used to (per request: ?legacy_content=true)
+ANALYZE_LEGACY_CONTENT = os.environ.get("ANALYZE_LEGACY_CONTENT", "0") == "1"
+
+# Cache for /analyze responses; set ANALYZE_CACHE_PATH to also keep them on disk across restarts
+analyze_cache = ResponseCache(
+    max_entries=int(os.environ.get("ANALYZE_CACHE_MAX_ENTRIES", "512")),
+    ttl_seconds=float(os.environ.get("ANALYZE_CACHE_TTL_SECONDS", "86400")),
+    persist_path=os.environ.get("ANALYZE_CACHE_PATH") or None,
+    namespace=f"{ANALYZE_MODEL}:{ANALYZE_TEMPERATURE}"
+)
+
+# Pool for CPU-bound PDF parsing and regex extraction, so one large PDF does not stall the event loop
+pdf_pool = BoundedWorkerPool(
+    max_workers=int(os.environ.get("PDF_POOL_SIZE", "0")) or None,
+    queue_limit=int(os.environ.get("PDF_QUEUE_LIMIT", "16")),
+    kind=os.environ.get("PDF_POOL_KIND", "process")
+)
+
+# Pages handed to a worker at once by /upload-pdf/stream, and the chunk size used to spool uploads to disk
+PDF_STREAM_PAGES_PER_JOB = int(os.environ.get("PDF_STREAM_PAGES_PER_JOB", "4"))
+UPLOAD_SPOOL_CHUNK_BYTES = 1024 * 1024
+
+# Bulk uploads: files processed at once, and limits guarding against oversized or malicious archives
+PDF_BATCH_CONCURRENCY = int(os.environ.get("PDF_BATCH_CONCURRENCY", "0")) or pdf_pool.max_workers
+PDF_BATCH_MAX_FILES = int(os.environ.get("PDF_BATCH_MAX_FILES", "500"))
+PDF_BATCH_MAX_FILE_BYTES = int(os.environ.get("PDF_BATCH_MAX_FILE_BYTES", str(100 * 1024 * 1024)))
+
+# Documents with at least twice this many pages are split across several workers by /upload-pdf
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "8"))
+
+# /upload-pdf regex-extracts each page range in the worker that parsed it, overlapping extraction with
+# the parsing of the other ranges, and starts the (single) Claude fallback as soon as the last range is
+# in. Set to 0 to extract only once the whole document has been parsed.
+UPLOAD_HEDGED_FALLBACK = os.environ.get("UPLOAD_HEDGED_FALLBACK", "1") != "0"
+
+# The Claude fallback of /upload-pdf only gets the lines that look like lab results (with their page
+# and line numbers), at most this many estimated tokens of them. Set UPLOAD_FALLBACK_PREFILTER=0 to
+# send the whole extracted text instead.
+UPLOAD_FALLBACK_PREFILTER = os.environ.get("UPLOAD_FALLBACK_PREFILTER", "1") != "0"
+UPLOAD_FALLBACK_TOKEN_BUDGET = int(os.environ.get("UPLOAD_FALLBACK_TOKEN_BUDGET", "1500"))
+
+# Size of the report text given to the fallback vs. what was actually sent, for /metrics
+fallback_prompt_stats = {"calls": 0, "skipped": 0, "text_tokens": 0, "prompt_tokens": 0, "results_dropped": 0}
+
+# Content-addressed store of /analyze results, served again by GET /reports/{content_id}.
+# Results stay in memory unless REPORT_STORE_PATH names a file, for REPORT_STORE_MAX_AGE_SECONDS;
+# set REPORT_STORE_SECRET to keep content ids stable across restarts.
+REPORT_STORE_PATH = os.environ.get("REPORT_STORE_PATH", "")
+REPORT_STORE_SECRET = os.environ.get("REPORT_STORE_SECRET", "")
+# A content id is only known to the process that issued it unless all workers share both the store
+# file and the secret: refuse to run several workers (WEB_CONCURRENCY, read by uvicorn and gunicorn) without them
+if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1 and not (REPORT_STORE_PATH and REPORT_STORE_SECRET):
+    raise RuntimeError("Running several workers requires REPORT_STORE_PATH and REPORT_STORE_SECRET to be set")
+report_store = ReportStore(
+    path=REPORT_STORE_PATH or ":memory:",
+    max_entries=int(os.environ.get("REPORT_STORE_MAX_ENTRIES", "1000")),
+    compress_min_bytes=int(os.environ.get("REPORT_COMPRESS_MIN_BYTES", "1024")),
+    max_age_seconds=float(os.environ.get("REPORT_STORE_MAX_AGE_SECONDS", "86400")),
+    secret=REPORT_STORE_SECRET.encode() or None
+)
+
+# Durable queue for slow Claude fallback extractions requested with /upload-pdf?background=true
+job_queue = JobQueue(
+    db_path=os.environ.get("JOB_DB_PATH", "jobs.sqlite3"),
+    workers=int(os.environ.get("JOB_WORKERS", "4")),
+    max_attempts=int(os.environ.get("JOB_MAX_ATTEMPTS", "3")),
+    retry_backoff_seconds=float(os.environ.get("JOB_RETRY_BACKOFF_SECONDS", "2")),
+    lease_seconds=float(os.environ.get("JOB_LEASE_SECONDS", "60")),
+    retention_seconds=float(os.environ.get("JOB_RETENTION_SECONDS", str(7 * 86400)))
+)
+
+# Longest a GET /jobs/{job_id}?wait=... long-poll may block
+JOB_MAX_WAIT_SECONDS = 60.0
+
+# Sections of a recovered analysis that Claude did not get to write
+EMPTY_ANALYSIS = {
+    "insights": [],
+    "metrics": [],
+    "recommendations": [],
+    "trends": {"description": "", "concerns": []}
+}
+
+
+class PartialAnalysis(dict):
+    """An analysis recovered from truncated or malformed output: served as "partial", never cached"""
+
+
+# Headers for server-sent-event responses (disable proxy buffering so events flush immediately)
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 @app.get("/")
 async def root():
     return {"message": "Medical Report Analysis API is running"}
 
-@app.post("/analyze")
-async def analyze_medical_report(report_data: Dict[str, Any] = Body(...)):
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Expose runtime counters (cache hit rate, saved upstream time, ...)
+    """
+    return {
+        "analyze_cache": analyze_cache.stats(),
+        "pdf_pool": pdf_pool.stats(),
+        "jobs": job_queue.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "admission": {name: limiter.stats() for name, limiter in admission_limiters.items()},
+        "report_store": report_store.stats(),
+        "fallback_prompt": fallback_prompt_stats
+    }
+
+
+# Token required (X-Admin-Token header) by the admin endpoints; without one they are disabled
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+
+def require_admin_token(token: Optional[str]):
+    """
+    Reject a request to an admin endpoint unless it carries ADMIN_TOKEN
+
+    Raises:
+        HTTPException: 403 if no ADMIN_TOKEN is configured, 401 if the token is missing or wrong
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not token or not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+class AdmissionLimits(BaseModel):
+    max_concurrency: Optional[int] = Field(None, ge=1)
+    queue_limit: Optional[int] = Field(None, ge=0)
+    max_wait_seconds: Optional[float] = Field(None, gt=0)
+
+
+@app.put("/admission/{name}")
+async def update_admission_limits(name: str, limits: AdmissionLimits, x_admin_token: Optional[str] = Header(None)):
+    """
+    Change the admission limits of an endpoint group (upload_pdf, analyze or biobert) at runtime
+    
+    Requires the ADMIN_TOKEN in an X-Admin-Token header. Fields left out
+    keep their current value. Returns the group's updated counters.
+    """
+    require_admin_token(x_admin_token)
+    limiter = admission_limiters.get(name)
+    if limiter is None:
+        raise HTTPException(status_code=404, detail=f"Unknown admission group: {name}")
+    
+    limiter.set_limits(**limits.model_dump())
+    return limiter.stats()
+
+
+@app.on_event("startup")
+async def start_job_queue():
+    job_queue.register("metric_extraction", run_metric_extraction_job)
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_pools():
+    await job_queue.stop()
+    pdf_pool.shutdown()
+
+@app.post("/analyze", response_model=AnalyzeResponse)
+async def analyze_medical_report(request: Request, report_data: Dict[str, Any] = Body(...), legacy_content: bool = ANALYZE_LEGACY_CONTENT):
     """
     Analyze medical report data using Claude AI
     
     Expects a JSON object with medical report data including metrics
-    Returns enhanced analysis with insights and recommendations
+    Returns enhanced analysis with insights and recommendations in
+    "analysis" (plus the legacy JSON string "content" if legacy_content
+    is set). If Claude
+    does not answer within the request deadline, the fallback analysis is
+    returned; if the client disconnects, the upstream call is cancelled
+    (unless other requests are waiting for the same analysis).
     """
+    deadline = request_deadline(request)
     try:
-        # Extract base metrics if available
-        base_metrics = report_data.get("baseMetrics", [])
-        report_type = report_data.get("reportType", "general")
-        
-        # Prepare the prompt for Claude
-        prompt = f"""Analyze this medical report data and provide medically accurate insights:
-        {json.dumps(report_data)}
-        
-        Return only a JSON object with the following structure:
-        {{"insights": [string array of key health insights],
-          "metrics": [array of metric objects with name, value, unit, status],
-          "recommendations": [string array of personalized recommendations],
-          "trends": {{
-            "description": string describing the overall trend,
-            "concerns": [array of potential health concerns]
-          }}
-        }}
-        
-        IMPORTANT MEDICAL GUIDELINES:
-        1. Do NOT change any values of the metrics in the input data, only add or enhance metadata
-        2. For status, use one of: "normal", "caution", "attention"
-        3. Do not exaggerate risks or create false concerns
-        4. Ensure all insights and recommendations are medically accurate and responsible
-        5. Focus on providing actionable health insights based on the lab values
-        6. Include specific reference ranges when discussing abnormal values
-        7. Highlight potential correlations between different metrics
-        8. Suggest follow-up tests when appropriate for concerning values
-        """
-        
-        # Call the Anthropic API
-        headers = {
-            "x-api-key": ANTHROPIC_API_KEY,
-            "Content-Type": "application/json",
-            "anthropic-version": "2023-06-01"
-        }
-        
-        payload = {
-            "model": "claude-3-haiku-20240307",  # Using the same model as in llmService.ts
-            "max_tokens": 1500,
-            "temperature": 0.2,  # Lower temperature for more consistent medical advice
-            "messages": [{"role": "user", "content": prompt}]
-        }
+        # Identical payloads (page reloads, retries, ...) share one cached or in-flight upstream call.
+        # The key only covers the fields sent to the model, so UI-only changes still hit the cache.
+        cache_key = analyze_cache.make_key(compact_report(report_data))
+        parsed_content = await run_until_disconnect(request, deadline.run(analyze_cache.get_or_compute(
+            cache_key, lambda: request_analysis(report_data), cacheable=is_complete_analysis
+        )))
+
+        # The analysis was validated against the schema when it was parsed, so it is encoded directly.
+        # Only complete analyses are stored: a fallback or partial one would differ on the next try
+        if parsed_content is None:
+            return ORJSONResponse(analysis_body(generate_fallback_analysis(report_data), legacy_content))
+        if not is_complete_analysis(parsed_content):
+            return ORJSONResponse(analysis_body(parsed_content, legacy_content))
+        return await report_response(request, analysis_body(parsed_content, legacy_content))
+    
+    except DeadlineExceeded as e:
+        print(f"Analysis not ready in time: {str(e)}")
+        return ORJSONResponse(analysis_body(generate_fallback_analysis(report_data), legacy_content))
+    except ClientDisconnected:
+        print("Client disconnected, analysis cancelled")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except Exception as e:
+        print(f"Error processing request: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing medical report: {str(e)}")
+
+
+async def request_analysis(report_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Ask Claude to analyze the report data
+    
+    Returns the parsed and validated analysis (a PartialAnalysis if Claude
+    stopped before finishing it), or None when the upstream call fails or
+    its output is unusable (the caller then falls back)
+    """
+    response = await post_message(build_analysis_payload(report_data), priority="analyze")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(ANTHROPIC_API_URL, json=payload, headers=headers)
-            
-        if response.status_code != 200:
-            print(f"API Error: {response.text}")
-            return generate_fallback_response(report_data)
-            
-        # Parse the response
-        response_data = response.json()
+    if response.status_code != 200:
+        print(f"API Error: {response.text}")
+        return None
         
-        # The Claude API response structure has changed, content is directly in the response
-        text_content = response_data.get("content", [{}])[0].get("text", "{}")
+    # Parse the response
+    response_data = response.json()
+    usage = response_data.get("usage", {})
+    print(f"Analysis usage: {usage.get('input_tokens')} input tokens, {usage.get('output_tokens')} output tokens")
+    
+    # The Claude API response structure has changed, content is directly in the response
+    text_content = response_data.get("content", [{}])[0].get("text", "{}")
+    
+    return parse_analysis(text_content, response_data.get("stop_reason"))
+
+
+def build_analysis_payload(report_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the messages API request body for analyzing a medical report
+    
+    Only the fields the model needs are sent, within ANALYZE_INPUT_TOKEN_BUDGET,
+    and the static instructions go in the system prompt
+    """
+    prompt = build_analysis_prompt(report_data, token_budget=ANALYZE_INPUT_TOKEN_BUDGET)
+    print(f"Analysis prompt: ~{prompt['estimated_input_tokens']} input tokens, "
+          f"{prompt['omitted_metrics']} metrics omitted")
+    
+    return {
+        "model": ANALYZE_MODEL,
+        "max_tokens": 1500,
+        "temperature": ANALYZE_TEMPERATURE,
+        "system": prompt["system"],
+        "messages": prompt["messages"]
+    }
+
+
+def parse_analysis(text_content: str, stop_reason: Optional[str] = "end_turn") -> Optional[Dict[str, Any]]:
+    """
+    Parse and validate Claude's analysis text
+    
+    Returns the analysis dict, or None if it is not valid JSON or misses required fields
+    """
+    parser = StreamingJSONParser()
+    parser.feed(text_content)
+    return validate_analysis(parser, stop_reason)
+
+
+def validate_analysis(parser: StreamingJSONParser, stop_reason: Optional[str] = "end_turn") -> Optional[Dict[str, Any]]:
+    """
+    Validate the analysis collected by a parser that consumed Claude's output
+    
+    Prose around the JSON object is ignored. If the output was truncated or
+    malformed but some metrics or insights were complete, they are kept and
+    the missing sections are left empty rather than discarding the response.
+    Such an analysis, or any analysis Claude did not finish (stop_reason
+    other than "end_turn", e.g. "max_tokens"), is returned as a PartialAnalysis.
+    
+    Returns the analysis dict, or None if nothing usable could be parsed
+    """
+    parsed_content = parser.result()
+    if parsed_content is None:
+        print("Failed to parse LLM response as JSON")
+        return None
+    
+    if parser.recovered:
+        if not parsed_content.get("metrics") and not parsed_content.get("insights"):
+            print("Failed to parse LLM response as JSON")
+            return None
+        print(f"Recovered partial analysis from malformed output: {sorted(parsed_content)}")
+        parsed_content = {**EMPTY_ANALYSIS, **parsed_content}
+    
+    # Validate the structure
+    required_fields = ["insights", "metrics", "recommendations", "trends"]
+    missing_fields = [field for field in required_fields if field not in parsed_content]
+    
+    if missing_fields:
+        print(f"Missing required fields in response: {missing_fields}")
+        return None
+    
+    # Validate the types (and coerce them, e.g. a null trends description)
+    try:
+        analysis = Analysis.model_validate(parsed_content)
+    except ValidationError as e:
+        print(f"Invalid analysis in response: {e.error_count()} errors, first: {e.errors()[0]['msg']}")
+        return None
         
-        # Parse the JSON from the text
+    analysis = analysis.model_dump()
+    if parser.recovered or stop_reason != "end_turn":
+        print(f"Incomplete analysis (recovered: {parser.recovered}, stop reason: {stop_reason}), not caching it")
+        return PartialAnalysis(analysis)
+    return analysis
+
+
+def is_complete_analysis(analysis: Dict[str, Any]) -> bool:
+    """Whether an analysis is complete, and so worth caching"""
+    return not isinstance(analysis, PartialAnalysis)
+
+
+def analysis_body(analysis: Dict[str, Any], legacy_content: bool = False) -> Dict[str, Any]:
+    """
+    Build the /analyze response body for a validated analysis
+    
+    The status is "partial" for an analysis Claude did not finish. With
+    legacy_content the analysis is also included as a JSON-encoded
+    "content" string, for clients written against the old response
+    """
+    body = {"analysis": analysis, "status": "success" if is_complete_analysis(analysis) else "partial"}
+    if legacy_content:
+        body["content"] = orjson.dumps(analysis).decode()
+    return body
+
+
+@app.post("/analyze/stream")
+async def analyze_medical_report_stream(request: Request, report_data: Dict[str, Any] = Body(...), legacy_content: bool = ANALYZE_LEGACY_CONTENT):
+    """
+    Streaming variant of /analyze using server-sent events
+    
+    Emits an "item" event for each element of metrics and insights and a
+    "section" event for each top-level field of the analysis as soon as
+    Claude finishes writing it, then a "done" event carrying the same body
+    /analyze would have returned. At the request deadline the upstream
+    stream is closed and the sections completed so far are used.
+    """
+    deadline = request_deadline(request)
+    cache_key = analyze_cache.make_key(compact_report(report_data))
+
+    async def event_stream():
+        yield sse_event({"status": "started"}, event="start")
+
+        cached = analyze_cache.get(cache_key)
+        if cached is not None:
+            for name, value in cached.items():
+                yield sse_event({"name": name, "value": value}, event="section")
+            yield sse_event(analysis_body(cached, legacy_content), event="done")
+            return
+
+        start_time = time.perf_counter()
+        parser = StreamingJSONParser()
+        stream_failed = False
+        message = {}
+        upstream = stream_message_text(build_analysis_payload(report_data), priority="analyze", message=message)
         try:
-            parsed_content = json.loads(text_content)
-            # Validate the parsed content and its structure
-            if not isinstance(parsed_content, dict):
-                raise ValueError("Response is not a valid JSON object")
-                
-            required_fields = ["insights", "metrics", "recommendations", "trends"]
-            missing_fields = [field for field in required_fields if field not in parsed_content]
-            
-            if missing_fields:
-                print(f"Missing required fields in response: {missing_fields}")
-                return generate_fallback_response(report_data)
-                
-            # Return the validated content
-            return {
-                "content": json.dumps(parsed_content),
-                "status": "success"
-            }
-        except json.JSONDecodeError:
-            print("Failed to parse LLM response as JSON")
-            return generate_fallback_response(report_data)
-            
-    except Exception as e:
-        print(f"Error processing request: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing medical report: {str(e)}")
+            while True:
+                try:
+                    text = await deadline.run(upstream.__anext__())
+                except StopAsyncIteration:
+                    break
+                for kind, name, value in parser.feed(text):
+                    yield sse_event({"name": name, "value": value}, event="section" if kind == "field" else "item")
+        except (httpx.HTTPError, RuntimeError, DeadlineExceeded) as e:
+            # Keep whatever Claude completed before the stream broke
+            print(f"Analysis stream stopped early: {str(e)}")
+            stream_failed = True
+        finally:
+            await upstream.aclose()
+
+        parsed_content = validate_analysis(parser, message.get("stop_reason"))
+        if parsed_content is None:
+            yield sse_event(analysis_body(generate_fallback_analysis(report_data), legacy_content), event="done")
+            return
 
+        # A result cut short (transient upstream error, max_tokens, malformed output) is not worth caching
+        if not stream_failed and is_complete_analysis(parsed_content):
+            analyze_cache.set(cache_key, parsed_content, time.perf_counter() - start_time)
+        yield sse_event(analysis_body(parsed_content, legacy_content), event="done")
 
-def generate_fallback_response(report_data: Dict[str, Any]) -> Dict[str, Any]:
+    # Starlette cancels the generator when the client disconnects, which closes the upstream stream
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def generate_fallback_analysis(report_data: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Generate a fallback response when the API call fails
+    Generate a fallback analysis when the API call fails
     Similar to the analyzeFallbackData function in llmService.ts
     """
     # Extract base metrics if available
@@ -156,35 +506,893 @@ def generate_fallback_response(report_data: Dict[str, Any]) -> Dict[str, Any]:
         }
     }
     
-    return {
-        "content": json.dumps(fallback_response),
-        "status": "success"
-    }
+    return fallback_response
 
 
-@app.post("/chat")
-async def chat_with_claude(prompt: str = Body(..., embed=True)):
+@app.post("/analyze/bulk")
+async def analyze_medical_reports_bulk(reports: List[Dict[str, Any]] = Body(..., embed=True)):
     """
-    General-purpose endpoint to chat with Claude AI
+    Analyze many medical reports at once, for backfills and offline reprocessing
     
-    Expects a text prompt
-    Returns Claude's response
+    Reports are packed ANALYZE_BULK_REPORTS_PER_CALL at a time into one
+    upstream call, so the instructions and the round trip are paid once per
+    pack instead of once per report. Claude tags the output of each report;
+    the combined response is split and every report validated on its own,
+    and only the reports whose output is missing or invalid are packed again
+    and retried. Reports in the /analyze cache (or repeated in the request)
+    are not sent again, and new analyses are added to the cache.
+    
+    The response is newline-delimited JSON with one "report" line per
+    report, in completion order, carrying its index, "analysis" and
+    "status" ("success", or "fallback" after ANALYZE_BULK_MAX_ATTEMPTS
+    failed attempts or an unexpected error), then a "summary" line with the
+    counts and the number of upstream calls made.
+    
+    Args:
+        reports: The report data objects, as sent to /analyze
     """
-    headers = {
-        "x-api-key": ANTHROPIC_API_KEY,
-        "Content-Type": "application/json",
-        "anthropic-version": "2023-06-01"
+    if len(reports) > ANALYZE_BULK_MAX_REPORTS:
+        raise HTTPException(status_code=400, detail=f"Bulk analysis is limited to {ANALYZE_BULK_MAX_REPORTS} reports")
+    
+    async def ndjson_stream():
+        results = asyncio.Queue()
+        counts = {"success": 0, "fallback": 0, "cached": 0, "upstream_calls": 0}
+        
+        # Identical reports share one analysis: cache key -> indices of the reports
+        indices_by_key: Dict[str, List[int]] = {}
+        for index, report in enumerate(reports):
+            indices_by_key.setdefault(analyze_cache.make_key(compact_report(report)), []).append(index)
+        
+        emitted = set()
+        
+        async def emit(key, analysis, status, attempts):
+            emitted.add(key)
+            counts[status] += len(indices_by_key[key])
+            for index in indices_by_key[key]:
+                await results.put({"type": "report", "index": index, "analysis": analysis, "status": status, "attempts": attempts})
+        
+        pending = []
+        for key, indices in indices_by_key.items():
+            cached = analyze_cache.get(key)
+            if cached is not None:
+                counts["cached"] += len(indices)
+                await emit(key, cached, "success", 0)
+            else:
+                pending.append(key)
+        
+        slots = asyncio.Semaphore(ANALYZE_BULK_CONCURRENCY)
+        
+        async def analyze_pack(keys):
+            attempt = 0
+            try:
+                for attempt in range(1, ANALYZE_BULK_MAX_ATTEMPTS + 1):
+                    async with slots:
+                        counts["upstream_calls"] += 1
+                        start_time = time.perf_counter()
+                        # Short ids within the pack keep the tags cheap
+                        analyses = await request_bulk_analysis([
+                            (str(position), reports[indices_by_key[key][0]]) for position, key in enumerate(keys, start=1)
+                        ])
+                        cost = (time.perf_counter() - start_time) / len(keys)
+                
+                    failed = []
+                    for position, key in enumerate(keys, start=1):
+                        analysis = analyses.get(str(position))
+                        if analysis is None:
+                            failed.append(key)
+                            continue
+                        analyze_cache.set(key, analysis, cost_seconds=cost)
+                        await emit(key, analysis, "success", attempt)
+                    if not failed:
+                        return
+                    print(f"Bulk analysis: {len(failed)} of {len(keys)} reports failed on attempt {attempt}")
+                    keys = failed
+            except Exception as e:
+                # One broken pack must not cost the other reports (or the summary) their lines
+                print(f"Bulk analysis of {len(keys)} reports failed: {str(e)}")
+                keys = [key for key in keys if key not in emitted]
+            
+            for key in keys:
+                report = reports[indices_by_key[key][0]]
+                await emit(key, generate_fallback_analysis(report), "fallback", attempt)
+        
+        async def produce():
+            try:
+                await asyncio.gather(*(
+                    analyze_pack(pending[i:i + ANALYZE_BULK_REPORTS_PER_CALL])
+                    for i in range(0, len(pending), ANALYZE_BULK_REPORTS_PER_CALL)
+                ), return_exceptions=True)
+            finally:
+                await results.put(None)
+        
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield orjson.dumps(result).decode() + "\n"
+            
+            producer.result()
+            yield orjson.dumps({
+                "type": "summary",
+                "reports": len(reports),
+                "succeeded": counts["success"],
+                "fallback": counts["fallback"],
+                "cached": counts["cached"],
+                "upstream_calls": counts["upstream_calls"]
+            }).decode() + "\n"
+        finally:
+            # Stop the remaining upstream calls if the client went away
+            producer.cancel()
+    
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+
+async def request_bulk_analysis(reports: List[tuple]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Ask Claude to analyze several reports in one call
+    
+    Args:
+        reports: (report id, report data) pairs, with string ids
+    
+    Returns:
+        The validated analysis of each report by id; None for the reports
+        whose output was missing or invalid, or for all of them if the call failed
+    """
+    prompt = build_bulk_analysis_prompt(reports, token_budget=ANALYZE_INPUT_TOKEN_BUDGET)
+    payload = {
+        "model": ANALYZE_MODEL,
+        "max_tokens": min(ANALYZE_BULK_MAX_OUTPUT_TOKENS, ANALYZE_BULK_OUTPUT_TOKENS_PER_REPORT * len(reports)),
+        "temperature": ANALYZE_TEMPERATURE,
+        "system": prompt["system"],
+        "messages": prompt["messages"]
     }
     
+    try:
+        response = await post_message(payload, priority="background")
+    except httpx.HTTPError as e:
+        print(f"Bulk analysis request failed: {str(e)}")
+        return {report_id: None for report_id, _ in reports}
+    if response.status_code != 200:
+        print(f"API Error: {response.text}")
+        return {report_id: None for report_id, _ in reports}
+    
+    response_data = response.json()
+    usage = response_data.get("usage", {})
+    print(f"Bulk analysis of {len(reports)} reports: {usage.get('input_tokens')} input tokens, "
+          f"{usage.get('output_tokens')} output tokens")
+    
+    outputs = split_bulk_response(response_data.get("content", [{}])[0].get("text", ""))
+    analyses = {}
+    for report_id, _ in reports:
+        analyses[report_id] = None
+        if outputs.get(report_id):
+            parser = StreamingJSONParser()
+            parser.feed(outputs[report_id])
+            analysis = validate_analysis(parser)
+            # A cut-off output is retried rather than kept as a partial analysis
+            if analysis is not None and not parser.recovered:
+                analyses[report_id] = analysis
+    return analyses
+
+
+@app.post("/upload-pdf")
+async def upload_pdf(request: Request, file: UploadFile = File(...), background: bool = False):
+    """
+    Upload and process a PDF medical report
+    
+    Processing stops when the request deadline passes (the results computed
+    so far are returned, marked "partial") or when the client disconnects.
+    
+    Args:
+        file: The uploaded PDF file
+        background: Run the slow Claude fallback as a background job instead of
+            waiting for it; the response then carries a "job" to poll at /jobs/{id}
+        
+    Returns:
+        Dict: The extracted medical data and analysis
+    """
+    deadline = request_deadline(request)
+    try:
+        # Validate file type
+        if not file.filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="Only PDF files are supported")
+        
+        # Extract text and medical data in the worker pool
+        path = await spool_upload(file)
+        try:
+            # Not kept in the report store: the result carries the full text of the PDF
+            return await run_until_disconnect(request, process_pdf_file(path, background=background, deadline=deadline))
+        except PoolSaturatedError:
+            raise HTTPException(status_code=503, detail="Server is busy processing other PDFs", headers={"Retry-After": "5"})
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=f"No results before the deadline: {str(e)}")
+        except ClientDisconnected:
+            print(f"Client disconnected, stopped processing {file.filename}")
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        finally:
+            os.unlink(path)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error processing PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+
+
+@app.get("/reports/{content_id}")
+async def get_report(request: Request, content_id: str):
+    """
+    Fetch a stored /analyze result by its content id
+    
+    The content id is sent in the ETag and Content-Location headers of those
+    responses, and cannot be derived from the result, so only the client the
+    result was sent to can fetch it. Send it back in If-None-Match to get a
+    304 when nothing changed; large results are gzip- or brotli-compressed if
+    the client accepts it. Results expire after REPORT_STORE_MAX_AGE_SECONDS.
+    """
+    response = await run_in_threadpool(report_store.response, request, content_id)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return response
+
+
+async def report_response(request: Request, body: Dict[str, Any]) -> Response:
+    """
+    Store a result and send it with its content id as ETag, compressed when large
+    
+    Compression and SQLite run in the threadpool, off the event loop.
+    """
+    content_id = await run_in_threadpool(report_store.put, orjson.dumps(body))
+    response = await run_in_threadpool(report_store.response, request, content_id)
+    # Evicted again by concurrent results already: send it unstored
+    return response or ORJSONResponse(body)
+
+
+@app.post("/upload-pdf/stream")
+async def upload_pdf_stream(request: Request, file: UploadFile = File(...)):
+    """
+    Upload a PDF medical report and stream the results page by page
+    
+    The upload is spooled to a temporary file and extracted a few pages at a
+    time in the worker pool. The response is newline-delimited JSON:
+    a "start" line with the page count, one "page" line per page as soon as
+    it is extracted (pages without regex matches are sent to Claude and
+    reported again with "source": "llm"), then a "summary" line with the
+    merged metrics and category. If the request deadline passes, the
+    remaining pages are skipped and the summary is marked "partial".
+    
+    Args:
+        file: The uploaded PDF file
+    """
+    # Validate file type
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    
+    deadline = request_deadline(request)
+    path = await spool_upload(file)
+    try:
+        doc_hash, num_pages = await deadline.run(pdf_pool.run(fingerprint_pdf, path))
+    except PoolSaturatedError:
+        os.unlink(path)
+        raise HTTPException(status_code=503, detail="Server is busy processing other PDFs", headers={"Retry-After": "5"})
+    except DeadlineExceeded as e:
+        os.unlink(path)
+        raise HTTPException(status_code=504, detail=f"No results before the deadline: {str(e)}")
+    except Exception as e:
+        os.unlink(path)
+        print(f"Error reading PDF: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Could not read the PDF: {str(e)}")
+    
+    async def ndjson_stream():
+        pages_metrics = [[] for _ in range(num_pages)]
+        llm_tasks = []
+        partial = None
+        
+        async def llm_page(page):
+            metrics = await request_metric_extraction(page["text"], pages=[page])
+            pages_metrics[page["page"] - 1] = metrics
+            return {"type": "page", "page": page["page"], "metrics": metrics, "source": "llm"}
+        
+        try:
+            yield json.dumps({"type": "start", "pages": num_pages}) + "\n"
+            
+            for start in range(0, num_pages, PDF_STREAM_PAGES_PER_JOB):
+                try:
+                    pages = await deadline.run(pdf_pool.run(
+                        extract_pdf_page_range, path, doc_hash, start, min(start + PDF_STREAM_PAGES_PER_JOB, num_pages), wait=True
+                    ))
+                except DeadlineExceeded:
+                    partial = {"stage": "parse", "reason": "deadline", "pages_processed": start, "pages": num_pages}
+                    break
+                for page in pages:
+                    pages_metrics[page["page"] - 1] = page["metrics"]
+                    yield json.dumps({"type": "page", "source": "regex", **page}) + "\n"
+                    
+                    # Only pages that have text but yielded nothing go to the LLM fallback
+                    if not page["metrics"] and page["text"].strip():
+                        llm_tasks.append(asyncio.create_task(llm_page(page)))
+                
+                # Report fallback results that finished while we were extracting
+                for task in [task for task in llm_tasks if task.done()]:
+                    llm_tasks.remove(task)
+                    yield json.dumps(task.result()) + "\n"
+            
+            try:
+                for task in asyncio.as_completed(llm_tasks, timeout=deadline.remaining()):
+                    yield json.dumps(await task) + "\n"
+            except asyncio.TimeoutError:
+                # Fallback calls still running are cancelled below
+                partial = partial or {"stage": "llm", "reason": "deadline"}
+            
+            metrics = merge_page_metrics(pages_metrics)
+            summary = {
+                "type": "summary",
+                "pages": num_pages,
+                "metrics": metrics,
+                "category": determine_category(metrics)
+            }
+            if partial:
+                summary["partial"] = partial
+            yield json.dumps(summary) + "\n"
+        except Exception as e:
+            print(f"Error processing PDF: {str(e)}")
+            yield json.dumps({"type": "error", "detail": f"Error processing PDF: {str(e)}"}) + "\n"
+        finally:
+            for task in llm_tasks:
+                task.cancel()
+            os.unlink(path)
+    
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+
+@app.post("/upload-pdf/batch")
+async def upload_pdf_batch(files: List[UploadFile] = File(...)):
+    """
+    Upload many PDF medical reports at once, as several files and/or ZIP archives
+    
+    ZIP archives are unpacked one member at a time. Up to PDF_BATCH_CONCURRENCY
+    files go through the /upload-pdf pipeline concurrently. The response is
+    newline-delimited JSON with one "file" line per PDF, in completion order,
+    carrying its index, name and either the usual /upload-pdf body or an
+    "error"; a final "summary" line gives the counts. A failing file does
+    not affect the others.
+    
+    Args:
+        files: The uploaded PDF and ZIP files
+    """
+    async def ndjson_stream():
+        results = asyncio.Queue()
+        slots = asyncio.Semaphore(PDF_BATCH_CONCURRENCY)
+        tasks = []
+        
+        async def process(index, name, path):
+            try:
+                result = await process_pdf_file(path, wait=True, priority="background")
+            except Exception as e:
+                print(f"Error processing {name}: {str(e)}")
+                result = {"error": f"Error processing PDF: {str(e)}"}
+            finally:
+                os.unlink(path)
+                slots.release()
+            await results.put({"type": "file", "index": index, "name": name, **result})
+        
+        async def produce():
+            index = 0
+            try:
+                for upload in files:
+                    filename = upload.filename or ""
+                    try:
+                        if filename.lower().endswith(".zip"):
+                            async for name, path in unpack_zip_upload(upload, slots):
+                                if index >= PDF_BATCH_MAX_FILES:
+                                    os.unlink(path)
+                                    slots.release()
+                                    raise ValueError(f"Batch is limited to {PDF_BATCH_MAX_FILES} files")
+                                tasks.append(asyncio.create_task(process(index, name, path)))
+                                index += 1
+                            continue
+                        
+                        if not filename.lower().endswith(".pdf"):
+                            raise ValueError("Only PDF and ZIP files are supported")
+                        if index >= PDF_BATCH_MAX_FILES:
+                            raise ValueError(f"Batch is limited to {PDF_BATCH_MAX_FILES} files")
+                        
+                        await slots.acquire()
+                        try:
+                            path = await spool_upload(upload, max_bytes=PDF_BATCH_MAX_FILE_BYTES)
+                        except Exception:
+                            slots.release()
+                            raise
+                        tasks.append(asyncio.create_task(process(index, filename, path)))
+                    except Exception as e:
+                        await results.put({"type": "file", "index": index, "name": filename, "error": str(e)})
+                    index += 1
+                
+                await asyncio.gather(*tasks)
+            finally:
+                await results.put(None)
+        
+        producer = asyncio.create_task(produce())
+        succeeded = failed = 0
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                if "error" in result:
+                    failed += 1
+                else:
+                    succeeded += 1
+                yield json.dumps(result) + "\n"
+            
+            yield json.dumps({"type": "summary", "files": succeeded + failed, "succeeded": succeeded, "failed": failed}) + "\n"
+        finally:
+            # Stop the remaining work if the client went away
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+
+async def unpack_zip_upload(upload: UploadFile, slots: asyncio.Semaphore):
+    """
+    Extract the PDF members of an uploaded ZIP archive to temporary files, one at a time
+    
+    A slot is acquired before each member is extracted, so the archive is
+    unpacked only as fast as the files are processed. The consumer releases
+    the slot once it is done with the file.
+    
+    Yields:
+        Tuple of (member name, temporary file path)
+    """
+    archive = await run_in_threadpool(zipfile.ZipFile, upload.file)
+    try:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or not name.lower().endswith(".pdf") or "__MACOSX/" in name:
+                continue
+            if info.file_size > PDF_BATCH_MAX_FILE_BYTES:
+                raise ValueError(f"{name} is larger than {PDF_BATCH_MAX_FILE_BYTES} bytes")
+            
+            await slots.acquire()
+            try:
+                path = await run_in_threadpool(extract_zip_member, archive, info)
+            except Exception:
+                slots.release()
+                raise
+            yield name, path
+    finally:
+        archive.close()
+
+
+def extract_zip_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> str:
+    """
+    Copy one ZIP member to a temporary file in chunks, enforcing PDF_BATCH_MAX_FILE_BYTES
+    
+    Returns the path of the file; the caller deletes it when done
+    """
+    spool = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    written = 0
+    try:
+        with spool, archive.open(info) as member:
+            while True:
+                chunk = member.read(UPLOAD_SPOOL_CHUNK_BYTES)
+                if not chunk:
+                    break
+                # Do not trust the size in the archive header alone
+                written += len(chunk)
+                if written > PDF_BATCH_MAX_FILE_BYTES:
+                    raise ValueError(f"{info.filename} is larger than {PDF_BATCH_MAX_FILE_BYTES} bytes")
+                spool.write(chunk)
+    except Exception:
+        os.unlink(spool.name)
+        raise
+    return spool.name
+
+
+async def spool_upload(file: UploadFile, max_bytes: Optional[int] = None) -> str:
+    """
+    Copy an upload to a temporary file in chunks, so the workers can read it from disk
+    
+    Args:
+        file: The uploaded file
+        max_bytes: Largest accepted upload, None for no limit
+    
+    Returns the path of the file; the caller deletes it when done
+    
+    Raises:
+        ValueError: If the upload is larger than max_bytes
+    """
+    spool = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    written = 0
+    try:
+        with spool:
+            while True:
+                chunk = await file.read(UPLOAD_SPOOL_CHUNK_BYTES)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if max_bytes is not None and written > max_bytes:
+                    raise ValueError(f"{file.filename} is larger than {max_bytes} bytes")
+                spool.write(chunk)
+    except Exception:
+        os.unlink(spool.name)
+        raise
+    return spool.name
+
+
+async def process_pdf_file(path: str, wait: bool = False, background: bool = False, priority: str = "analyze",
+                           deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Run the /upload-pdf pipeline on a spooled PDF: extraction, then the Claude fallback if no metrics were found
+    
+    With background=True the fallback is queued as a job and its id is
+    returned in "job" instead of waiting for Claude. Otherwise, unless
+    UPLOAD_HEDGED_FALLBACK is off, metrics are extracted while pages are
+    still being parsed. When the deadline passes,
+    the stage that was running is cut short and extracted_data["partial"]
+    records which one.
+    
+    Returns:
+        Dict: The /upload-pdf response body
+    
+    Raises:
+        DeadlineExceeded: If the deadline passed before any text was extracted
+    """
+    if UPLOAD_HEDGED_FALLBACK and not background:
+        extracted_data = await extract_pdf_document_hedged(path, wait=wait, priority=priority, deadline=deadline)
+        if not extracted_data["text"]:
+            return {"error": "Could not extract text from the PDF", "extracted_data": extracted_data}
+        return {"extracted_data": extracted_data}
+    
+    extracted_data = await extract_pdf_document(path, wait=wait, deadline=deadline)
+    
+    if not extracted_data["text"]:
+        return {"error": "Could not extract text from the PDF", "extracted_data": extracted_data}
+    
+    # If no metrics were found, try to use Claude to extract them
+    if not extracted_data["metrics"]:
+        if background:
+            job_id = job_queue.submit("metric_extraction", {"extracted_data": extracted_data})
+            return {"extracted_data": extracted_data, "job": {"id": job_id, "status": "queued"}}
+        
+        # Metrics Claude completed before the deadline are kept
+        metrics = []
+        try:
+            await run_within(deadline, request_metric_extraction(extracted_data["text"], priority=priority, metrics=metrics))
+        except DeadlineExceeded:
+            extracted_data.setdefault("partial", {"stage": "llm", "reason": "deadline"})
+        extracted_data["metrics"] = metrics
+    
+    return {"extracted_data": extracted_data}
+
+
+async def extract_pdf_document(path: str, wait: bool = False, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Extract the text and medical data of a spooled PDF in the worker pool
+    
+    Large documents are split into page ranges extracted in parallel by
+    several workers; pages already in the page cache are not parsed again.
+    Pass wait=True to queue even when the pool is saturated. If the deadline
+    passes while pages are parsed, the remaining page ranges are cancelled
+    and the pages parsed so far are used ("partial" says how many).
+    
+    Returns:
+        Dict: The extracted medical data, with an empty "text" if no text could be extracted
+    
+    Raises:
+        DeadlineExceeded: If the deadline passed before any page was parsed
+    """
+    tasks = []
+    try:
+        doc_hash, num_pages = await run_within(deadline, pdf_pool.run(fingerprint_pdf, path, wait=wait))
+        
+        jobs = max(1, min(pdf_pool.max_workers, num_pages // PDF_PARALLEL_MIN_PAGES))
+        bounds = [(num_pages * i // jobs, num_pages * (i + 1) // jobs) for i in range(jobs)]
+        tasks = [
+            asyncio.ensure_future(pdf_pool.run(extract_pdf_page_texts, path, doc_hash, start, stop, wait=True))
+            for start, stop in bounds
+        ]
+        done, pending = await asyncio.wait(tasks, timeout=deadline.remaining() if deadline else None)
+        chunks = [task.result() for task in tasks if task in done]
+    except (PoolSaturatedError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"Error extracting text from PDF: {str(e)}")
+        return {"metrics": [], "category": "general", "text": ""}
+    finally:
+        # Page ranges not started yet are dropped from the pool queue
+        for task in tasks:
+            task.cancel()
+    
+    text = "".join(page + "\n\n" for chunk in chunks for page in chunk)
+    if pending and not text:
+        raise DeadlineExceeded("Request deadline exceeded while parsing the PDF")
+    if not text:
+        return {"metrics": [], "category": "general", "text": ""}
+    
+    # Regex extraction is cheap, so it also runs on the pages of a cut-short parse
+    extracted_data = await pdf_pool.run(extract_medical_data, text, wait=True)
+    if pending:
+        extracted_data["partial"] = {
+            "stage": "parse",
+            "reason": "deadline",
+            "pages_processed": sum(len(chunk) for chunk in chunks),
+            "pages": num_pages
+        }
+    return extracted_data
+
+
+async def extract_pdf_document_hedged(path: str, wait: bool = False, priority: str = "analyze",
+                                      deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Extract a spooled PDF like extract_pdf_document, overlapping metric extraction with parsing
+    
+    Each page range is parsed and regex-extracted by a worker, so the
+    metrics of a range are known as soon as it is parsed, while the other
+    ranges are still being parsed. If the regexes find nothing in the whole
+    document, one Claude fallback covers all its pages, within a single
+    UPLOAD_FALLBACK_TOKEN_BUDGET; a failed fallback leaves the text and
+    regex results as they are.
+    
+    Returns:
+        Dict: The extracted medical data, with an empty "text" if no text could be extracted
+    
+    Raises:
+        DeadlineExceeded: If the deadline passed before any page was parsed
+    """
+    range_tasks = []
+    try:
+        doc_hash, num_pages = await run_within(deadline, pdf_pool.run(fingerprint_pdf, path, wait=wait))
+        
+        jobs = max(1, min(pdf_pool.max_workers, num_pages // PDF_PARALLEL_MIN_PAGES))
+        bounds = [(num_pages * i // jobs, num_pages * (i + 1) // jobs) for i in range(jobs)]
+        range_tasks = [
+            asyncio.ensure_future(pdf_pool.run(extract_pdf_page_range, path, doc_hash, start, stop, wait=True))
+            for start, stop in bounds
+        ]
+        done, pending = await asyncio.wait(range_tasks, timeout=deadline.remaining() if deadline else None)
+        # Kept in range order, so pages and metrics merge in page order
+        ranges = [task.result() for task in range_tasks if task in done]
+    except (PoolSaturatedError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        print(f"Error extracting text from PDF: {str(e)}")
+        return {"metrics": [], "category": "general", "text": ""}
+    finally:
+        # Page ranges not started yet are dropped from the pool queue
+        for task in range_tasks:
+            task.cancel()
+    
+    pages = [page for chunk in ranges for page in chunk]
+    text = "".join(page["text"] + "\n\n" for page in pages)
+    if pending and not text:
+        raise DeadlineExceeded("Request deadline exceeded while parsing the PDF")
+    if not text:
+        return {"metrics": [], "category": "general", "text": ""}
+    
+    metrics = merge_page_metrics([page["metrics"] for page in pages])
+    extracted_data = {"metrics": metrics, "category": determine_category(metrics), "text": text}
+    if pending:
+        extracted_data["partial"] = {
+            "stage": "parse",
+            "reason": "deadline",
+            "pages_processed": len(pages),
+            "pages": num_pages
+        }
+    
+    if not metrics:
+        # Metrics Claude completed before the deadline are kept; upstream errors are handled by
+        # request_metric_extraction, which then returns no metrics
+        llm_metrics = []
+        try:
+            await run_within(deadline, request_metric_extraction(text, priority=priority, metrics=llm_metrics, pages=pages))
+        except DeadlineExceeded:
+            extracted_data.setdefault("partial", {"stage": "llm", "reason": "deadline"})
+        extracted_data["metrics"] = llm_metrics
+    return extracted_data
+
+
+async def request_metric_extraction(text: str, priority: str = "analyze", metrics: Optional[List[Dict[str, Any]]] = None,
+                                    pages: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Ask Claude to extract metrics from report text the regex patterns could not handle
+    
+    Returns the annotated metrics, or an empty list if the call or parsing fails
+    """
+    try:
+        return await fetch_metric_extraction(text, priority=priority, metrics=metrics, pages=pages)
+    except (httpx.HTTPError, RuntimeError) as e:
+        print(str(e))
+        return []
+
+
+async def fetch_metric_extraction(text: str, priority: str = "analyze", metrics: Optional[List[Dict[str, Any]]] = None,
+                                  pages: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Ask Claude to extract metrics from report text
+    
+    Unless UPLOAD_FALLBACK_PREFILTER is off, only the lines that look like
+    lab results are sent, each with its page (when pages are given) and line
+    number, and Claude is asked to say which line each metric comes from.
+    If no line looks like a result, Claude is not called at all.
+    
+    Metrics are appended to the given list as they arrive, so a caller that
+    cancels the call (e.g. at its deadline) keeps the ones already received.
+    
+    Args:
+        text: The report text
+        pages: The same text split into pages ("page" and "text" entries), for page numbers in the prompt
+    
+    Raises:
+        httpx.HTTPError: If the API cannot be reached
+        RuntimeError: If the API answers with an error or the response cannot be parsed
+    """
+    if metrics is None:
+        metrics = []
+    fallback_prompt_stats["text_tokens"] += estimate_tokens(text)
+    
+    if UPLOAD_FALLBACK_PREFILTER:
+        report_lines, kept, dropped = select_candidate_lines(
+            [(page["page"], page["text"]) for page in pages] if pages else [(None, text)],
+            UPLOAD_FALLBACK_TOKEN_BUDGET
+        )
+        if not kept:
+            fallback_prompt_stats["skipped"] += 1
+            return metrics
+        fallback_prompt_stats["results_dropped"] += dropped
+        
+        prompt = f"""Extract medical test results from these lines of a lab report. Each line starts with its location (p = page, l = line), then "|", then the text of the line.
+    
+    LINES FROM MEDICAL REPORT:
+    {report_lines}
+    
+    Return ONLY a JSON object with this structure:
+    {{
+      "metrics": [
+        {{
+          "name": "Test Name",
+          "value": numeric_value,
+          "unit": "unit of measurement",
+          "source": "location of the line the value is on, e.g. p1 l12"
+        }},
+        ...
+      ]
+    }}
+    
+    IMPORTANT:
+    1. Only include tests with clear numeric values
+    2. Convert all values to numbers (remove any text from the value field)
+    3. Include the unit if present
+    4. Do not make up or infer any values not explicitly stated
+    5. Focus on common tests like glucose, cholesterol, blood pressure, etc.
+    """
+    else:
+        prompt = f"""Extract medical test results from this lab report text. For each test, provide the name, value, and unit if available.
+    
+    TEXT FROM MEDICAL REPORT:
+    {text}
+    
+    Return ONLY a JSON object with this structure:
+    {{
+      "metrics": [
+        {{
+          "name": "Test Name",
+          "value": numeric_value,
+          "unit": "unit of measurement"
+        }},
+        ...
+      ]
+    }}
+    
+    IMPORTANT:
+    1. Only include tests with clear numeric values
+    2. Convert all values to numbers (remove any text from the value field)
+    3. Include the unit if present
+    4. Do not make up or infer any values not explicitly stated
+    5. Focus on common tests like glucose, cholesterol, blood pressure, etc.
+    """
+    fallback_prompt_stats["calls"] += 1
+    fallback_prompt_stats["prompt_tokens"] += estimate_tokens(prompt)
+    
     payload = {
         "model": "claude-3-haiku-20240307",
-        "max_tokens": 1024,
-        "temperature": 0.7,
+        "max_tokens": 1500,
+        "temperature": 0.2,
         "messages": [{"role": "user", "content": prompt}]
     }
+    
+    # Metrics are annotated as soon as each one is complete in the stream, and the
+    # complete ones are kept if the output is cut off or followed by stray prose
+    parser = StreamingJSONParser(item_fields=("metrics",))
+    try:
+        async for text_content in stream_message_text(payload, priority=priority):
+            for kind, name, value in parser.feed(text_content):
+                if kind == "item" and name == "metrics" and isinstance(value, dict):
+                    metrics.extend(annotate_llm_metrics([value]))
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(f"API Error: {e.response.text}")
+    except (httpx.HTTPError, RuntimeError):
+        if not metrics:
+            raise
+        print(f"Metric extraction stream failed, keeping {len(metrics)} metrics received")
+        return metrics
+    
+    if parser.result() is None:
+        raise RuntimeError("Failed to parse Claude's response as JSON")
+    
+    return metrics
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(ANTHROPIC_API_URL, json=payload, headers=headers)
+
+async def run_metric_extraction_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Job handler for background Claude fallback extractions queued by /upload-pdf
+    
+    Errors propagate so the job queue retries the call and eventually dead-letters it
+    """
+    extracted_data = payload["extracted_data"]
+    extracted_data["metrics"] = await fetch_metric_extraction(extracted_data["text"], priority="background")
+    return {"extracted_data": extracted_data}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Poll a background job
+    
+    Args:
+        job_id: The id returned by /upload-pdf?background=true
+        wait: Seconds to wait for the job to finish before answering (long polling)
+    
+    Returns:
+        Dict: The job status ("queued", "running", "succeeded" or "dead"), attempts, error and result
+    """
+    if wait > 0:
+        job = await job_queue.wait(job_id, timeout=min(wait, JOB_MAX_WAIT_SECONDS))
+    else:
+        job = job_queue.get(job_id)
+    
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Subscribe to a background job's completion using server-sent events
+    
+    Emits a "status" event with the current state, then a "done" event with
+    the final job (keep-alive comments are sent while waiting)
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def event_stream():
+        current = job
+        yield sse_event(current, event="status")
+        while current["status"] not in FINAL_STATES:
+            current = await job_queue.wait(job_id, timeout=15)
+            if current["status"] not in FINAL_STATES:
+                yield ": keep-alive\n\n"
+        yield sse_event(current, event="done")
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/chat")
+async def chat_with_claude(prompt: str = Body(..., embed=True)):
+    """
+    General-purpose endpoint to chat with Claude AI
+    
+    Expects a text prompt
+    Returns Claude's response
+    """
+    response = await post_message(build_chat_payload(prompt), priority="chat")
 
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail=response.text)
@@ -192,5 +1400,42 @@ async def chat_with_claude(prompt: str = Body(..., embed=True)):
     return response.json()
 
 
+@app.post("/chat/stream")
+async def chat_with_claude_stream(prompt: str = Body(..., embed=True)):
+    """
+    Streaming variant of /chat using server-sent events
+    
+    Emits a "delta" event per text fragment as Claude generates it, then
+    a "done" event (or an "error" event if the upstream call fails)
+    """
+    async def event_stream():
+        yield sse_event({"status": "started"}, event="start")
+        try:
+            async for text in stream_message_text(build_chat_payload(prompt), priority="chat"):
+                yield sse_event({"text": text}, event="delta")
+        except httpx.HTTPStatusError as e:
+            yield sse_event({"status_code": e.response.status_code, "detail": e.response.text}, event="error")
+            return
+        except (httpx.HTTPError, RuntimeError) as e:
+            yield sse_event({"status_code": 502, "detail": str(e)}, event="error")
+            return
+        yield sse_event({"status": "success"}, event="done")
+
+    # Starlette cancels the generator when the client disconnects, which closes the upstream stream
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def build_chat_payload(prompt: str) -> Dict[str, Any]:
+    """
+    Build the messages API request body for a chat prompt
+    """
+    return {
+        "model": "claude-3-haiku-20240307",
+        "max_tokens": 1024,
+        "temperature": 0.7,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+
+
 if __name__ == "__main__":
     uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,28 @@
+import os
+import sys
+
+# The modules under test live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """The server module, configured before import to run without a process pool or a shared job db"""
+    os.environ["JOB_DB_PATH"] = str(tmp_path_factory.mktemp("jobs") / "jobs.sqlite3")
+    os.environ["PDF_POOL_KIND"] = "thread"
+    os.environ["PDF_POOL_SIZE"] = "4"
+    import server
+    return server
+
+
+@pytest.fixture
+def bert_tokenizer(tmp_path):
+    """A BERT tokenizer with a tiny vocabulary, built without downloading anything"""
+    pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "glucose", "cholesterol", "hdl", "is", "high", "low", "normal"]
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(vocab) + "\n")
+    return transformers.BertTokenizerFast(vocab_file=str(vocab_file))
@@ -0,0 +1,151 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from admission import AdmissionLimiter, AdmissionMiddleware, OverloadedError
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def occupy(limiter, release, admitted=None):
+    async with limiter.admit():
+        if admitted is not None:
+            admitted.append(len(admitted))
+        await release.wait()
+
+
+def test_requests_beyond_the_queue_are_shed():
+    async def main():
+        limiter = AdmissionLimiter("upload", max_concurrency=1, queue_limit=1, retry_after_seconds=7)
+        release = asyncio.Event()
+        running = asyncio.create_task(occupy(limiter, release))
+        queued = asyncio.create_task(occupy(limiter, release))
+        await asyncio.sleep(0)
+        with pytest.raises(OverloadedError) as shed:
+            async with limiter.admit():
+                pass
+        release.set()
+        await asyncio.gather(running, queued)
+        return shed.value.retry_after, limiter.stats()
+
+    retry_after, stats = run(main())
+    assert retry_after == 7
+    assert (stats["admitted"], stats["shed"], stats["active"], stats["queued"]) == (2, 1, 0, 0)
+
+
+def test_waiting_too_long_is_shed():
+    async def main():
+        limiter = AdmissionLimiter("analyze", max_concurrency=1, queue_limit=5, max_wait_seconds=0.01)
+        release = asyncio.Event()
+        running = asyncio.create_task(occupy(limiter, release))
+        await asyncio.sleep(0)
+        with pytest.raises(OverloadedError, match="Timed out"):
+            async with limiter.admit():
+                pass
+        release.set()
+        await running
+        return limiter.stats()
+
+    stats = run(main())
+    assert stats["timed_out"] == 1 and stats["queued"] == 0
+
+
+def test_slots_are_handed_over_in_arrival_order():
+    async def main():
+        limiter = AdmissionLimiter("analyze", max_concurrency=1, queue_limit=5)
+        release = asyncio.Event()
+        admitted = []
+
+        async def request(name):
+            async with limiter.admit():
+                admitted.append(name)
+                await release.wait()
+
+        tasks = []
+        for name in ("first", "second", "third"):
+            tasks.append(asyncio.create_task(request(name)))
+            await asyncio.sleep(0)
+        assert admitted == ["first"]
+        # A newcomer must queue behind the waiting requests, even when a slot is about to free up
+        release.set()
+        tasks.append(asyncio.create_task(request("fourth")))
+        await asyncio.gather(*tasks)
+        return admitted
+
+    assert run(main()) == ["first", "second", "third", "fourth"]
+
+
+def test_raising_the_limit_admits_waiting_requests():
+    async def main():
+        limiter = AdmissionLimiter("biobert", max_concurrency=1, queue_limit=5)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(occupy(limiter, release)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert limiter.stats()["queued"] == 2
+        limiter.set_limits(max_concurrency=3)
+        await asyncio.sleep(0)
+        active = limiter.stats()["active"]
+        release.set()
+        await asyncio.gather(*tasks)
+        return active
+
+    assert run(main()) == 3
+
+
+def test_slot_handed_to_a_cancelled_request_is_passed_on():
+    async def main():
+        limiter = AdmissionLimiter("analyze", max_concurrency=1, queue_limit=5)
+        release = asyncio.Event()
+        running = asyncio.create_task(occupy(limiter, release))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(occupy(limiter, asyncio.Event()))
+        admitted = []
+        last = asyncio.create_task(occupy(limiter, release, admitted))
+        await asyncio.sleep(0)
+        # The slot goes to the second request, which is cancelled before it resumes
+        release.set()
+        await running
+        cancelled.cancel()
+        await asyncio.wait([cancelled, last], timeout=1)
+        return cancelled.cancelled(), admitted, limiter.stats()["active"]
+
+    assert run(main()) == (True, [0], 0)
+
+
+def test_middleware_answers_503_without_running_the_endpoint():
+    release = asyncio.Event()
+    calls = []
+
+    async def upload(request):
+        calls.append(request.url.path)
+        await release.wait()
+        return PlainTextResponse("done")
+
+    async def health(request):
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/upload-pdf", upload, methods=["POST"]), Route("/health", health)])
+    limiter = AdmissionLimiter("upload_pdf", max_concurrency=1, queue_limit=0, retry_after_seconds=3)
+    app = AdmissionMiddleware(app, [("/upload-pdf", limiter)])
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            first = asyncio.create_task(client.post("/upload-pdf", content=b"pdf"))
+            while not calls:
+                await asyncio.sleep(0.001)
+            shed = await client.post("/upload-pdf", content=b"pdf")
+            health = await client.get("/health")
+            release.set()
+            return (await first), shed, health
+
+    first, shed, health = run(main())
+    assert first.status_code == 200
+    assert shed.status_code == 503 and shed.headers["retry-after"] == "3"
+    assert health.status_code == 200
+    assert calls == ["/upload-pdf"]
@@ -0,0 +1,24 @@
+import pytest
+from fastapi.testclient import TestClient
+
+ANALYSIS = {"summary": "All good", "metrics": [], "insights": [], "recommendations": []}
+
+
+@pytest.fixture
+def client(server):
+    return TestClient(server.app)
+
+
+@pytest.mark.parametrize("kind", ["complete", "partial", "fallback"])
+def test_only_complete_analyses_are_stored(server, client, monkeypatch, kind):
+    async def request_analysis(report_data):
+        if kind == "fallback":
+            return None
+        return ANALYSIS if kind == "complete" else server.PartialAnalysis(ANALYSIS)
+
+    monkeypatch.setattr(server, "request_analysis", request_analysis)
+    stored = server.report_store.stats()["stored"]
+    response = client.post("/analyze", json={"baseMetrics": [{"name": f"Glucose ({kind})", "value": 90}]})
+    assert response.status_code == 200
+    assert ("etag" in response.headers) == (kind == "complete")
+    assert server.report_store.stats()["stored"] == stored + (kind == "complete")
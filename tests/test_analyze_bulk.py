@@ -0,0 +1,92 @@
+import json
+import re
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from prompt_builder import split_bulk_response
+
+ANALYSIS = {"insights": ["Glucose is high"], "metrics": [], "recommendations": ["Recheck glucose"],
+            "trends": {"description": "Stable", "concerns": []}}
+
+
+class StubResponse:
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+
+    def json(self):
+        return {"content": [{"text": self.text}], "usage": {}, "stop_reason": "end_turn"}
+
+
+def tagged(report_ids):
+    return "Here you go:\n" + "\n".join(f'<report id="{report_id}">{json.dumps(ANALYSIS)}</report>'
+                                       for report_id in report_ids)
+
+
+def make_reports(name, count):
+    # Unique per test, so that no analysis comes from the /analyze cache
+    return [{"baseMetrics": [{"name": name, "value": value}]} for value in range(count)]
+
+
+def analyze_bulk(server, reports):
+    response = TestClient(server.app).post("/analyze/bulk", json={"reports": reports})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return sorted((line for line in lines[:-1]), key=lambda line: line["index"]), lines[-1]
+
+
+def test_split_bulk_response():
+    text = 'Sure!\n<report id="1">\n{"a": 1}\n</report>\nnoise <report id="b2">{"b": 2}</report>\n<report id="3">{"c":'
+    assert split_bulk_response(text) == {"1": '{"a": 1}', "b2": '{"b": 2}'}
+
+
+@pytest.fixture
+def bulk(server, monkeypatch):
+    monkeypatch.setattr(server, "ANALYZE_BULK_REPORTS_PER_CALL", 3)
+    monkeypatch.setattr(server, "ANALYZE_BULK_MAX_ATTEMPTS", 2)
+    return server
+
+
+def test_only_failed_reports_are_retried(bulk, monkeypatch):
+    packs = []
+
+    async def post_message(payload, priority="background"):
+        report_ids = re.findall(r"### REPORT (\S+)", payload["messages"][0]["content"])
+        packs.append(len(report_ids))
+        # The first call skips its second report and cuts off the third
+        if len(packs) == 1:
+            return StubResponse(tagged(report_ids[:1]) + f'\n<report id="{report_ids[2]}">{{"insights": [')
+        return StubResponse(tagged(report_ids))
+
+    monkeypatch.setattr(bulk, "post_message", post_message)
+    lines, summary = analyze_bulk(bulk, make_reports("Retried", 3))
+    assert packs == [3, 2]
+    assert [(line["status"], line["attempts"]) for line in lines] == [("success", 1), ("success", 2), ("success", 2)]
+    assert all(line["analysis"]["insights"] == ["Glucose is high"] for line in lines)
+    assert summary["succeeded"] == 3 and summary["upstream_calls"] == 2
+
+
+def test_every_report_gets_a_line_when_upstream_fails(bulk, monkeypatch):
+    async def post_message(payload, priority="background"):
+        raise httpx.ConnectError("upstream unreachable")
+
+    monkeypatch.setattr(bulk, "post_message", post_message)
+    lines, summary = analyze_bulk(bulk, make_reports("Unreachable", 4))
+    assert [line["index"] for line in lines] == [0, 1, 2, 3]
+    assert all(line["status"] == "fallback" and line["attempts"] == 2 for line in lines)
+    assert summary["fallback"] == 4 and summary["upstream_calls"] == 4
+
+
+def test_an_unexpected_error_only_falls_back_its_own_pack(bulk, monkeypatch):
+    async def request_bulk_analysis(reports):
+        if any(report["baseMetrics"][0]["value"] == 4 for _, report in reports):
+            raise ValueError("unexpected")
+        return {report_id: ANALYSIS for report_id, _ in reports}
+
+    monkeypatch.setattr(bulk, "request_bulk_analysis", request_bulk_analysis)
+    lines, summary = analyze_bulk(bulk, make_reports("Broken pack", 6))
+    assert [line["status"] for line in lines] == ["success"] * 3 + ["fallback"] * 3
+    assert (summary["succeeded"], summary["fallback"]) == (3, 3)
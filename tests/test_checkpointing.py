@@ -0,0 +1,112 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("transformers")
+
+from checkpointing import (
+    OPTIMIZER_NAME, RNG_STATE_NAME, SCHEDULER_NAME, TEMP_MARKER, TRAINER_STATE_NAME, AsyncCheckpointCallback,
+    latest_checkpoint, list_checkpoints, prepare_checkpoint_dir, publish_directory, remove_incomplete_checkpoints
+)
+
+
+def make_checkpoints(directory, *names):
+    for name in names:
+        os.makedirs(os.path.join(directory, name))
+
+
+def test_checkpoints_are_listed_by_step(tmp_path):
+    make_checkpoints(str(tmp_path), "checkpoint-20", "checkpoint-3", f"checkpoint-40{TEMP_MARKER}ab", "logs")
+    assert [os.path.basename(p) for p in list_checkpoints(str(tmp_path))] == ["checkpoint-3", "checkpoint-20"]
+    assert latest_checkpoint(str(tmp_path)).endswith("checkpoint-20")
+    assert latest_checkpoint(str(tmp_path / "missing")) is None
+
+
+def test_incomplete_checkpoints_are_removed(tmp_path):
+    make_checkpoints(str(tmp_path), "checkpoint-3", f"checkpoint-5{TEMP_MARKER}ab")
+    remove_incomplete_checkpoints(str(tmp_path))
+    assert sorted(os.listdir(str(tmp_path))) == ["checkpoint-3"]
+
+
+def test_existing_checkpoints_need_resume_or_overwrite(tmp_path):
+    make_checkpoints(str(tmp_path), "checkpoint-3", "checkpoint-7")
+    with pytest.raises(ValueError, match="--resume"):
+        prepare_checkpoint_dir(str(tmp_path))
+    # Refusing must not have touched them
+    assert len(list_checkpoints(str(tmp_path))) == 2
+
+    assert prepare_checkpoint_dir(str(tmp_path), resume=True).endswith("checkpoint-7")
+    assert prepare_checkpoint_dir(str(tmp_path), overwrite=True) is None
+    assert list_checkpoints(str(tmp_path)) == []
+
+
+def test_fresh_directory_starts_from_scratch(tmp_path):
+    assert prepare_checkpoint_dir(str(tmp_path / "new")) is None
+    assert prepare_checkpoint_dir(str(tmp_path / "new"), resume=True) is None
+
+
+def test_publish_directory_replaces_target(tmp_path):
+    target = tmp_path / "model"
+    target.mkdir()
+    (target / "old.bin").write_text("old")
+    temp = tmp_path / f"model{TEMP_MARKER}x"
+    temp.mkdir()
+    (temp / "new.bin").write_text("new")
+    publish_directory(str(temp), str(target))
+    assert os.listdir(str(target)) == ["new.bin"]
+    assert sorted(os.listdir(str(tmp_path))) == ["model"]
+
+
+def train_tiny_model(tokenizer, checkpoint_dir, max_steps, resume_from=None):
+    """Train a one-layer BERT on a few sentences, checkpointing after every step"""
+    import torch
+    from transformers import BertConfig, BertForMaskedLM, DataCollatorForLanguageModeling, Trainer, TrainingArguments
+
+    from training_metrics import InstrumentedCollator
+
+    class Sentences(torch.utils.data.Dataset):
+        texts = ["glucose is high", "hdl is low", "cholesterol is normal", "glucose is normal"]
+
+        def __len__(self):
+            return len(self.texts)
+
+        def __getitem__(self, index):
+            return dict(tokenizer(self.texts[index]))
+
+    torch.manual_seed(0)
+    model = BertForMaskedLM(BertConfig(
+        vocab_size=len(tokenizer), hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+        intermediate_size=32, max_position_embeddings=16
+    ))
+    collator = InstrumentedCollator(DataCollatorForLanguageModeling(tokenizer, mlm_probability=0.3),
+                                    pad_token_id=tokenizer.pad_token_id)
+    callback = AsyncCheckpointCallback(checkpoint_dir, tokens=1, keep=2, collator=collator, evaluate=False)
+    trainer = Trainer(
+        model=model,
+        args=TrainingArguments(output_dir=checkpoint_dir, max_steps=max_steps, per_device_train_batch_size=2,
+                               save_strategy="no", report_to="none", use_cpu=True, seed=0),
+        train_dataset=Sentences(),
+        data_collator=collator,
+        callbacks=[callback]
+    )
+    trainer.train(resume_from_checkpoint=resume_from)
+    return trainer, callback
+
+
+def test_background_checkpoints_resume_training(tmp_path, bert_tokenizer):
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    _, callback = train_tiny_model(bert_tokenizer, checkpoint_dir, max_steps=3)
+
+    # One checkpoint per step, the oldest deleted, nothing left half-written
+    assert callback.stats()["written"] == 3 and callback.stats()["failed"] == 0
+    assert sorted(os.listdir(checkpoint_dir)) == ["checkpoint-2", "checkpoint-3"]
+    latest = latest_checkpoint(checkpoint_dir)
+    for name in (OPTIMIZER_NAME, SCHEDULER_NAME, RNG_STATE_NAME, TRAINER_STATE_NAME, "model.safetensors"):
+        assert os.path.isfile(os.path.join(latest, name))
+    with open(os.path.join(latest, TRAINER_STATE_NAME)) as f:
+        assert json.load(f)["global_step"] == 3
+
+    trainer, _ = train_tiny_model(bert_tokenizer, checkpoint_dir, max_steps=5, resume_from=latest)
+    assert trainer.state.global_step == 5
+    assert latest_checkpoint(checkpoint_dir).endswith("checkpoint-5")
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from corpus_ingest import find_corpus_files, generate_texts, iter_json_records, record_text
+
+RECORDS = [{"input": "Glucose 126 mg/dL"}, "plain text", 12.5, True, None, [1, 2], {"text": "é ünïcode"}, -3e2]
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1024])
+def test_arrays_and_json_lines_give_the_same_records(tmp_path, chunk_size):
+    array = write(tmp_path / "corpus.json", "﻿[\n  " + ",\n  ".join(json.dumps(r, ensure_ascii=False) for r in RECORDS) + "\n]\n")
+    lines = write(tmp_path / "corpus.jsonl", "\n".join(json.dumps(r) for r in RECORDS) + "\n\n")
+    assert list(iter_json_records(array, chunk_size=chunk_size)) == RECORDS
+    assert list(iter_json_records(lines, chunk_size=chunk_size)) == RECORDS
+
+
+def test_single_value_and_empty_files(tmp_path):
+    assert list(iter_json_records(write(tmp_path / "one.json", '{"content": "page"}'), chunk_size=4)) == [{"content": "page"}]
+    assert list(iter_json_records(write(tmp_path / "empty.json", "  \n"))) == []
+    assert list(iter_json_records(write(tmp_path / "empty_array.json", "[ ]"))) == []
+    # Numbers split across reads are not cut short
+    assert list(iter_json_records(write(tmp_path / "numbers.jsonl", "12345\n678"), chunk_size=2)) == [12345, 678]
+
+
+@pytest.mark.parametrize("text, valid", [
+    ('[{"input": "a"}, {"input": ', [{"input": "a"}]),
+    ('{"input": "a"}\n{"input": }', [{"input": "a"}]),
+    ("[1, 2", [1, 2]),
+])
+def test_malformed_files_raise_after_the_valid_records(tmp_path, text, valid):
+    records = []
+    with pytest.raises(ValueError):
+        for record in iter_json_records(write(tmp_path / "bad.json", text), chunk_size=3):
+            records.append(record)
+    assert records == valid
+
+
+def test_record_text_accepts_every_schema():
+    assert record_text({"input": "a", "content": "b"}) == "a"
+    assert record_text({"content": "page", "text": "t"}) == "page"
+    assert record_text({"text": "t"}) == "t"
+    assert record_text("plain") == "plain"
+    assert record_text({"input": 3, "text": "t"}) == "t"
+    assert record_text({"input": "   "}) is None
+    assert record_text(42) is None
+
+
+def test_generated_texts_skip_the_rest_of_a_malformed_file(tmp_path):
+    good = write(tmp_path / "a.jsonl", '{"input": "one"}\n{"other": 1}\n"two"\n')
+    bad = write(tmp_path / "b.json", '[{"text": "three"}, {"text": ')
+    write(tmp_path / "notes.txt", "ignored")
+    files = find_corpus_files(str(tmp_path))
+    assert files == [good, bad]
+    assert [example["text"] for example in generate_texts([(path, 0, 0.0) for path in files])] == ["one", "two", "three"]
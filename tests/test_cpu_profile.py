@@ -0,0 +1,53 @@
+import argparse
+import json
+import os
+
+import pytest
+
+pytest.importorskip("transformers")
+
+from cpu_profile import add_cpu_profile_args, apply_cpu_profile, read_cpu_baseline
+from training_metrics import METRICS_JSON
+
+
+def parse(*argv):
+    parser = argparse.ArgumentParser()
+    add_cpu_profile_args(parser)
+    return parser.parse_args(list(argv))
+
+
+def write_report(directory, profile="default"):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, METRICS_JSON), "w") as f:
+        json.dump({"config": {"profile": profile}, "summary": {"samples_per_second": 10.0}}, f)
+
+
+def test_baseline_is_read_from_output_dir(tmp_path):
+    write_report(str(tmp_path))
+    assert read_cpu_baseline(parse("--cpu-optimized"), str(tmp_path)) == {"samples_per_second": 10.0}
+
+
+def test_baseline_survives_clearing_output_dir_after_reading(tmp_path):
+    # The scripts read the baseline first and clear output_dir afterwards
+    write_report(str(tmp_path))
+    baseline = read_cpu_baseline(parse("--cpu-optimized"), str(tmp_path))
+    os.remove(os.path.join(str(tmp_path), METRICS_JSON))
+    assert baseline is not None
+
+
+def test_explicit_baseline_and_profile_checks(tmp_path):
+    write_report(str(tmp_path / "base"))
+    write_report(str(tmp_path / "optimized"), profile="cpu-optimized")
+    args = parse("--cpu-optimized", "--baseline_metrics", str(tmp_path / "base" / METRICS_JSON))
+    assert read_cpu_baseline(args, str(tmp_path / "optimized")) is not None
+    # A report of another profile is no baseline, and default runs compare against nothing
+    assert read_cpu_baseline(parse("--cpu-optimized"), str(tmp_path / "optimized")) is None
+    assert read_cpu_baseline(parse(), str(tmp_path / "base")) is None
+    assert read_cpu_baseline(None, str(tmp_path / "base")) is None
+
+
+def test_default_profile_only_passes_torch_compile():
+    training_args = {"per_device_train_batch_size": 8}
+    assert apply_cpu_profile(parse("--torch_compile"), training_args) == {"profile": "default", "cpu": None}
+    assert training_args == {"per_device_train_batch_size": 8, "torch_compile": True}
+    assert apply_cpu_profile(None, {"per_device_train_batch_size": 8}) == {"profile": "default", "cpu": None}
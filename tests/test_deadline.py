@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+import deadline as deadline_module
+from deadline import (
+    ClientDisconnected, Deadline, DeadlineExceeded, request_deadline, run_until_disconnect, run_within
+)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def make_request(receive=None, **headers):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/analyze",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    }
+    return Request(scope, receive) if receive else Request(scope)
+
+
+def test_stage_finishing_in_time_returns_its_result():
+    async def stage():
+        await asyncio.sleep(0.001)
+        return "done"
+
+    assert run(Deadline(1).run(stage())) == "done"
+    assert run(run_within(None, stage())) == "done"
+
+
+def test_stage_is_cancelled_at_the_deadline():
+    cancelled = []
+
+    async def stage():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    with pytest.raises(DeadlineExceeded):
+        run(run_within(Deadline(0.01), stage()))
+    assert cancelled == [True]
+
+
+def test_expired_deadline_does_not_start_the_stage():
+    started = []
+
+    async def stage():
+        started.append(True)
+
+    deadline = Deadline(0)
+    assert deadline.expired and deadline.remaining() == 0
+    with pytest.raises(DeadlineExceeded):
+        run(deadline.run(stage()))
+    assert started == []
+
+
+def test_clients_choose_their_deadline_within_bounds(monkeypatch):
+    monkeypatch.setattr(deadline_module, "REQUEST_DEADLINE_SECONDS", 60.0)
+    monkeypatch.setattr(deadline_module, "REQUEST_MAX_DEADLINE_SECONDS", 300.0)
+    assert request_deadline(make_request()).seconds == 60
+    assert request_deadline(make_request(x_request_timeout="2.5")).seconds == 2.5
+    assert request_deadline(make_request(x_request_timeout="9999")).seconds == 300
+    assert request_deadline(make_request(x_request_timeout="-1")).seconds == 0
+    assert request_deadline(make_request(x_request_timeout="soon")).seconds == 60
+
+
+def test_work_is_cancelled_when_the_client_disconnects():
+    cleaned_up = []
+
+    async def work():
+        try:
+            await asyncio.sleep(1)
+        finally:
+            cleaned_up.append(True)
+
+    async def main():
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        task = asyncio.create_task(run_until_disconnect(make_request(receive), work()))
+        await asyncio.sleep(0.01)
+        disconnected.set()
+        with pytest.raises(ClientDisconnected):
+            await task
+
+    run(main())
+    assert cleaned_up == [True]
+
+
+def test_result_is_returned_while_the_client_is_connected():
+    async def receive():
+        await asyncio.sleep(1)
+        return {"type": "http.disconnect"}
+
+    async def work():
+        return {"summary": "ok"}
+
+    assert run(run_until_disconnect(make_request(receive), work())) == {"summary": "ok"}
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from job_queue import DEAD, QUEUED, RUNNING, SUCCEEDED, JobQueue
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def make_queue(tmp_path, **options):
+    options = {"workers": 1, "retry_backoff_seconds": 0.01, "poll_interval_seconds": 0.01, **options}
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), **options)
+
+
+async def echo(payload):
+    return {"echo": payload["value"]}
+
+
+def test_jobs_run_and_can_be_awaited(tmp_path):
+    async def main():
+        queue = make_queue(tmp_path)
+        queue.register("echo", echo)
+        await queue.start()
+        try:
+            job_id = queue.submit("echo", {"value": 42})
+            return await queue.wait(job_id, timeout=5)
+        finally:
+            await queue.stop()
+
+    job = run(main())
+    assert (job["status"], job["result"], job["attempts"]) == (SUCCEEDED, {"echo": 42}, 1)
+
+
+def test_unknown_kinds_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make_queue(tmp_path).submit("missing", {})
+
+
+def test_failing_jobs_are_retried_then_dead_lettered(tmp_path):
+    attempts = []
+
+    async def flaky(payload):
+        attempts.append(1)
+        if len(attempts) < payload["succeed_on"]:
+            raise RuntimeError(f"attempt {len(attempts)} failed")
+        return "ok"
+
+    async def main(succeed_on):
+        queue = make_queue(tmp_path, max_attempts=3)
+        queue.register("flaky", flaky)
+        await queue.start()
+        try:
+            return await queue.wait(queue.submit("flaky", {"succeed_on": succeed_on}), timeout=5)
+        finally:
+            await queue.stop()
+
+    job = run(main(succeed_on=3))
+    assert (job["status"], job["attempts"], job["result"]) == (SUCCEEDED, 3, "ok")
+    attempts.clear()
+    job = run(main(succeed_on=10))
+    assert (job["status"], job["attempts"], job["error"]) == (DEAD, 3, "attempt 3 failed")
+
+
+def test_jobs_of_a_dead_process_are_taken_over(tmp_path):
+    dead = make_queue(tmp_path, lease_seconds=0.01, max_attempts=2)
+    dead.register("echo", echo)
+    retried = dead.submit("echo", {"value": 1})
+    last_attempt = dead.submit("echo", {"value": 2})
+    # The first process claims both jobs, then dies without renewing its leases
+    dead._claim_next()
+    dead._claim_next()
+    dead._db.execute("UPDATE jobs SET attempts = 2 WHERE id = ?", (last_attempt,))
+    dead._db.commit()
+
+    live = make_queue(tmp_path, lease_seconds=60, max_attempts=2)
+    assert live.get(retried)["status"] == RUNNING
+    run(asyncio.sleep(0.02))
+    live._maintain()
+    assert live.get(retried)["status"] == QUEUED
+    assert (live.get(last_attempt)["status"], live.get(last_attempt)["error"]) == (DEAD, "Interrupted on its last attempt")
+
+    # The dead process must not overwrite the result of a job it lost
+    dead._finish(retried, SUCCEEDED, result="stale")
+    assert live.get(retried)["result"] is None
+
+
+def test_live_leases_are_renewed(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("job_queue.time.time", lambda: now[0])
+    queue = make_queue(tmp_path, lease_seconds=60)
+    queue.register("echo", echo)
+    job_id = queue.submit("echo", {"value": 1})
+    queue._claim_next()
+    now[0] += 40
+    queue._maintain()
+    now[0] += 40
+    # Past the original lease, but not the renewed one
+    make_queue(tmp_path)._maintain()
+    assert queue.get(job_id)["status"] == RUNNING
+    now[0] += 60
+    make_queue(tmp_path)._maintain()
+    assert queue.get(job_id)["status"] == QUEUED
+
+
+def test_stopping_requeues_running_jobs_without_using_an_attempt(tmp_path):
+    async def main():
+        queue = make_queue(tmp_path)
+        running = asyncio.Event()
+
+        async def slow(payload):
+            running.set()
+            await asyncio.sleep(10)
+
+        queue.register("slow", slow)
+        await queue.start()
+        job_id = queue.submit("slow", {})
+        await running.wait()
+        await queue.stop()
+        return queue.get(job_id)
+
+    job = run(main())
+    assert (job["status"], job["attempts"]) == (QUEUED, 0)
+
+
+def test_finished_jobs_are_purged_after_retention(tmp_path):
+    queue = make_queue(tmp_path, retention_seconds=0)
+    queue.register("echo", echo)
+    job_id = queue.submit("echo", {"value": 1})
+    queue._claim_next()
+    queue._finish(job_id, SUCCEEDED, result="ok")
+    run(asyncio.sleep(0.01))
+    queue._maintain()
+    assert queue.get(job_id) is None
@@ -0,0 +1,50 @@
+from json_stream import StreamingJSONParser
+
+OUTPUT = 'Here is the analysis:\n{"summary": "Mostly normal", "metrics": [{"name": "Glucose", "value": 130}, ' \
+         '{"name": "HDL", "value": 42}], "insights": ["Check \\"glucose\\"", "Recheck in 3 months"], "score": 7}'
+
+
+def feed_in_chunks(parser, text, size):
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(parser.feed(text[start:start + size]))
+    return events
+
+
+def test_items_and_fields_are_emitted_as_they_complete():
+    for size in (1, 7, len(OUTPUT)):
+        parser = StreamingJSONParser()
+        events = feed_in_chunks(parser, OUTPUT, size)
+        assert events == [
+            ("field", "summary", "Mostly normal"),
+            ("item", "metrics", {"name": "Glucose", "value": 130}),
+            ("item", "metrics", {"name": "HDL", "value": 42}),
+            ("field", "metrics", [{"name": "Glucose", "value": 130}, {"name": "HDL", "value": 42}]),
+            ("item", "insights", 'Check "glucose"'),
+            ("item", "insights", "Recheck in 3 months"),
+            ("field", "insights", ['Check "glucose"', "Recheck in 3 months"]),
+            ("field", "score", 7),
+        ]
+        assert parser.result()["score"] == 7
+        assert not parser.recovered
+
+
+def test_prose_after_the_object_is_ignored():
+    parser = StreamingJSONParser()
+    parser.feed(OUTPUT + "\nLet me know if {you need more}.")
+    assert parser.json_text.startswith("{") and parser.json_text.endswith("}")
+    assert parser.result()["summary"] == "Mostly normal"
+
+
+def test_truncated_output_recovers_complete_fields_and_items():
+    parser = StreamingJSONParser()
+    parser.feed(OUTPUT[:OUTPUT.index('{"name": "HDL"') + 10])
+    result = parser.result()
+    assert parser.recovered
+    assert result == {"summary": "Mostly normal", "metrics": [{"name": "Glucose", "value": 130}]}
+
+
+def test_nothing_parseable_gives_none():
+    parser = StreamingJSONParser()
+    parser.feed("I cannot analyze this report.")
+    assert parser.result() is None
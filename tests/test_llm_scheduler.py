@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import LLMScheduler
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def hold(scheduler, priority, order, input_tokens=10, output_tokens=10, release=None):
+    async with scheduler.slot(priority, input_tokens, output_tokens):
+        order.append(priority)
+        if release is not None:
+            await release.wait()
+
+
+def fast_scheduler(**limits):
+    """A scheduler whose buckets refill within milliseconds"""
+    return LLMScheduler(requests_per_minute=6000, input_tokens_per_minute=600000, output_tokens_per_minute=600000,
+                        **limits)
+
+
+def test_more_urgent_classes_are_admitted_first():
+    async def main():
+        scheduler = fast_scheduler()
+        order = []
+        # Calls queue up while admission is paused
+        scheduler.pause(0.02)
+        waiting = [asyncio.create_task(hold(scheduler, priority, order))
+                   for priority in ("background", "analyze", "chat", "analyze")]
+        await asyncio.sleep(0)
+        assert scheduler.stats()["classes"]["analyze"]["queued"] == 2
+        await asyncio.gather(*waiting)
+        return order
+
+    assert run(main()) == ["chat", "analyze", "analyze", "background"]
+
+
+def test_waiting_calls_are_promoted_by_aging():
+    async def main():
+        scheduler = fast_scheduler(aging_seconds=0.01)
+        order = []
+        scheduler.pause(0.1)
+        background = asyncio.create_task(hold(scheduler, "background", order))
+        await asyncio.sleep(0.05)
+        chat = asyncio.create_task(hold(scheduler, "chat", order))
+        await asyncio.gather(background, chat)
+        return order
+
+    assert run(main()) == ["background", "chat"]
+
+
+def test_unknown_priority_is_rejected():
+    async def main():
+        async with LLMScheduler().slot("urgent", 1, 1):
+            pass
+
+    with pytest.raises(ValueError):
+        run(main())
+
+
+def test_usage_settles_the_reservation():
+    async def main():
+        scheduler = LLMScheduler(input_tokens_per_minute=1000, output_tokens_per_minute=1000)
+        async with scheduler.slot("chat", 300, 500) as grant:
+            grant.record_usage(input_tokens=200, output_tokens=100)
+        return scheduler.stats()["available"]
+
+    available = run(main())
+    assert (available["input_tokens"], available["output_tokens"]) == (800, 900)
+
+
+def test_failed_call_gives_back_its_output_reservation():
+    async def main():
+        scheduler = LLMScheduler(input_tokens_per_minute=1000, output_tokens_per_minute=1000)
+        with pytest.raises(ConnectionError):
+            async with scheduler.slot("chat", 300, 500):
+                raise ConnectionError("upstream unreachable")
+        return scheduler.stats()["available"]
+
+    available = run(main())
+    assert (available["input_tokens"], available["output_tokens"]) == (700, 1000)
+
+
+def test_call_cancelled_after_admission_gives_back_everything():
+    async def main():
+        scheduler = LLMScheduler(requests_per_minute=10, input_tokens_per_minute=1000, output_tokens_per_minute=1000)
+        order = []
+        release = asyncio.Event()
+        first = asyncio.create_task(hold(scheduler, "chat", order, 600, 600, release))
+        await asyncio.sleep(0)
+        # Queued behind the first call's reservation
+        second = asyncio.create_task(hold(scheduler, "chat", order, 600, 600))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["classes"]["chat"]["queued"] == 1
+
+        # Admit the second call, then cancel it before it gets to run
+        scheduler.input_bucket.give_back(200)
+        scheduler.output_bucket.give_back(200)
+        scheduler._dispatch()
+        second.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        available = scheduler.stats()["available"]
+        release.set()
+        await first
+        return order, available
+
+    order, available = run(main())
+    assert order == ["chat"]
+    # The second call's reservation is back, so just enough for another such call
+    assert (available["requests"], available["input_tokens"], available["output_tokens"]) == (9, 600, 600)
+
+
+def test_throttling_pauses_every_class():
+    async def main():
+        scheduler = fast_scheduler()
+        async with scheduler.slot("chat", 1, 1) as grant:
+            grant.throttled(0.05)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        async with scheduler.slot("chat", 1, 1):
+            return loop.time() - start, scheduler.throttled
+
+    waited, throttled = run(main())
+    assert waited >= 0.04 and throttled == 1
@@ -0,0 +1,72 @@
+import pytest
+
+from mlm_batching import PackedMLMCollator, pack_examples, padded_tokens
+
+
+def test_padding_is_counted_per_batch():
+    assert padded_tokens([3, 5, 2, 2], [[0, 1], [2, 3], []]) == 10 + 4
+
+
+def test_reports_are_packed_whole_and_in_order():
+    examples = {"input_ids": [[2, 5, 3], [2, 6, 7, 3], [2, 8, 3], [2, 9, 10, 11, 5, 6, 3]]}
+    blocks = pack_examples(examples, block_size=7, isolate_documents=True)
+    assert blocks["input_ids"] == [[2, 5, 3, 2, 6, 7, 3], [2, 8, 3], [2, 9, 10, 11, 5, 6, 3]]
+    assert blocks["token_type_ids"] == [[0] * 7, [0] * 3, [0] * 7]
+    assert blocks["document_ids"] == [[0, 0, 0, 1, 1, 1, 1], [0, 0, 0], [0] * 7]
+
+
+def test_long_reports_are_truncated_to_the_block():
+    blocks = pack_examples({"input_ids": [[2, 5, 6, 7, 8, 3], [2, 9, 3]]}, block_size=4)
+    assert blocks["input_ids"] == [[2, 5, 6, 7], [2, 9, 3]]
+    assert "document_ids" not in blocks
+
+
+def collate(tokenizer, isolate_documents):
+    blocks = pack_examples(
+        {"input_ids": [tokenizer(text)["input_ids"] for text in ("glucose is high", "hdl is low", "cholesterol")]},
+        block_size=10, isolate_documents=isolate_documents
+    )
+    features = [{key: blocks[key][row] for key in blocks} for row in range(len(blocks["input_ids"]))]
+    collator = PackedMLMCollator(tokenizer, mlm_probability=0.0, isolate_documents=isolate_documents)
+    return blocks, collator(features)
+
+
+def test_packed_blocks_attend_within_each_report(bert_tokenizer):
+    import torch
+
+    blocks, batch = collate(bert_tokenizer, isolate_documents=True)
+    # "[CLS] glucose is high [SEP] [CLS] hdl is low [SEP]" and "[CLS] cholesterol [SEP]" + padding
+    assert [len(ids) for ids in blocks["input_ids"]] == [10, 3]
+    mask = batch["attention_mask"]
+    assert mask.shape == (2, 10, 10)
+    first = torch.zeros(10, 10, dtype=torch.long)
+    first[:5, :5] = 1
+    first[5:, 5:] = 1
+    assert torch.equal(mask[0], first)
+    second = torch.zeros(10, 10, dtype=torch.long)
+    second[:3, :3] = 1
+    assert torch.equal(mask[1], second)
+    # Positions restart at each report; those of padding do not matter
+    assert batch["position_ids"][0].tolist() == [0, 1, 2, 3, 4, 0, 1, 2, 3, 4]
+    assert batch["position_ids"][1, :3].tolist() == [0, 1, 2]
+    assert "document_ids" not in batch
+    # Nothing masked with mlm_probability=0
+    assert (batch["labels"] == -100).all()
+
+
+def test_without_isolation_the_usual_mask_is_kept(bert_tokenizer):
+    _, batch = collate(bert_tokenizer, isolate_documents=False)
+    assert batch["attention_mask"].tolist() == [[1] * 10, [1] * 3 + [0] * 7]
+    assert "position_ids" not in batch
+
+
+def test_padding_report_compares_the_batching_schemes():
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from mlm_batching import padding_report
+
+    # Equal lengths, so that the shuffles cannot change the counts
+    report = padding_report([5] * 12, batch_size=4, max_length=16)
+    assert (report["examples"], report["real_tokens"]) == (12, 60)
+    assert report["static"] == {"tokens": 192, "real_fraction": 0.3125}
+    assert report["dynamic"] == report["grouped"] == {"tokens": 60, "real_fraction": 1.0}
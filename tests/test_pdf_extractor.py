@@ -0,0 +1,19 @@
+from pdf_extractor import annotate_llm_metrics
+
+
+def test_llm_metrics_get_status_and_reference_range():
+    metrics = annotate_llm_metrics([{"name": "Glucose", "value": "130", "unit": "mg/dL", "source": "p1 l3"}])
+    assert metrics == [{"name": "Glucose", "value": 130.0, "unit": "mg/dL", "status": "attention",
+                        "referenceRange": "70-99 mg/dL", "source": "p1 l3"}]
+
+
+def test_llm_metrics_without_a_numeric_value_are_skipped():
+    metrics = annotate_llm_metrics([
+        {"name": "CRP", "value": "<0.1", "unit": "mg/L"},
+        {"name": "HbA1c", "value": "N/A"},
+        {"name": "TSH", "value": None},
+        {"name": "Ferritin", "value": "nan"},
+        {"name": None, "value": 4.2},
+        "Glucose 130",
+    ])
+    assert [(m["name"], m["value"]) for m in metrics] == [(None, 4.2)]
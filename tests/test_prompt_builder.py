@@ -0,0 +1,82 @@
+from prompt_builder import (
+    ANALYSIS_INSTRUCTIONS, build_analysis_prompt, build_bulk_analysis_prompt, compact_report, format_report,
+    score_line, select_candidate_lines
+)
+
+REPORT = {
+    "reportType": "Blood panel",
+    "rawText": "Patient: Jane Doe ...",
+    "baseMetrics": [
+        {"name": "Glucose", "value": 130, "unit": "mg/dL", "status": "attention", "description": "Blood sugar"},
+        {"name": "HDL", "value": 55, "unit": "mg/dL", "status": "normal", "referenceRange": ">40"},
+    ],
+}
+
+
+def test_compact_report_keeps_only_model_fields():
+    assert compact_report(REPORT) == {
+        "reportType": "Blood panel",
+        "metrics": [
+            {"name": "Glucose", "value": 130, "unit": "mg/dL", "status": "attention"},
+            {"name": "HDL", "value": 55, "unit": "mg/dL", "status": "normal", "referenceRange": ">40"},
+        ],
+    }
+
+
+def test_abnormal_metrics_are_kept_first_within_the_budget():
+    compact = compact_report({"baseMetrics": [{"name": f"Normal {i}", "value": i, "status": "normal"} for i in range(20)]
+                              + [{"name": "Glucose", "value": 130, "status": "attention"}]})
+    text, omitted = format_report(compact, token_budget=40)
+    assert "- Glucose: 130 | attention" in text
+    assert omitted > 0
+    assert text.endswith(f"({omitted} further metrics omitted for length)")
+
+
+def test_analysis_prompt_sends_the_instructions_as_system_prompt():
+    prompt = build_analysis_prompt(REPORT)
+    assert prompt["system"] == [{"type": "text", "text": ANALYSIS_INSTRUCTIONS}]
+    content = prompt["messages"][0]["content"]
+    assert "- Glucose: 130 mg/dL | attention" in content
+    assert "Jane Doe" not in content and "Blood sugar" not in content
+    assert prompt["omitted_metrics"] == 0
+
+
+def test_bulk_prompt_tags_each_report():
+    prompt = build_bulk_analysis_prompt([("a", REPORT), ("b", {"baseMetrics": []})])
+    content = prompt["messages"][0]["content"]
+    assert content.index("### REPORT a") < content.index("### REPORT b")
+    assert len(prompt["system"]) == 2
+
+
+PAGE = """City Lab, 555-123-4567
+Collected 03/14/2024 08:30
+Glucose 126 mg/dL 70-99
+The patient reports feeling well today and slept 8 hours.
+Hemoglobin
+13.5 g/dL
+Total Cholesterol: 210 mg/dL"""
+
+
+def test_result_lines_score_above_narrative_and_noise():
+    assert score_line("Glucose 126 mg/dL 70-99") > score_line("The patient reports feeling well today and slept 8 hours.")
+    assert score_line("Collected 03/14/2024 08:30") == 0
+    assert score_line("Page 2 of 2") == 0
+
+
+def test_candidate_lines_keep_their_provenance():
+    selected, kept, dropped = select_candidate_lines([(1, PAGE), (2, "HDL 42 mg/dL\nPage 2 of 2")], token_budget=1000)
+    assert selected.splitlines() == [
+        "p1 l3 | Glucose 126 mg/dL 70-99",
+        # A label line travels with the value below it
+        "p1 l5 | Hemoglobin",
+        "p1 l6 | 13.5 g/dL",
+        "p1 l7 | Total Cholesterol: 210 mg/dL",
+        "p2 l1 | HDL 42 mg/dL",
+    ]
+    assert (kept, dropped) == (4, 0)
+
+
+def test_best_candidates_are_kept_within_the_budget():
+    selected, kept, dropped = select_candidate_lines([(None, PAGE)], token_budget=12)
+    assert selected == "l3 | Glucose 126 mg/dL 70-99"
+    assert (kept, dropped) == (1, 2)
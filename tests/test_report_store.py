@@ -0,0 +1,69 @@
+import gzip
+import json
+import time
+
+from starlette.requests import Request
+
+from report_store import ReportStore
+
+BODY = json.dumps({"analysis": {"summary": "Normal " * 400}}).encode()
+
+
+def make_request(method="GET", **headers):
+    return Request({
+        "type": "http",
+        "method": method,
+        "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_content_ids_depend_on_the_secret():
+    first = ReportStore(secret=b"one").put(BODY)
+    assert ReportStore(secret=b"one").put(BODY) == first
+    assert ReportStore(secret=b"two").put(BODY) != first
+
+
+def test_if_none_match_gives_304():
+    store = ReportStore()
+    content_id = store.put(BODY)
+    response = store.response(make_request(), content_id)
+    assert response.status_code == 200 and response.body == BODY
+    assert response.headers["etag"] == f'"{content_id}"'
+
+    response = store.response(make_request(if_none_match=response.headers["etag"]), content_id)
+    assert response.status_code == 304 and response.body == b""
+    assert store.stats()["not_modified"] == 1
+
+
+def test_large_results_are_sent_gzip_compressed():
+    store = ReportStore(compress_min_bytes=1024)
+    content_id = store.put(BODY)
+    response = store.response(make_request(accept_encoding="gzip"), content_id)
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == f'"{content_id}-gzip"'
+    assert gzip.decompress(response.body) == BODY
+    # Any coding of the content matches
+    assert store.response(make_request(if_none_match=f'"{content_id}"', accept_encoding="gzip"), content_id).status_code == 304
+
+    small_id = store.put(b'{"analysis": {}}')
+    assert "content-encoding" not in store.response(make_request(accept_encoding="gzip"), small_id).headers
+
+
+def test_results_expire(monkeypatch):
+    store = ReportStore(max_age_seconds=60)
+    content_id = store.put(BODY)
+    now = time.time()
+    monkeypatch.setattr("report_store.time.time", lambda: now + 61)
+    assert store.response(make_request(), content_id) is None
+    store.put(b"{}")
+    assert store.stats()["expired"] == 1
+
+
+def test_least_recently_used_results_are_evicted():
+    store = ReportStore(max_entries=2)
+    first, second = store.put(b'{"a": 1}'), store.put(b'{"b": 2}')
+    store.response(make_request(), first)
+    store.put(b'{"c": 3}')
+    assert store.response(make_request(), second) is None
+    assert store.response(make_request(), first) is not None
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import pytest
+
+from response_cache import ResponseCache
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_keys_ignore_dict_order_but_not_namespace():
+    cache = ResponseCache(namespace="haiku")
+    assert cache.make_key({"a": 1, "b": [1, 2]}) == cache.make_key({"b": [1, 2], "a": 1})
+    assert cache.make_key({"a": 1}) != ResponseCache(namespace="sonnet").make_key({"a": 1})
+
+
+def test_concurrent_lookups_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"summary": "ok"}
+
+    async def main():
+        cache = ResponseCache()
+        results = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+        again = await cache.get_or_compute("k", compute)
+        return cache, results, again
+
+    cache, results, again = run(main())
+    assert len(calls) == 1
+    assert results == [{"summary": "ok"}] * 5 and again == {"summary": "ok"}
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"], stats["inflight"]) == (1, 4, 1, 0)
+
+
+def test_rejected_and_none_results_are_not_cached():
+    async def main():
+        cache = ResponseCache()
+        values = iter([None, {"partial": True}, {"partial": False}])
+
+        async def compute():
+            return next(values)
+
+        def complete(value):
+            return not value["partial"]
+
+        results = [await cache.get_or_compute("k", compute, cacheable=complete) for _ in range(3)]
+        return results, cache.get("k")
+
+    results, cached = run(main())
+    assert results == [None, {"partial": True}, {"partial": False}]
+    assert cached == {"partial": False}
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    async def main():
+        cache = ResponseCache()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream failed")
+
+        results = await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(3)),
+                                       return_exceptions=True)
+        return results, cache.stats()["inflight"]
+
+    results, inflight = run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert inflight == 0
+
+
+def test_computation_survives_one_waiter_leaving_and_stops_when_all_have():
+    async def main():
+        cache = ResponseCache()
+        started = asyncio.Event()
+        finished = []
+
+        async def compute():
+            started.set()
+            await asyncio.sleep(0.05)
+            finished.append(1)
+            return "value"
+
+        first = asyncio.create_task(cache.get_or_compute("shared", compute))
+        second = asyncio.create_task(cache.get_or_compute("shared", compute))
+        await started.wait()
+        first.cancel()
+        assert await second == "value"
+
+        lonely = asyncio.create_task(cache.get_or_compute("alone", compute))
+        await asyncio.sleep(0.01)
+        lonely.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await lonely
+        await asyncio.sleep(0.06)
+        return finished, cache
+
+    finished, cache = run(main())
+    assert len(finished) == 1
+    assert cache.stats()["abandoned"] == 1 and cache.get("alone") is None
+
+
+def test_lru_eviction_and_expiry(monkeypatch):
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+    now = time.time()
+    monkeypatch.setattr("response_cache.time.time", lambda: now + 61)
+    assert cache.get("a") is None
+
+
+def test_persistent_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ResponseCache(persist_path=path).set("k", {"summary": "ok"}, cost_seconds=2.0)
+    cache = ResponseCache(persist_path=path)
+    assert cache.get("k") == {"summary": "ok"}
+    assert cache.stats()["persistent_hits"] == 1
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from training_metrics import InstrumentedCollator, TrainingMetricsCallback, compare_to_baseline
+
+
+def fake_collator(features):
+    length = max(len(feature) for feature in features)
+    input_ids = torch.tensor([feature + [0] * (length - len(feature)) for feature in features])
+    return {"input_ids": input_ids, "attention_mask": (input_ids != 0).long()}
+
+
+def test_real_tokens_come_from_the_attention_mask():
+    collator = InstrumentedCollator(fake_collator)
+    collator([[5, 6, 7], [5]])
+    collator([[5, 6]])
+    assert (collator.samples, collator.tokens, collator.padded_tokens) == (3, 6, 8)
+    assert collator.seconds > 0
+
+
+def test_three_dimensional_masks_count_tokens_by_pad_id():
+    def packed_collator(features):
+        batch = fake_collator(features)
+        mask = batch["attention_mask"]
+        batch["attention_mask"] = mask[:, :, None] * mask[:, None, :]
+        return batch
+
+    collator = InstrumentedCollator(packed_collator, pad_token_id=0)
+    collator([[5, 6, 7, 8], [5, 6]])
+    assert (collator.tokens, collator.padded_tokens) == (6, 8)
+
+
+def test_rewind_forgets_evaluation_batches():
+    collator = InstrumentedCollator(fake_collator)
+    collator([[5, 6]])
+    snapshot = collator.snapshot()
+    collator([[5, 6, 7]])
+    collator.rewind(snapshot)
+    assert (collator.samples, collator.tokens) == (1, 2)
+
+
+def test_rows_count_only_training_batches():
+    collator = InstrumentedCollator(fake_collator)
+    callback = TrainingMetricsCallback(collator)
+    args = SimpleNamespace(per_device_train_batch_size=2, gradient_accumulation_steps=1)
+    control = SimpleNamespace()
+
+    callback.on_train_begin(args, None, control)
+    for step in range(1, 3):
+        collator([[5, 6, 7], [5, 6]])
+        callback.on_step_begin(args, None, control)
+        callback.on_step_end(args, None, control)
+    # Evaluation batches collated after the step are not training throughput
+    collator([[5] * 50])
+    callback.on_evaluate(args, None, control)
+    state = SimpleNamespace(global_step=2, epoch=0.5)
+    callback.on_log(args, state, control, logs={"loss": 1.5})
+    callback.on_train_end(args, state, control)
+
+    row = callback.rows[0]
+    assert (row["step"], row["samples"], row["tokens"], row["loss"]) == (2, 4, 10, 1.5)
+    assert row["real_token_fraction"] == round(10 / 12, 4)
+    assert callback.summary["samples"] == 4 and callback.summary["steps"] == 2
+    assert 0 <= callback.summary["dataloader_fraction"] <= 1
+
+
+def test_speedup_against_a_baseline():
+    run = {"samples_per_second": 30.0, "tokens_per_second": 300.0, "wall_seconds": 50.0, "peak_rss_mb": 900.0}
+    baseline = {"samples_per_second": 10.0, "tokens_per_second": 150.0, "wall_seconds": 100.0, "peak_rss_mb": 600.0}
+    speedup = compare_to_baseline(run, baseline)
+    assert (speedup["samples_per_second"], speedup["tokens_per_second"]) == (3.0, 2.0)
+    assert (speedup["wall_time"], speedup["peak_rss"]) == (2.0, 1.5)
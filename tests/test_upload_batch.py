@@ -0,0 +1,36 @@
+import io
+import json
+import zipfile
+
+from fastapi.testclient import TestClient
+
+from benchmark_event_loop import make_sample_pdf
+
+
+def post_batch(server, files):
+    response = TestClient(server.app).post("/upload-pdf/batch", files=files)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_oversized_files_are_rejected_individually(server, monkeypatch):
+    pdf = make_sample_pdf(num_pages=2, lines_per_page=3)
+    monkeypatch.setattr(server, "PDF_BATCH_MAX_FILE_BYTES", len(pdf) + 10)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("small.pdf", pdf)
+        zf.writestr("big.pdf", pdf + b" " * 100)
+
+    results = post_batch(server, [
+        ("files", ("big.pdf", pdf + b" " * 100, "application/pdf")),
+        ("files", ("small.pdf", pdf, "application/pdf")),
+        ("files", ("reports.zip", archive.getvalue(), "application/zip")),
+    ])
+    by_name = {}
+    for result in results[:-1]:
+        by_name.setdefault(result["name"], []).append(result)
+    assert "big.pdf is larger than" in by_name["big.pdf"][0]["error"]
+    # An oversized member stops the rest of its archive
+    assert "big.pdf is larger than" in by_name["reports.zip"][0]["error"]
+    assert all("error" not in result for result in by_name["small.pdf"])
+    assert results[-1] == {"type": "summary", "files": 4, "succeeded": 2, "failed": 2}
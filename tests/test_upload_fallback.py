@@ -0,0 +1,59 @@
+import asyncio
+
+import httpx
+import pytest
+
+from benchmark_event_loop import make_sample_pdf
+
+# Mangled lab names, so that the regexes find no metrics and the Claude fallback is needed
+UNPARSEABLE = {b"Glucose": b"Gxxxose", b"Cholesterol": b"Chxxxxxxxxxl", b"HDL": b"HxL", b"LDL": b"LxL",
+               b"Hemoglobin": b"Hxxxxxxxxx", b"Creatinine": b"Crxxxxxxxx"}
+
+
+def unparseable_pdf(num_pages):
+    pdf = make_sample_pdf(num_pages=num_pages, lines_per_page=3)
+    for name, mangled in UNPARSEABLE.items():
+        pdf = pdf.replace(name, mangled)
+    return pdf
+
+
+def upload(server, pdf):
+    async def post():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/upload-pdf", files={"file": ("report.pdf", pdf, "application/pdf")})
+    return asyncio.run(post())
+
+
+@pytest.fixture
+def hedged(server, monkeypatch):
+    monkeypatch.setattr(server, "UPLOAD_HEDGED_FALLBACK", True)
+    monkeypatch.setattr(server, "PDF_PARALLEL_MIN_PAGES", 2)
+    return server
+
+
+def test_one_fallback_call_covers_all_page_ranges(hedged, monkeypatch):
+    payloads = []
+
+    async def stream_message_text(payload, priority="background", message=None):
+        payloads.append(payload)
+        yield '{"metrics": [{"name": "Glucose", "value": 130, "unit": "mg/dL"}]}'
+
+    monkeypatch.setattr(hedged, "stream_message_text", stream_message_text)
+    response = upload(hedged, unparseable_pdf(num_pages=8))
+    assert response.status_code == 200
+    assert [m["name"] for m in response.json()["extracted_data"]["metrics"]] == ["Glucose"]
+    assert len(payloads) == 1
+
+
+def test_failed_fallback_keeps_the_extracted_text(hedged, monkeypatch):
+    async def stream_message_text(payload, priority="background", message=None):
+        raise httpx.ConnectError("upstream down")
+        yield
+
+    monkeypatch.setattr(hedged, "stream_message_text", stream_message_text)
+    response = upload(hedged, unparseable_pdf(num_pages=8) + b" ")
+    assert response.status_code == 200
+    extracted = response.json()["extracted_data"]
+    assert extracted["metrics"] == []
+    assert "Gxxxose" in extracted["text"]
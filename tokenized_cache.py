@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from typing import Optional
+
+# Bump whenever the tokenization below changes in a way that changes its output,
+# so that datasets tokenized by older code are not reused
+PREPROCESSING_VERSION = 2
+
+# Where tokenized corpora are kept between runs
+DEFAULT_CACHE_DIR = os.environ.get("TOKENIZED_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "medical_mlm_tokenized"))
+
+# Rows hashed at a time when fingerprinting a corpus
+HASH_BATCH_SIZE = 10000
+
+
+def corpus_fingerprint(dataset, column: str = "text") -> str:
+    """
+    Hash the texts of a dataset, in order
+
+    Args:
+        dataset: A datasets Dataset
+        column: The text column
+
+    Returns:
+        A hex digest identifying the corpus content
+    """
+    digest = hashlib.sha256()
+    for batch in dataset.select_columns([column]).iter(batch_size=HASH_BATCH_SIZE):
+        for text in batch[column]:
+            digest.update(text.encode("utf-8"))
+            # Separator, so that moving text between rows changes the hash
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def tokenizer_id(tokenizer) -> str:
+    """
+    Identify a tokenizer by its source, class and vocabulary
+
+    Args:
+        tokenizer: A transformers tokenizer
+
+    Returns:
+        A string that changes when the tokenizer would tokenize differently
+    """
+    vocab = json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False)
+    return f"{tokenizer.name_or_path}:{type(tokenizer).__name__}:{hashlib.sha256(vocab.encode('utf-8')).hexdigest()[:16]}"
+
+
+def cache_key(corpus_hash: str, tokenizer, max_length: int, padding) -> str:
+    """
+    Build the cache key of a tokenized corpus
+
+    Args:
+        corpus_hash: From corpus_fingerprint
+        tokenizer: The tokenizer
+        max_length: Truncation length
+        padding: The padding strategy passed to the tokenizer
+
+    Returns:
+        A hex digest naming the cache entry
+    """
+    key = json.dumps({
+        "corpus": corpus_hash,
+        "tokenizer": tokenizer_id(tokenizer),
+        "max_length": max_length,
+        "padding": padding,
+        "preprocessing_version": PREPROCESSING_VERSION,
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def tokenize_corpus(dataset, tokenizer, max_length: int, num_proc: Optional[int] = None,
+                    cache_dir: Optional[str] = None, padding=False):
+    """
+    Tokenize a text dataset, reusing the result of an earlier run when possible
+
+    Tokenized datasets are saved as Arrow shards under cache_dir, keyed by
+    the corpus content, tokenizer, max_length, padding and
+    PREPROCESSING_VERSION, and loaded memory-mapped on later runs, so re-runs
+    and hyperparameter changes skip tokenization. On a cache miss the corpus
+    is tokenized by num_proc processes and the result published atomically,
+    so an interrupted run never leaves a half-written entry behind.
+
+    Args:
+        dataset: A datasets Dataset with a "text" column
+        tokenizer: The tokenizer
+        max_length: Truncation length
+        num_proc: Tokenization processes on a cache miss (default: one per CPU)
+        cache_dir: Cache directory (default: DEFAULT_CACHE_DIR)
+        padding: The padding strategy passed to the tokenizer; by default
+            examples are left unpadded and batches are padded by the collator
+
+    Returns:
+        The tokenized Dataset (input_ids, token_type_ids, attention_mask, length)
+    """
+    from datasets import load_from_disk
+
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    num_proc = num_proc or os.cpu_count() or 1
+
+    entry = os.path.join(cache_dir, cache_key(corpus_fingerprint(dataset), tokenizer, max_length, padding))
+    if os.path.isdir(entry):
+        print(f"Loading tokenized dataset from cache: {entry}")
+        return load_from_disk(entry)
+
+    print(f"Tokenizing dataset with {num_proc} processes...")
+
+    def tokenize_function(examples):
+        # "length" (tokens per example) lets the Trainer group batches by length without re-reading the data
+        return tokenizer(examples["text"], padding=padding, truncation=True, max_length=max_length, return_length=True)
+
+    tokenized = dataset.map(
+        tokenize_function,
+        batched=True,
+        num_proc=num_proc if num_proc > 1 and len(dataset) > num_proc else None,
+        remove_columns=dataset.column_names
+    )
+
+    # Written under a temporary name, then renamed into place
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_entry = f"{entry}.tmp-{uuid.uuid4().hex}"
+    try:
+        tokenized.save_to_disk(temp_entry, num_proc=num_proc if num_proc > 1 and len(tokenized) > num_proc else None)
+        os.rename(temp_entry, entry)
+        print(f"Saved tokenized dataset to cache: {entry}")
+    except OSError as e:
+        # Another run published the same entry first, or the cache is not writable
+        print(f"Warning: Could not save tokenized dataset to cache: {e}")
+    finally:
+        shutil.rmtree(temp_entry, ignore_errors=True)
+
+    return load_from_disk(entry) if os.path.isdir(entry) else tokenized
@@ -0,0 +1,303 @@
+import csv
+import json
+import os
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from transformers import TrainerCallback
+
+# File names of the report written next to the model
+METRICS_CSV = "training_metrics.csv"
+METRICS_JSON = "training_metrics.json"
+
+# Columns of training_metrics.csv, one row per logging step
+CSV_FIELDS = [
+    "step", "epoch", "loss", "samples", "tokens", "samples_per_second", "tokens_per_second",
+    "real_token_fraction", "dataloader_fraction", "step_ms_p50", "step_ms_p90", "step_ms_p99",
+    "peak_rss_mb", "checkpoint_seconds",
+]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process so far, in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class InstrumentedCollator:
+    """
+    Wrap a data collator to count the samples and tokens it produces and the time it takes
+
+    Token counts exclude padding: they come from the attention mask, or from
+    the pad token id when the mask is three-dimensional (packed blocks). The
+    counters are only seen by the training process when batches are collated
+    in it, i.e. with dataloader_num_workers=0 (the default).
+    """
+
+    def __init__(self, collator, pad_token_id: int = 0):
+        self.collator = collator
+        self.pad_token_id = pad_token_id
+        self.samples = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.seconds = 0.0
+
+    def __call__(self, features):
+        start_time = time.perf_counter()
+        batch = self.collator(features)
+        input_ids = batch["input_ids"]
+        mask = batch.get("attention_mask")
+        real = mask.sum() if mask is not None and mask.dim() == 2 else (input_ids != self.pad_token_id).sum()
+        self.samples += input_ids.shape[0]
+        self.tokens += int(real)
+        self.padded_tokens += input_ids.numel()
+        self.seconds += time.perf_counter() - start_time
+        return batch
+
+    def snapshot(self):
+        return self.samples, self.tokens, self.padded_tokens, self.seconds
+
+    def rewind(self, snapshot):
+        """Forget the batches collated since snapshot, e.g. evaluation batches"""
+        self.samples, self.tokens, self.padded_tokens, self.seconds = snapshot
+
+
+class TrainingMetricsCallback(TrainerCallback):
+    """
+    Record training throughput and resource use at every logging step
+
+    Each row covers the steps since the previous one: samples/s and (real)
+    tokens/s, the fraction of wall time spent waiting for batches, step time
+    percentiles, peak RSS and the time spent writing checkpoints. Evaluation
+    and checkpoint time are not counted as step or dataloader time.
+
+    Batches are counted by the InstrumentedCollator given to the Trainer. The
+    time between the end of a step (or of logging, evaluation and saving) and
+    the start of the next is the time spent fetching its first batch; the
+    collation of later gradient accumulation micro-batches is counted too,
+    and taken out of the step time, so step and dataloader time never overlap.
+    """
+
+    def __init__(self, collator: InstrumentedCollator):
+        self.collator = collator
+        self.rows: List[Dict[str, Any]] = []
+        self.summary: Dict[str, Any] = {}
+
+        self._last_event = None
+        self._step_start = None
+        self._collate_at_step_start = 0.0
+        self._counts_at_step_end = None
+        self._train_start = None
+        self._reset_window()
+        self._step_times: List[float] = []
+        self._dataloader_seconds = 0.0
+        self._checkpoint_seconds: List[float] = []
+
+    def _reset_window(self):
+        self._window = {
+            "samples": self.collator.samples,
+            "tokens": self.collator.tokens,
+            "padded_tokens": self.collator.padded_tokens,
+            "step_times": [],
+            "dataloader_seconds": 0.0,
+            "checkpoint_seconds": 0.0,
+        }
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self._train_start = self._last_event = time.perf_counter()
+        self._reset_window()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        waited = now - self._last_event
+        self._window["dataloader_seconds"] += waited
+        self._dataloader_seconds += waited
+        self._step_start = now
+        self._collate_at_step_start = self.collator.seconds
+
+    def on_step_end(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        # Micro-batches collated inside the step count as dataloader time, not step time
+        collate_inside = self.collator.seconds - self._collate_at_step_start
+        self._window["dataloader_seconds"] += collate_inside
+        self._dataloader_seconds += collate_inside
+
+        step_time = max(0.0, now - self._step_start - collate_inside)
+        self._window["step_times"].append(step_time)
+        self._step_times.append(step_time)
+        self._counts_at_step_end = self.collator.snapshot()
+        self._last_event = now
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        # Evaluation runs between the end of a step and the fetch of the next
+        # training batch, so everything collated since then was evaluation data
+        if self._counts_at_step_end is not None:
+            self.collator.rewind(self._counts_at_step_end)
+        self._last_event = time.perf_counter()
+
+    def on_save(self, args, state, control, **kwargs):
+        # on_save runs right after the checkpoint was written
+        self.record_checkpoint(time.perf_counter() - self._last_event)
+
+    def record_checkpoint(self, seconds: float):
+        """Count time the training loop spent on a checkpoint, e.g. one written outside the Trainer"""
+        self._window["checkpoint_seconds"] += seconds
+        self._checkpoint_seconds.append(seconds)
+        self._last_event = time.perf_counter()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        now = time.perf_counter()
+        window = self._window
+        step_times = window["step_times"]
+        # Training logs carry "loss"; evaluation and end-of-training logs do not end a window
+        if step_times and "loss" in (logs or {}):
+            busy = sum(step_times) + window["dataloader_seconds"]
+            samples = self.collator.samples - window["samples"]
+            tokens = self.collator.tokens - window["tokens"]
+            padded = self.collator.padded_tokens - window["padded_tokens"]
+            row = {
+                "step": state.global_step,
+                "epoch": round(state.epoch or 0.0, 3),
+                "loss": logs["loss"],
+                "samples": samples,
+                "tokens": tokens,
+                "samples_per_second": round(samples / busy, 2) if busy else 0.0,
+                "tokens_per_second": round(tokens / busy, 1) if busy else 0.0,
+                "real_token_fraction": round(tokens / padded, 4) if padded else 0.0,
+                "dataloader_fraction": round(window["dataloader_seconds"] / busy, 4) if busy else 0.0,
+                "step_ms_p50": round(1000 * percentile(step_times, 50), 1),
+                "step_ms_p90": round(1000 * percentile(step_times, 90), 1),
+                "step_ms_p99": round(1000 * percentile(step_times, 99), 1),
+                "peak_rss_mb": peak_rss_mb(),
+                "checkpoint_seconds": round(window["checkpoint_seconds"], 3),
+            }
+            self.rows.append(row)
+            print(f"[metrics] step {row['step']}: {row['samples_per_second']} samples/s, {row['tokens_per_second']} tokens/s, "
+                  f"dataloader {row['dataloader_fraction']:.1%}, step p50 {row['step_ms_p50']} ms, "
+                  f"peak RSS {row['peak_rss_mb']} MiB")
+            self._reset_window()
+        self._last_event = now
+
+    def on_train_end(self, args, state, control, **kwargs):
+        wall = time.perf_counter() - self._train_start
+        busy = sum(self._step_times) + self._dataloader_seconds
+        self.summary = {
+            "steps": state.global_step,
+            "wall_seconds": round(wall, 2),
+            "samples": self.collator.samples,
+            "tokens": self.collator.tokens,
+            "samples_per_second": round(self.collator.samples / busy, 2) if busy else 0.0,
+            "tokens_per_second": round(self.collator.tokens / busy, 1) if busy else 0.0,
+            "real_token_fraction": round(self.collator.tokens / self.collator.padded_tokens, 4) if self.collator.padded_tokens else 0.0,
+            "dataloader_fraction": round(self._dataloader_seconds / busy, 4) if busy else 0.0,
+            "step_ms_p50": round(1000 * percentile(self._step_times, 50), 1) if self._step_times else 0.0,
+            "step_ms_p90": round(1000 * percentile(self._step_times, 90), 1) if self._step_times else 0.0,
+            "step_ms_p99": round(1000 * percentile(self._step_times, 99), 1) if self._step_times else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+            "checkpoints": len(self._checkpoint_seconds),
+            "checkpoint_seconds": round(sum(self._checkpoint_seconds), 2),
+            "batch_size": args.per_device_train_batch_size,
+            "gradient_accumulation_steps": args.gradient_accumulation_steps,
+        }
+        print_metrics_summary(self.summary)
+
+    def save(self, directory: str, extra: Optional[Dict[str, Any]] = None,
+             baseline: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Write training_metrics.csv (the per-step rows) and training_metrics.json (summary and rows)
+
+        Args:
+            directory: Where to write, normally next to the saved model
+            extra: More entries for the JSON report, e.g. the run configuration
+            baseline: Summary of a default-configuration run on the same data (see
+                load_baseline); the report then includes the speedup against it
+
+        Returns:
+            Path of the JSON report
+        """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, METRICS_CSV), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+        report = {**(extra or {}), "summary": self.summary}
+        if baseline:
+            report["speedup"] = compare_to_baseline(self.summary, baseline)
+            print_speedup(report["speedup"])
+        report["steps"] = self.rows
+
+        report_path = os.path.join(directory, METRICS_JSON)
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Training metrics written to {report_path}")
+        return report_path
+
+
+def print_metrics_summary(summary: Dict[str, Any]):
+    """Print the end-of-run summary of a TrainingMetricsCallback"""
+    print(f"Training summary: {summary['steps']} steps in {summary['wall_seconds']}s")
+    print(f"  throughput: {summary['samples_per_second']} samples/s, {summary['tokens_per_second']} tokens/s "
+          f"({summary['real_token_fraction']:.1%} of tokens are real)")
+    print(f"  time waiting for data: {summary['dataloader_fraction']:.1%}")
+    print(f"  step time: p50 {summary['step_ms_p50']} ms, p90 {summary['step_ms_p90']} ms, p99 {summary['step_ms_p99']} ms")
+    print(f"  peak RSS: {summary['peak_rss_mb']} MiB")
+    print(f"  checkpoints: {summary['checkpoints']} written in {summary['checkpoint_seconds']}s")
+
+
+def load_baseline(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read the summary of a default-configuration run from its training_metrics.json
+
+    Args:
+        path: The report, e.g. the one an earlier run left next to the model
+
+    Returns:
+        The summary, or None if there is no such report or it comes from a
+        run with another profile (such as --cpu-optimized)
+    """
+    try:
+        with open(path) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if report.get("config", {}).get("profile", "default") != "default" or not report.get("summary"):
+        return None
+    return report["summary"]
+
+
+def compare_to_baseline(summary: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Speedup of a run over a baseline run: ratios above 1 mean this run was faster
+
+    peak_rss is this run's peak memory relative to the baseline's.
+
+    Throughput is compared per sample and per token, since the two runs may
+    take different numbers of (differently sized) optimizer steps.
+    """
+    def ratio(numerator, denominator):
+        return round(numerator / denominator, 2) if numerator and denominator else None
+
+    return {
+        "samples_per_second": ratio(summary["samples_per_second"], baseline["samples_per_second"]),
+        "tokens_per_second": ratio(summary["tokens_per_second"], baseline["tokens_per_second"]),
+        "wall_time": ratio(baseline["wall_seconds"], summary["wall_seconds"]),
+        "peak_rss": ratio(summary["peak_rss_mb"], baseline["peak_rss_mb"]),
+        "baseline": {key: baseline.get(key) for key in ("samples_per_second", "tokens_per_second", "wall_seconds", "peak_rss_mb")},
+    }
+
+
+def print_speedup(speedup: Dict[str, Any]):
+    """Print a compare_to_baseline result"""
+    print(f"Against the default configuration: {speedup['samples_per_second']}x samples/s, "
+          f"{speedup['tokens_per_second']}x tokens/s, {speedup['wall_time']}x less wall time, "
+          f"{speedup['peak_rss']}x the peak RSS")
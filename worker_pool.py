@@ -0,0 +1,110 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class PoolSaturatedError(Exception):
+    """Raised when a pool's queue is full and the job is rejected"""
+
+
+class BoundedWorkerPool:
+    """Run CPU-bound functions off the event loop with a bounded queue
+
+    At most max_workers jobs run at once and at most queue_limit more wait
+    for a worker; further submissions fail fast with PoolSaturatedError
+    instead of piling up.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, queue_limit: int = 16, kind: str = "process"):
+        """Initialize the pool (the executor itself is created on first use)
+
+        Args:
+            max_workers: Number of workers, defaults to the number of CPUs
+            queue_limit: Number of jobs allowed to wait for a free worker
+            kind: "process" for a process pool, "thread" for a thread pool, or
+                "inline" to run jobs directly on the event loop (for benchmarks only)
+        """
+        if kind not in ("process", "thread", "inline"):
+            raise ValueError(f"Unknown worker pool kind: {kind}")
+
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue_limit = queue_limit
+        self.kind = kind
+        self._executor: Optional[Executor] = None
+
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # "spawn" keeps the workers free of the server's threads and event loop state
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="worker-pool")
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any, wait: bool = False) -> Any:
+        """Run fn(*args) in the pool and wait for its result
+
+        Args:
+            fn: A picklable (module-level) function
+            *args: Picklable arguments
+            wait: Queue the job even if the queue is full. Used for follow-up jobs
+                of a request that was already admitted, so it is not cut off halfway.
+
+        Returns:
+            The function's return value
+
+        Raises:
+            PoolSaturatedError: If all workers are busy and the queue is full
+        """
+        if not wait and self.active >= self.max_workers + self.queue_limit:
+            self.rejected += 1
+            raise PoolSaturatedError(f"Worker pool is full ({self.active} jobs running or queued)")
+
+        self.active += 1
+        start_time = time.perf_counter()
+        try:
+            if self.kind == "inline":
+                result = fn(*args)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._get_executor(), fn, *args)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            self.total_seconds += time.perf_counter() - start_time
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pool counters for the metrics endpoint"""
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "queue_limit": self.queue_limit,
+            "active": self.active,
+            "queued": max(0, self.active - self.max_workers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "busy_seconds": round(self.total_seconds, 3),
+        }
+
+    def shutdown(self):
+        """Stop the workers"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None